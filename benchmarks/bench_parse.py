@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# merkletree/benchmarks/bench_parse.py
+
+"""
+Compare the regular expression parser for non-first lines,
+MerkleTree.parse_other_line(), with the regex-free parser used by
+create_from_stream(), MerkleTree.parse_other_line_fast(), over a
+synthetic serialization.  Run from the top of the source tree:
+
+    PYTHONPATH=src benchmarks/bench_parse.py -n 500000
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from xlattice import HashTypes
+
+from merkletree import MerkleTree, get_hash_func
+
+
+def make_listing(count, hashtype):
+    """
+    Return a list of count lines serializing a synthetic tree with up
+    to 64 entries per directory, the first line being the root's.
+    """
+    len_hash = len(get_hash_func(hashtype).digest())
+    lines = ['%s root/' % ('0' * (2 * len_hash))]
+    depth = 1
+    for ndx in range(count - 1):
+        hex_hash = os.urandom(len_hash).hex()
+        if ndx % 64 == 0:
+            lines.append('%s%s dir%06d/' % (' ' * depth, hex_hash, ndx))
+            depth = depth % 6 + 1
+        else:
+            lines.append('%s%s file-%06d.dat' % (' ' * depth, hex_hash, ndx))
+    return lines
+
+
+def best_of(repeats, func, *args):
+    """ Return the shortest of repeats timings of func(*args). """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def regex_parse(lines):
+    """ Parse lines as create_from_string_array() used to. """
+    parse = MerkleTree.parse_other_line
+    for line in lines:
+        parse(line)
+
+
+def fast_parse(lines, len_hash):
+    """ Parse lines as create_from_stream() now does. """
+    parse = MerkleTree.parse_other_line_fast
+    for line in lines:
+        parse(line, len_hash)
+
+
+def main():
+    """ Collect command line arguments and run the comparison. """
+
+    parser = ArgumentParser(description='time serialization line parsers')
+    parser.add_argument('-n', '--lines', default=200000, type=int,
+                        help='number of lines in listing (default=200000)')
+    parser.add_argument('-r', '--repeats', default=5, type=int,
+                        help='best of this many runs (default=5)')
+    args = parser.parse_args()
+
+    for hashtype in [HashTypes.SHA1, HashTypes.SHA2]:
+        lines = make_listing(args.lines, hashtype)
+        len_hash = len(get_hash_func(hashtype).digest())
+        others = lines[1:]
+
+        t_regex = best_of(args.repeats, regex_parse, others)
+        t_fast = best_of(args.repeats, fast_parse, others, len_hash)
+        print("%-5s lines: regex %8.0f/s  fast %8.0f/s  speedup %.2fx" % (
+            hashtype.name, len(others) / t_regex, len(others) / t_fast,
+            t_regex / t_fast))
+
+        t_build = best_of(args.repeats, MerkleTree.create_from_stream,
+                          lines, hashtype)
+        print("%-5s create_from_stream: %8.0f lines/s" % (
+            hashtype.name, len(lines) / t_build))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
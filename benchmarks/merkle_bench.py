@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# merkletree/benchmarks/merkle_bench.py
+
+"""
+Time building, serializing, parsing and comparing MerkleTrees over
+synthetic directory trees, recording the best time and the peak memory
+allocated for each operation, shape and hash type as JSON.  Run from
+the top of the source tree:
+
+    PYTHONPATH=src benchmarks/merkle_bench.py -o before.json
+    ... change something ...
+    PYTHONPATH=src benchmarks/merkle_bench.py -o after.json
+    PYTHONPATH=src benchmarks/merkle_bench.py --compare before.json after.json
+
+Trees are generated from a seeded random number generator, so the same
+arguments always produce the same trees.  The comparison exits with 1
+if any timing or peak has grown by more than the threshold.
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from xlattice import HashTypes
+
+from merkletree import __version__, MerkleTree
+
+# name: (depth, subdirectories per directory, files per directory,
+#        smallest file, largest file, size distribution)
+SHAPES = {
+    'tiny': (3, 6, 40, 0, 512, 'uniform'),
+    'mixed': (4, 4, 12, 0, 256 * 1024, 'log'),
+    'deep': (12, 1, 4, 0, 4096, 'uniform'),
+    'wide': (1, 1, 4000, 0, 1024, 'uniform'),
+    'huge': (1, 0, 3, 32 * 1024 * 1024, 32 * 1024 * 1024, 'fixed'),
+}
+
+OPERATIONS = ['create_from_file_system', 'to_string',
+              'create_from_serialization', '__eq__']
+
+
+def file_size(rng, min_size, max_size, dist):
+    """ Return a file size drawn from the distribution. """
+    if dist == 'fixed' or min_size >= max_size:
+        return max_size
+    if dist == 'log':
+        # sizes spread evenly over orders of magnitude
+        return min(max_size, int(
+            (min_size + 1) * ((max_size + 1) / (min_size + 1)) **
+            rng.random()) - 1)
+    return rng.randint(min_size, max_size)
+
+
+def make_tree(path, shape, seed):
+    """
+    Create the directory tree for a shape at path, returning the number
+    of files and of bytes written.
+    """
+    (depth, width, files, min_size, max_size, dist) = shape
+    rng = random.Random(seed)
+    file_count = byte_count = 0
+    stack = [(path, depth)]
+    while stack:
+        (dir_path, level) = stack.pop()
+        os.makedirs(dir_path)
+        for ndx in range(files):
+            size = file_size(rng, min_size, max_size, dist)
+            with open(os.path.join(dir_path, 'f%05d' % ndx), 'wb') as file:
+                file.write(rng.getrandbits(8 * size).to_bytes(size, 'little')
+                           if size else b'')
+            file_count += 1
+            byte_count += size
+        if level > 1:
+            for ndx in range(width):
+                stack.append((os.path.join(dir_path, 'd%03d' % ndx),
+                              level - 1))
+    return (file_count, byte_count)
+
+
+def measure(repeats, func, *args):
+    """
+    Return the result of func(*args), the shortest of repeats timings,
+    and the peak memory allocated during one further traced call.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (result, best, peak)
+
+
+def run_shape(path, repeats, hashtypes):
+    """ Time each operation on the tree at path for each hash type. """
+    results = {}
+    for hashtype in hashtypes:
+        (tree, secs, peak) = measure(
+            repeats, MerkleTree.create_from_file_system, path, hashtype)
+        results[(hashtype.name, OPERATIONS[0])] = (secs, peak)
+        (text, secs, peak) = measure(repeats, tree.to_string)
+        results[(hashtype.name, OPERATIONS[1])] = (secs, peak)
+        (tree2, secs, peak) = measure(
+            repeats, MerkleTree.create_from_serialization, text, hashtype)
+        results[(hashtype.name, OPERATIONS[2])] = (secs, peak)
+        (equal, secs, peak) = measure(repeats, tree.__eq__, tree2)
+        if not equal:
+            raise RuntimeError("round trip changed the %s tree" %
+                               hashtype.name)
+        results[(hashtype.name, OPERATIONS[3])] = (secs, peak)
+    return results
+
+
+def run(args):
+    """ Generate the trees, run the benchmarks, and write the JSON. """
+    shapes = {}
+    for name in args.shapes:
+        if name not in SHAPES:
+            print("unknown shape '%s'; choose from %s" % (
+                name, ', '.join(sorted(SHAPES))))
+            return 2
+        shapes[name] = SHAPES[name]
+    if args.custom:
+        (depth, width, files, min_size, max_size) = args.custom
+        shapes['custom'] = (depth, width, files, min_size, max_size,
+                            args.dist)
+    hashtypes = [HashTypes[name] for name in args.hashtypes] \
+        if args.hashtypes else list(HashTypes)
+
+    data_dir = tempfile.mkdtemp(prefix='merkle_bench-', dir=args.data_dir)
+    report = {
+        'meta': {
+            'merkletree': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'repeats': args.repeats,
+            'seed': args.seed,
+        },
+        'shapes': {},
+        'results': {},
+    }
+    try:
+        for (name, shape) in sorted(shapes.items()):
+            path = os.path.join(data_dir, name)
+            (files, size) = make_tree(path, shape, args.seed)
+            report['shapes'][name] = {
+                'depth': shape[0], 'width': shape[1], 'files_per_dir':
+                shape[2], 'min_size': shape[3], 'max_size': shape[4],
+                'dist': shape[5], 'files': files, 'bytes': size}
+            for ((hashtype, op), (secs, peak)) in sorted(
+                    run_shape(path, args.repeats, hashtypes).items()):
+                key = '%s/%s/%s' % (name, hashtype, op)
+                report['results'][key] = {'seconds': secs,
+                                          'peak_bytes': peak}
+                if args.verbose:
+                    print("%-48s %10.4f s %12d B" % (key, secs, peak))
+    finally:
+        if args.keep:
+            print("trees kept in %s" % data_dir)
+        else:
+            shutil.rmtree(data_dir)
+
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.out_file:
+        with open(args.out_file, 'w', encoding='utf-8') as file:
+            file.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+def compare(old_file, new_file, threshold):
+    """
+    Print the ratio new/old of each measurement present in both runs,
+    flagging those above 1 + threshold; return 1 if there are any.
+    """
+    with open(old_file, encoding='utf-8') as file:
+        old = json.load(file)['results']
+    with open(new_file, encoding='utf-8') as file:
+        new = json.load(file)['results']
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        flags = []
+        ratios = []
+        for (field, label) in [('seconds', 'time'), ('peak_bytes', 'peak')]:
+            before = old[key][field]
+            after = new[key][field]
+            ratio = after / before if before else 1.0
+            ratios.append(ratio)
+            if ratio > 1 + threshold:
+                flags.append(label)
+        regressions += bool(flags)
+        print(("%-48s time %6.2fx  peak %6.2fx  %s" % (
+            key, ratios[0], ratios[1],
+            'REGRESSION: ' + ', '.join(flags) if flags else '')).rstrip())
+    for key in sorted(set(old) ^ set(new)):
+        print("%-48s only in %s" % (key, old_file if key in old
+                                    else new_file))
+    print("%d regression(s) beyond %.0f%%" % (regressions, 100 * threshold))
+    return 1 if regressions else 0
+
+
+def main():
+    """ Collect command line arguments and run or compare benchmarks. """
+
+    parser = ArgumentParser(description='benchmark merkletree operations')
+    parser.add_argument('-C', '--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two JSON result files')
+    parser.add_argument('-c', '--custom', nargs=5, type=int,
+                        metavar=('DEPTH', 'WIDTH', 'FILES', 'MIN', 'MAX'),
+                        help='also run a custom shape')
+    parser.add_argument('-D', '--dist', default='uniform',
+                        choices=['uniform', 'log', 'fixed'],
+                        help='file size distribution of the custom shape')
+    parser.add_argument('-d', '--data_dir',
+                        help='make the trees under this directory')
+    parser.add_argument('-H', '--hashtypes', action='append',
+                        choices=[h.name for h in HashTypes],
+                        help='hash types to run (default=all)')
+    parser.add_argument('-k', '--keep', action='store_true',
+                        help='keep the generated trees')
+    parser.add_argument('-o', '--out_file',
+                        help='write JSON here (default=stdout)')
+    parser.add_argument('-r', '--repeats', default=3, type=int,
+                        help='best of this many runs (default=3)')
+    parser.add_argument('-S', '--seed', default=42, type=int,
+                        help='random seed for the trees (default=42)')
+    parser.add_argument('-s', '--shapes', nargs='+',
+                        default=['tiny', 'mixed', 'deep', 'wide'],
+                        help='shapes to run, from %s (default=all but huge)'
+                        % ', '.join(sorted(SHAPES)))
+    parser.add_argument('-t', '--threshold', default=0.10, type=float,
+                        help='regression threshold (default=0.10)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print results as they are measured')
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
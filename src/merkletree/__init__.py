@@ -7,11 +7,19 @@ contents.  If it is a tree or a document, it is the hash of the hashes
 of its immediate children.
 """
 
+import asyncio
 import binascii
+import io
+import mmap
 import os
 import re
+import struct
 import sys
-from stat import S_ISDIR
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from xlattice import(SHA1_BIN_LEN, SHA1_BIN_NONE, SHA1_HEX_NONE,
                      SHA2_BIN_LEN, SHA2_BIN_NONE, SHA2_HEX_NONE,
@@ -22,16 +30,22 @@ from xlattice import(SHA1_BIN_LEN, SHA1_BIN_NONE, SHA1_HEX_NONE,
 from xlutil import make_ex_re, make_match_re
 from xlcrypto import SP   # for getSpaces()
 from xlcrypto.hash import XLSHA1, XLSHA2, XLSHA3, XLBLAKE2B_256
-from xlu import(file_sha1bin, file_sha2bin, file_sha3bin, file_blake2b_256_bin)
 
 __all__ = ['__version__', '__version_date__',
            # BELONGS IN xlattice_py:
            'get_hash_func',
+           # functions
+           'file_hash_bin', 'file_hash_chunked', 'check_chunk_bits',
+           'verify_proof', 'verify_multiproof',
+           # for reading and writing the binary serializations
+           'bin_hash_len', 'bin_chunk_bits', 'binary_header',
+           'read_binary_header', 'varint', 'read_varint', 'new_leaf',
            # classes
-           'MerkleDoc', 'MerkleLeaf', 'MerkleTree', 'MerkleParseError', ]
+           'ChunkedMerkleLeaf', 'MerkleDoc', 'MerkleLeaf', 'MerkleTree',
+           'MerkleParseError', ]
 
-__version__ = '5.4.0'
-__version_date__ = '2018-07-26'
+__version__ = '5.5.0'
+__version_date__ = '2026-10-18'
 
 # -------------------------------------------------------------------
 
@@ -57,18 +71,443 @@ def get_hash_func(hashtype):
     return sha
 
 
+# files are read into a reusable buffer of this size
+READ_BUF_SIZE = 64 * 1024
+
+_READ_BUFS = threading.local()
+
+# blocking calls in flight at once in an asynchronous build by default
+ASYNC_WORKERS = 8
+
+# files may be hashed in chunks of 2**chunk_bits bytes, within these limits
+MIN_CHUNK_BITS = 12
+MAX_CHUNK_BITS = 40
+DEFAULT_CHUNK_BITS = 26                 # 64 MiB
+CHUNK_READ_SIZE = 1024 * 1024           # each pread() in a chunk
+CHUNK_HASH_PREFIX = b'MRKC'
+
+
+def file_hash_bin(path_to_file, hashtype=HashTypes.SHA2):
+    """
+    Return the binary hash of the contents of the file at path_to_file.
+
+    The file is read with readinto() into a buffer which each thread
+    allocates once and then reuses, so the data is not copied and the
+    digest is never converted to hex.  Files are not mapped into memory:
+    a mapped file truncated by another process, as one being watched
+    may be, kills the interpreter with SIGBUS.  Raises OSError if the
+    file cannot be read.
+    """
+    return _file_hash_bin(path_to_file, hashtype)[0]
+
+
+def _file_hash_bin(path_to_file, hashtype):
+    """
+    Do the work of file_hash_bin(), returning the hash and the number of
+    bytes read.
+    """
+    sha = get_hash_func(hashtype)
+    size = 0
+    view = getattr(_READ_BUFS, 'view', None)
+    if view is None:
+        view = _READ_BUFS.view = memoryview(bytearray(READ_BUF_SIZE))
+    with open(path_to_file, 'rb', buffering=0) as file:
+        while True:
+            count = file.readinto(view)
+            if count:
+                sha.update(view[:count])
+                size += count
+            # a short read on a regular file means end of file
+            if count < READ_BUF_SIZE:
+                break
+    return (bytes(sha.digest()), size)
+
+
+def check_chunk_bits(chunk_bits):
+    """ Raise RuntimeError if chunk_bits is not a permitted chunk size. """
+    if not isinstance(chunk_bits, int) or \
+            not MIN_CHUNK_BITS <= chunk_bits <= MAX_CHUNK_BITS:
+        raise RuntimeError("chunk_bits must be from %d to %d, not %r" % (
+            MIN_CHUNK_BITS, MAX_CHUNK_BITS, chunk_bits))
+
+
+def file_hash_chunked(path_to_file, hashtype=HashTypes.SHA2,
+                      chunk_bits=DEFAULT_CHUNK_BITS, pool=None):
+    """
+    Return the chunked binary hash of the contents of the file at
+    path_to_file.  The file is read with os.pread() in chunks of
+    2**chunk_bits bytes, by the threads of pool if it is an Executor,
+    and each chunk is hashed separately.  The chunk hashes are combined
+    pairwise, level by level, an odd hash out being carried up to the
+    next level, and the hash returned is that of CHUNK_HASH_PREFIX, the
+    chunk_bits as one byte, the file length as eight bytes little-endian
+    and the top hash.  So the result depends on chunk_bits and cannot
+    be confused with file_hash_bin() of any file.  Raises OSError if the
+    file cannot be read.
+    """
+    return _file_hash_chunked(path_to_file, hashtype, chunk_bits, pool)[0]
+
+
+def _hash_chunk(fd_, offset, length, hashtype):
+    """ Return the hash of length bytes at offset in the open file. """
+    sha = get_hash_func(hashtype)
+    end = offset + length
+    while offset < end:
+        data = os.pread(fd_, min(CHUNK_READ_SIZE, end - offset), offset)
+        if not data:
+            break
+        sha.update(data)
+        offset += len(data)
+    return bytes(sha.digest())
+
+
+def _file_hash_chunked(path_to_file, hashtype, chunk_bits, pool=None):
+    """
+    Do the work of file_hash_chunked(), returning the hash and the number
+    of bytes in the file.
+    """
+    check_chunk_bits(chunk_bits)
+    chunk_size = 1 << chunk_bits
+    fd_ = os.open(path_to_file, os.O_RDONLY)
+    try:
+        size = os.fstat(fd_).st_size
+        # an empty file has one empty chunk
+        offsets = range(0, size or 1, chunk_size)
+        if pool is None:
+            hashes = [_hash_chunk(fd_, offset, chunk_size, hashtype)
+                      for offset in offsets]
+        else:
+            hashes = list(pool.map(
+                lambda offset: _hash_chunk(fd_, offset, chunk_size, hashtype),
+                offsets))
+    finally:
+        os.close(fd_)
+    while len(hashes) > 1:
+        pairs = []
+        for ndx in range(0, len(hashes) - 1, 2):
+            sha = get_hash_func(hashtype)
+            sha.update(hashes[ndx])
+            sha.update(hashes[ndx + 1])
+            pairs.append(bytes(sha.digest()))
+        if len(hashes) % 2:
+            pairs.append(hashes[-1])
+        hashes = pairs
+    sha = get_hash_func(hashtype)
+    sha.update(CHUNK_HASH_PREFIX + struct.pack('<BQ', chunk_bits, size))
+    sha.update(hashes[0])
+    return (bytes(sha.digest()), size)
+
+
+def verify_proof(root_hash, path, leaf_hash, proof, hashtype=HashTypes.SHA2,
+                 doc_path=None):
+    """
+    Given a proof returned by MerkleTree.prove(path), return whether it
+    shows that a node with the hash leaf_hash is part of the tree whose
+    hash is root_hash or, if doc_path is not None, part of the MerkleDoc
+    with that path whose hash is root_hash.
+
+    Each level of the proof is a pair of lists, the hashes of the
+    siblings before and after the node at that level, so the hash of its
+    parent is recomputed exactly as create_from_file_system() computes
+    it.  Names are not hashed, so the path itself is not proven; it is
+    only checked to be as deep as the proof.
+    """
+    names = [name for name in path.split('/') if name]
+    if leaf_hash is None or len(names) != len(proof):
+        return False
+    hash_ = leaf_hash
+    for (before, after) in proof:
+        sha = get_hash_func(hashtype)
+        for sibling in before:
+            sha.update(sibling)
+        sha.update(hash_)
+        for sibling in after:
+            sha.update(sibling)
+        hash_ = sha.digest()
+    if doc_path is not None:
+        doc_path = doc_path.strip()
+        if not doc_path.endswith('/'):
+            doc_path += '/'
+        sha = get_hash_func(hashtype)
+        sha.update(hash_)
+        sha.update(doc_path.encode('utf-8'))
+        hash_ = sha.digest()
+    return bytes(hash_) == bytes(root_hash)
+
+
+def verify_multiproof(root_hash, hashes, proof, hashtype=HashTypes.SHA2,
+                      doc_path=None):
+    """
+    Given a proof returned by MerkleTree.prove_many() and a dictionary
+    mapping each of the paths proven to the hash claimed for it, return
+    whether the proof shows that all of them are part of the tree whose
+    hash is root_hash, or of the MerkleDoc with that hash and doc_path.
+
+    The proof is consumed in a single pass, each directory's hash being
+    completed as soon as the last of its children has been seen.  As
+    with verify_proof(), names are not hashed, so what is proven is that
+    the hashes are found where the proof places them.
+    """
+    hashes = {'/'.join(name for name in path.split('/') if name): hash_
+              for (path, hash_) in hashes.items()}
+    unused = set(hashes)
+    stack = []                  # [hash object, children to come, path]
+    result = None
+
+    def child_path(name):
+        """ Return the path of the named child of the open directory. """
+        if not stack:
+            return ''                   # the top directory
+        parent = stack[-1][2]
+        return parent + '/' + name if parent else name
+
+    try:
+        for token in proof:
+            if result is not None:
+                return False            # tokens after the top is complete
+            kind = token[0]
+            if kind == 'D':
+                (_, name, count) = token
+                if count < 1:
+                    return False
+                path = child_path(name)
+                stack.append([get_hash_func(hashtype), count, path])
+                continue
+            if kind == 'H':
+                hash_ = token[1]
+            elif kind == 'L':
+                path = child_path(token[1])
+                hash_ = hashes.get(path)
+                if hash_ is None:
+                    return False
+                unused.discard(path)
+            else:
+                return False
+            # pass the hash up, completing any directories it finishes
+            while stack:
+                frame = stack[-1]
+                frame[0].update(hash_)
+                frame[1] -= 1
+                if frame[1]:
+                    break
+                stack.pop()
+                hash_ = bytes(frame[0].digest())
+                if frame[2] in hashes:
+                    if hashes[frame[2]] != hash_:
+                        return False
+                    unused.discard(frame[2])
+            if not stack:
+                result = hash_
+    except (IndexError, TypeError, ValueError):
+        return False                    # malformed tokens
+    if result is None or unused:
+        return False
+    return verify_proof(root_hash, '', result, [], hashtype, doc_path)
+
+
 class MerkleParseError(RuntimeError):
     """ Class for MerkleTree/Doc parse errors. """
     pass
 
 
+# -------------------------------------------------------------------
+# BINARY SERIALIZATION
+#
+# A header (magic, version, hashtype, kind); for a MerkleDoc, its raw
+# hash and length-prefixed path; then the nodes of the tree in preorder.
+# Each node is a flags byte, its length-prefixed UTF-8 name, its raw
+# hash if it has one, and for a directory the count of its children.
+# Lengths and counts are unsigned LEB128 varints.
+
+BINARY_MAGIC = b'MRKL'
+BINARY_VERSION = 1
+BIN_KIND_TREE = 0
+BIN_KIND_DOC = 1
+BIN_FLAG_DIR = 0x01
+BIN_FLAG_HASH = 0x02
+# the chunk_bits of a chunked leaf, zero for any other node
+BIN_CHUNK_SHIFT = 2
+BIN_CHUNK_MASK = 0xfc
+BIN_FLAGS = BIN_FLAG_DIR | BIN_FLAG_HASH | BIN_CHUNK_MASK  # all understood
+
+
+def bin_hash_len(hashtype):
+    """ Return the length in bytes of a binary hash of the type. """
+    if hashtype == HashTypes.SHA1:
+        return SHA1_BIN_LEN
+    elif hashtype == HashTypes.SHA2:
+        return SHA2_BIN_LEN
+    elif hashtype == HashTypes.SHA3:
+        return SHA3_BIN_LEN
+    elif hashtype == HashTypes.BLAKE2B_256:
+        return BLAKE2B_256_BIN_LEN
+    raise NotImplementedError
+
+
+def varint(value):
+    """ Encode a non-negative integer as an unsigned LEB128 varint. """
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def read_varint(view, offset):
+    """
+    Decode the varint at offset in view, returning its value and the
+    offset of the next byte.  Raises IndexError if view is truncated.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = view[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value, offset)
+        shift += 7
+
+
+def binary_header(hashtype, kind):
+    """ Return the header of a binary serialization. """
+    return BINARY_MAGIC + bytes([BINARY_VERSION, int(hashtype), kind, 0])
+
+
+def read_binary_header(view, kind):
+    """
+    Check the header at the start of view, returning the hashtype and
+    the offset of the byte following the header.
+    """
+    if len(view) < 8 or bytes(view[0:4]) != BINARY_MAGIC:
+        raise MerkleParseError("not a binary merkletree serialization")
+    if view[4] != BINARY_VERSION:
+        raise MerkleParseError(
+            "unsupported binary serialization version %d" % view[4])
+    try:
+        hashtype = HashTypes(view[5])
+    except ValueError:
+        raise MerkleParseError("unknown hashtype %d" % view[5]) from None
+    if view[6] != kind:
+        raise MerkleParseError(
+            "binary serialization is of kind %d, expected %d" % (
+                view[6], kind))
+    return (hashtype, 8)
+
+
+def new_leaf(name, hashtype, hash_, chunk_bits=0):
+    """ Return a ChunkedMerkleLeaf if chunk_bits, else a MerkleLeaf. """
+    if chunk_bits:
+        return ChunkedMerkleLeaf(name, hashtype, hash_, chunk_bits)
+    return MerkleLeaf(name, hashtype, hash_)
+
+
+def _listed_hash(hash_):
+    """
+    Return the hash of a directory read from a text listing, in which
+    an empty directory, having no hash, is shown with one of zeroes.
+    """
+    return hash_ if any(hash_) else None
+
+
+def bin_chunk_bits(flags, name):
+    """
+    Return the chunk_bits held in a node's binary flags, raising
+    MerkleParseError unless they are zero or those of a chunked leaf.
+    """
+    chunk_bits = flags >> BIN_CHUNK_SHIFT
+    if chunk_bits and (flags & BIN_FLAG_DIR or not flags & BIN_FLAG_HASH or
+                       not MIN_CHUNK_BITS <= chunk_bits <= MAX_CHUNK_BITS):
+        raise MerkleParseError("bad chunked leaf %s" % name)
+    return chunk_bits
+
+
+def _write_binary_nodes(tree, write):
+    """
+    Write the binary serialization of tree and everything below it,
+    in preorder, using write().
+    """
+    hash_len = bin_hash_len(tree.hashtype)
+    stack = [iter([tree])]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            continue
+        name = node.name.encode('utf-8')
+        hash_ = node.bin_hash
+        flags = node.chunk_bits << BIN_CHUNK_SHIFT if node.is_leaf \
+            else BIN_FLAG_DIR
+        if hash_:
+            if len(hash_) != hash_len:
+                raise RuntimeError("hash of %s has length %d, not %d" % (
+                    node.name, len(hash_), hash_len))
+            flags |= BIN_FLAG_HASH
+        parts = [bytes([flags]), varint(len(name)), name]
+        if hash_:
+            parts.append(hash_)
+        if not node.is_leaf:
+            parts.append(varint(len(node.nodes)))
+            stack.append(iter(node.nodes))
+        write(b''.join(parts))
+
+
+def _read_binary_nodes(view, offset, hashtype):
+    """
+    Rebuild the MerkleTree whose binary serialization starts at offset
+    in view, returning it and the offset of the byte following it.
+    """
+    hash_len = bin_hash_len(hashtype)
+    stack = []                  # [tree, count of children still to come]
+    root = None
+    try:
+        while True:
+            flags = view[offset]
+            if flags & ~BIN_FLAGS:
+                raise MerkleParseError("unknown flags 0x%02x at offset %d" % (
+                    flags, offset))
+            (name_len, offset) = read_varint(view, offset + 1)
+            name = str(view[offset:offset + name_len], 'utf-8')
+            offset += name_len
+            hash_ = None
+            if flags & BIN_FLAG_HASH:
+                hash_ = bytes(view[offset:offset + hash_len])
+                offset += hash_len
+                if len(hash_) != hash_len:
+                    raise IndexError
+            count = 0
+            chunk_bits = bin_chunk_bits(flags, name)
+            if flags & BIN_FLAG_DIR:
+                node = MerkleTree(name, hashtype)
+                node.bin_hash = hash_
+                (count, offset) = read_varint(view, offset)
+            else:
+                node = new_leaf(name, hashtype, hash_, chunk_bits)
+            if stack:
+                stack[-1][0].nodes.append(node)
+                stack[-1][1] -= 1
+            elif node.is_leaf:
+                raise MerkleParseError("binary serialization has no tree")
+            else:
+                root = node
+            if count:
+                stack.append([node, count])
+            while stack and stack[-1][1] == 0:
+                stack.pop()
+            if not stack:
+                return (root, offset)
+    except IndexError:
+        raise MerkleParseError("binary serialization is truncated") from None
+
+
 class MerkleNode(object):
     """
     Abstract class to which all Nodes in a MerkleDoc or MerkleTree
     belong.
     """
 
-    # __slots__ = [ A PERFORMANCE ENHANCER ]
+    __slots__ = ['_bin_hash', '_hashtype', '_is_leaf', '_name', ]
 
     def __init__(self, name, is_leaf=False, hashtype=HashTypes.SHA2):
         check_hashtype(hashtype)
@@ -87,7 +526,8 @@ class MerkleNode(object):
         """
         Return the hash associated with the MerkleNode as a hex value.
         """
-        if self._bin_hash is None:
+        bin_hash = self.bin_hash
+        if bin_hash is None:
             if self._hashtype == HashTypes.SHA1:
                 return SHA1_HEX_NONE
             elif self._hashtype == HashTypes.SHA2:
@@ -99,7 +539,7 @@ class MerkleNode(object):
             else:
                 raise NotImplementedError
         else:
-            return str(binascii.b2a_hex(self._bin_hash), 'ascii')
+            return str(binascii.b2a_hex(bin_hash), 'ascii')
 
     @hex_hash.setter
     def hex_hash(self, value):
@@ -159,8 +599,7 @@ class MerkleDoc(MerkleNode):
     The path to a tree, and the SHA hash of the path and the treehash.
     """
 
-    __slots__ = ['_bound', '_ex_re', '_match_re', '_path',
-                 '_tree', '_hashtype', ]
+    __slots__ = ['_bound', '_ex_re', '_match_re', '_path', '_tree', ]
 
     # notice the terminating forward slash and lack of newlines or CR-LF
     # THIS PATTERN WON"T CATCH SOME ERRORS; eg it permits '///' in paths
@@ -262,16 +701,88 @@ class MerkleDoc(MerkleNode):
     def hashtype(self):
         return self._hashtype
 
+    def prove(self, path):
+        """
+        Return a proof that the node at path, relative to the top of the
+        MerkleDoc's tree, is part of it.  It is verified by passing the
+        MerkleDoc's hash and path to verify_proof().
+        """
+        return self._tree.prove(path)
+
+    def prove_many(self, paths):
+        """
+        Return a single proof that the nodes at all of the paths are
+        part of the MerkleDoc's tree; see MerkleTree.prove_many().
+        """
+        return self._tree.prove_many(paths)
+
+    def verify_against_file_system(self, path_to_dir, workers=None,
+                                   fail_fast=False, cache=None):
+        """
+        Generate a merkletree.diff.MerkleChange for each difference
+        between the MerkleDoc's tree and the directory at path_to_dir;
+        see MerkleTree.verify_against_file_system().
+        """
+        return self._tree.verify_against_file_system(
+            path_to_dir, workers, fail_fast, cache=cache)
+
     # QUASI-CONSTRUCTORS ############################################
     @staticmethod
     def create_from_file_system(path_to_dir, hashtype=HashTypes.SHA2,
-                                exclusions=None, matches=None):
+                                exclusions=None, matches=None, workers=None,
+                                cache=None, stats=None, chunk_bits=None,
+                                processes=None):
         """
         Create a MerkleDoc based on the information in the directory
         at pathToDir.  The name of the directory will be the last component
         of pathToDir.  Return the MerkleTree.
+
+        If workers is more than one, files are hashed by a pool of that
+        many threads; cache is an optional LeafHashCache, stats an
+        optional BuildStats, and if chunk_bits is set large files are
+        hashed in chunks.  If processes is more than one, the tree is
+        built by that many processes.  See
+        MerkleTree.create_from_file_system().
+        """
+        check_hashtype(hashtype)
+        (path, ex_re, match_re) = MerkleDoc._build_args(
+            path_to_dir, exclusions, matches)
+        tree = MerkleTree.create_from_file_system(path_to_dir, hashtype,
+                                                  ex_re, match_re, workers,
+                                                  cache, stats, chunk_bits,
+                                                  processes)
+        # creates the hash
+        doc = MerkleDoc(path, hashtype, False, tree, ex_re, match_re)
+        doc.bound = True
+        return doc
+
+    @staticmethod
+    async def async_create_from_file_system(
+            path_to_dir, hashtype=HashTypes.SHA2, exclusions=None,
+            matches=None, workers=None, cache=None, stats=None,
+            executor=None, chunk_bits=None):
+        """
+        Coroutine which creates the same MerkleDoc as
+        create_from_file_system() without blocking the event loop.  See
+        MerkleTree.async_create_from_file_system().
         """
         check_hashtype(hashtype)
+        (path, ex_re, match_re) = MerkleDoc._build_args(
+            path_to_dir, exclusions, matches)
+        tree = await MerkleTree.async_create_from_file_system(
+            path_to_dir, hashtype, ex_re, match_re, workers, cache, stats,
+            executor, chunk_bits)
+        # creates the hash
+        doc = MerkleDoc(path, hashtype, False, tree, ex_re, match_re)
+        doc.bound = True
+        return doc
+
+    @staticmethod
+    def _build_args(path_to_dir, exclusions, matches):
+        """
+        Check path_to_dir and compile the exclusion and match patterns,
+        returning the doc's path and the two regular expressions.
+        """
         if not path_to_dir:
             raise RuntimeError("cannot create a MerkleTree, no path set")
         if not os.path.exists(path_to_dir):
@@ -287,12 +798,7 @@ class MerkleDoc(MerkleNode):
         match_re = None
         if matches:
             match_re = make_match_re(matches)
-        tree = MerkleTree.create_from_file_system(path_to_dir, hashtype,
-                                                  ex_re, match_re)
-        # creates the hash
-        doc = MerkleDoc(path, hashtype, False, tree, ex_re, match_re)
-        doc.bound = True
-        return doc
+        return (path, ex_re, match_re)
 
     @staticmethod
     def create_from_serialization(string, hashtype=HashTypes.SHA2):
@@ -318,9 +824,27 @@ class MerkleDoc(MerkleNode):
         # XXX check TYPE - must be array of strings
         if not string:
             raise RuntimeError("empty string array")
+        return MerkleDoc.create_from_stream(string, hashtype)
+
+    @staticmethod
+    def create_from_stream(lines, hashtype=HashTypes.SHA2):
+        """
+        Create a MerkleDoc from its serialization, taking lines one at
+        a time from a file object or any other iterable of strings.
+        See MerkleTree.create_from_stream().
+        """
+        check_hashtype(hashtype)
+        if lines is None:
+            raise RuntimeError('null argument')
+        lines = iter(lines)
+        first_line = next(lines, None)
+        if first_line is None:
+            raise RuntimeError("empty string array")
+        if isinstance(first_line, bytes):
+            first_line = str(first_line, 'utf-8')
 
         (doc_hash, doc_path) =\
-            MerkleDoc.parse_first_line(string[0].rstrip())
+            MerkleDoc.parse_first_line(first_line.rstrip())
         len_hash = len(doc_hash)
         if len_hash == SHA1_BIN_LEN:
             if hashtype != HashTypes.SHA1:
@@ -337,7 +861,7 @@ class MerkleDoc(MerkleNode):
         # print("    usingSHA=%s" % str(usingSHA))
         # END
 
-        tree = MerkleTree.create_from_string_array(string[1:], hashtype)
+        tree = MerkleTree._create_from_stream(lines, hashtype, 2)
 
         # def __init__ (self, path, binding = False, tree = None,
         #    exRE    = None,    # exclusions, which are Regular Expressions
@@ -424,14 +948,72 @@ class MerkleDoc(MerkleNode):
     def __str__(self):
         return self.to_string()
 
+    def iter_lines(self, indent=0):
+        """
+        Generate the serialization of the MerkleDoc one line at a time.
+        indent applies to the tree, not to the first line.
+        """
+        yield "%s %s\n" % (self.hex_hash, self.path)
+        yield from self._tree.iter_lines(indent)
+
+    def write_to(self, file, indent=0):
+        """
+        Write the serialization of the MerkleDoc to a file object
+        without building it in memory.
+        """
+        write = file.write
+        for line in self.iter_lines(indent):
+            write(line)
+
     # XXX indent is not used
     def to_string(self, indent=0):
         """ Convert MerkleDoc to string form. """
+        return ''.join(self.iter_lines(indent))
+
+    def write_binary(self, file):
+        """
+        Write the binary serialization of the MerkleDoc to a file object
+        opened in binary mode.
+        """
+        path = self._path.encode('utf-8')
+        file.write(b''.join([binary_header(self._hashtype, BIN_KIND_DOC),
+                             self._bin_hash, varint(len(path)), path]))
+        _write_binary_nodes(self._tree, file.write)
+
+    def to_bytes(self):
+        """ Return the binary serialization of the MerkleDoc. """
+        buf = io.BytesIO()
+        self.write_binary(buf)
+        return buf.getvalue()
 
-        return ''.join([
-            "%s %s\n" % (self.hex_hash, self.path),
-            self._tree.to_string(indent)
-        ])
+    @staticmethod
+    def create_from_binary(data):
+        """
+        Create a MerkleDoc from its binary serialization, given either as
+        a bytes-like object or as a file object opened in binary mode.
+        The hash type is taken from the serialization, and the document
+        hash recorded there must match that of the path and tree.
+        """
+        if hasattr(data, 'read'):
+            data = data.read()
+        view = memoryview(data)
+        (hashtype, offset) = read_binary_header(view, BIN_KIND_DOC)
+        hash_len = bin_hash_len(hashtype)
+        try:
+            doc_hash = bytes(view[offset:offset + hash_len])
+            (path_len, offset) = read_varint(view, offset + hash_len)
+            path = str(view[offset:offset + path_len], 'utf-8')
+        except IndexError:
+            raise MerkleParseError(
+                "binary serialization is truncated") from None
+        (tree, offset) = _read_binary_nodes(view, offset + path_len, hashtype)
+        if offset != len(view):
+            raise MerkleParseError(
+                "%d bytes follow binary serialization" % (len(view) - offset))
+        doc = MerkleDoc(path, hashtype=hashtype, tree=tree)
+        if doc.bin_hash != doc_hash:
+            raise MerkleParseError("MerkleDoc hash does not match its tree")
+        return doc
 
 # -------------------------------------------------------------------
 
@@ -439,19 +1021,11 @@ class MerkleDoc(MerkleNode):
 class MerkleLeaf(MerkleNode):
     """ Leaf form of MerkleNode. """
 
-    __slots__ = ['_name', '_hashtype', ]
+    __slots__ = []
 
     def __init__(self, name, hashtype=HashTypes.SHA1, hash_=None):
         super().__init__(name, is_leaf=True, hashtype=hashtype)
 
-        # JUNK
-        if name is None:
-            raise RuntimeError("MerkleLeaf: null MerkleLeaf name")
-        self._name = name.strip()
-        if not self._name:
-            raise RuntimeError("MerkleLeaf: null or empty name")
-        # END JUNK
-
         # XXX VERIFY HASH IS WELL-FORMED
         if hash_:
             self._bin_hash = hash_
@@ -463,19 +1037,41 @@ class MerkleLeaf(MerkleNode):
     def __eq__(self, other):
         return isinstance(other, MerkleLeaf) and \
             self._name == other.name and \
-            self._bin_hash == other.bin_hash
+            self._bin_hash == other.bin_hash and \
+            self.chunk_bits == other.chunk_bits
 
     def __str__(self):
         return self.to_string(0)        # that is, no indent
 
     # OTHER METHODS AND PROPERTIES ##################################
 
+    @property
+    def chunk_bits(self):
+        """ Zero: the hash is that of the whole file. """
+        return 0
+
     @staticmethod
-    def create_from_file_system(path_to_file, name, hashtype=HashTypes.SHA2):
+    def create_from_file_system(path_to_file, name, hashtype=HashTypes.SHA2,
+                                cache=None, stats=None, chunk_bits=None,
+                                pool=None):
         """
         Returns a MerkleLeaf.  The name is part of pathToFile, but is
         passed to simplify the code.
+
+        If a LeafHashCache is supplied, the hash is taken from it when
+        the file's stat() key still matches, and stored in it otherwise.
+        If a BuildStats is supplied, the file, the bytes read and the
+        time taken are recorded in it.
+
+        If chunk_bits is set and the file is longer than 2**chunk_bits
+        bytes, it is hashed by file_hash_chunked(), using the threads of
+        pool if there is one, and a ChunkedMerkleLeaf is returned.  The
+        cache is not used for such files.
         """
+        if stats is not None:
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+
         def report_io_error(exc):
             """ Report an I/O error to stdout. """
             print("error reading file %s: %s" % (
@@ -483,36 +1079,80 @@ class MerkleLeaf(MerkleNode):
 
         if not os.path.exists(path_to_file):
             print(("INTERNAL ERROR: file does not exist: " + path_to_file))
-        # XXX we convert from binary to hex and then right back to binary !!
         if hashtype == HashTypes.SHA1:
-            try:
-                hash_ = file_sha1bin(path_to_file)
-            except OSError as exc:
-                report_io_error(exc)
-                hash_ = SHA1_BIN_NONE
+            none_hash = SHA1_BIN_NONE
         elif hashtype == HashTypes.SHA2:
-            try:
-                hash_ = file_sha2bin(path_to_file)
-            except OSError as exc:
-                report_io_error(exc)
-                hash_ = SHA2_BIN_NONE
+            none_hash = SHA2_BIN_NONE
         elif hashtype == HashTypes.SHA3:
-            try:
-                hash_ = file_sha3bin(path_to_file)
-            except OSError as exc:
-                report_io_error(exc)
-                hash_ = SHA3_BIN_NONE
+            none_hash = SHA3_BIN_NONE
         elif hashtype == HashTypes.BLAKE2B_256:
-            try:
-                hash_ = file_blake2b_256_bin(path_to_file)
-            except OSError as exc:
-                report_io_error(exc)
-                hash_ = BLAKE2B_256_BIN_NONE
+            none_hash = BLAKE2B_256_BIN_NONE
         else:
             raise NotImplementedError
 
+        if chunk_bits:
+            try:
+                chunked = os.path.getsize(path_to_file) > 1 << chunk_bits
+            except OSError:
+                chunked = False         # reported when we try to read it
+            if chunked:
+                return MerkleLeaf._create_chunked(
+                    path_to_file, name, hashtype, stats, chunk_bits, pool,
+                    none_hash)
+
+        stat_ = None
+        if cache is not None:
+            try:
+                # stat BEFORE reading, so that a file changed while it is
+                # being hashed looks stale on the next run
+                stat_ = os.stat(path_to_file)
+            except OSError:
+                pass                    # reported when we try to read it
+            else:
+                hash_ = cache.get(stat_, hashtype)
+                if hash_:
+                    if stats is not None:
+                        stats.add_file(path_to_file, 0,
+                                       time.perf_counter() - wall,
+                                       time.thread_time() - cpu, True)
+                    return MerkleLeaf(name, hashtype, hash_)
+
+        try:
+            (hash_, size) = _file_hash_bin(path_to_file, hashtype)
+        except OSError as exc:
+            report_io_error(exc)
+            if stats is not None:
+                stats.add_error()
+            return MerkleLeaf(name, hashtype, none_hash)
+        if stat_ is not None:
+            cache.put(stat_, hashtype, hash_)
+        if stats is not None:
+            stats.add_file(path_to_file, size, time.perf_counter() - wall,
+                           time.thread_time() - cpu)
         return MerkleLeaf(name, hashtype, hash_)
 
+    @staticmethod
+    def _create_chunked(path_to_file, name, hashtype, stats, chunk_bits,
+                        pool, none_hash):
+        """ Return a ChunkedMerkleLeaf for the file at path_to_file. """
+        if stats is not None:
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+        try:
+            (hash_, size) = _file_hash_chunked(path_to_file, hashtype,
+                                               chunk_bits, pool)
+        except OSError as exc:
+            print("error reading file %s: %s" % (path_to_file, exc),
+                  file=sys.stderr)
+            if stats is not None:
+                stats.add_error()
+            return MerkleLeaf(name, hashtype, none_hash)
+        if stats is not None:
+            # the CPU time of other threads reading chunks is not seen
+            stats.add_file(path_to_file, size, time.perf_counter() - wall,
+                           time.thread_time() - cpu)
+        return ChunkedMerkleLeaf(name, hashtype, hash_, chunk_bits)
+
     def to_string(self, indent=0):
         """ Serialize MerkleLeaf as string . """
         if self._bin_hash is None:
@@ -528,6 +1168,8 @@ class MerkleLeaf(MerkleNode):
                 raise NotImplementedError
         else:
             hash_ = self.hex_hash
+        if self.chunk_bits:
+            hash_ += '*%d' % self.chunk_bits
         string = "%s%s %s\n" % (SP.get_spaces(indent), hash_, self.name)
         return string
 
@@ -557,26 +1199,57 @@ class MerkleLeaf(MerkleNode):
     #         raise RuntimeError('invalid SHA hash len')
     #     return MerkleLeaf(name, hash, usingSHA)
 
+
+class ChunkedMerkleLeaf(MerkleLeaf):
+    """
+    A MerkleLeaf whose hash was computed by file_hash_chunked() in
+    chunks of 2**chunk_bits bytes.  In the text serialization the hash
+    is followed by an asterisk and chunk_bits in decimal, and in the
+    binary serialization chunk_bits is kept in the node's flags, so
+    that the hash can be checked the way it was made.
+    """
+
+    __slots__ = ['_chunk_bits', ]
+
+    def __init__(self, name, hashtype=HashTypes.SHA2, hash_=None,
+                 chunk_bits=DEFAULT_CHUNK_BITS):
+        super().__init__(name, hashtype, hash_)
+        check_chunk_bits(chunk_bits)
+        self._chunk_bits = chunk_bits
+
+    @property
+    def chunk_bits(self):
+        """ The log base 2 of the size of the chunks hashed. """
+        return self._chunk_bits
+
 # -------------------------------------------------------------------
 
 
 class MerkleTree(MerkleNode):
     """ Tree subclass of MerkleNode. """
 
-    __slots__ = ['_bound', '_name', '_ex_re', '_bin_hash', '_match_re',
-                 '_nodes', '_hashtype', ]
+    __slots__ = ['_bound', '_dirty', '_ex_re', '_match_re', '_nodes',
+                 '_index', '_names', '_source', ]
 
     # notice the terminating forward slash and lack of newlines or CR-LF
     FIRST_LINE_RE_1 = re.compile(
         r'^( *)([0-9a-f]{40}) ([a-z0-9_\-\.:]+/)$', re.IGNORECASE)
     OTHER_LINE_RE_1 = re.compile(
-        r'^([ XYZ]*)([0-9a-f]{40}) ([a-z0-9_\$\+\-\.:~]+/?)$', re.IGNORECASE)
+        r'^([ XYZ]*)([0-9a-f]{40})(?:\*[0-9]+)? ([a-z0-9_\$\+\-\.:~]+/?)$',
+        re.IGNORECASE)
     FIRST_LINE_RE_2 = re.compile(
         r'^( *)([0-9a-f]{64}) ([a-z0-9_\-\.:]+/)$', re.IGNORECASE)
     OTHER_LINE_RE_2 = re.compile(
-        r'^([ XYZ]*)([0-9a-f]{64}) ([a-z0-9_\$\+\-\.:_]+/?)$',
+        r'^([ XYZ]*)([0-9a-f]{64})(?:\*[0-9]+)? ([a-z0-9_\$\+\-\.:_]+/?)$',
         re.IGNORECASE)
 
+    # what the OTHER_LINE_REs permit, for use without regular expressions
+    OTHER_LINE_INDENT = ' XYZ'
+    _NAME_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ' +\
+        '0123456789_$+-.:'
+    OTHER_NAME_CHARS_1 = _NAME_CHARS + '~'
+    OTHER_NAME_CHARS_2 = _NAME_CHARS
+
     #################################################################
     # exRE and matchRE must have been validated by the calling code
     #################################################################
@@ -589,6 +1262,10 @@ class MerkleTree(MerkleNode):
         self._ex_re = ex_re
         self._match_re = match_re
         self._nodes = []
+        self._index = None      # child name -> child node
+        self._names = None      # names of the nodes, in order
+        self._source = None     # where unparsed nodes are; see create_lazy()
+        self._dirty = False     # hash out of date; see upsert_leaf()
 
     # IMPLEMENTATIONS OF ABSTRACT METHODS ###########################
 
@@ -623,6 +1300,30 @@ class MerkleTree(MerkleNode):
     def hashtype(self):
         return self._hashtype
 
+    @property
+    def bin_hash(self):
+        """
+        Return the hash of the MerkleTree as a binary value, first
+        recomputing it if the tree has been changed since it was last
+        computed.
+        """
+        self.rehash()
+        return self._bin_hash
+
+    @bin_hash.setter
+    def bin_hash(self, value):
+        if self._bin_hash:
+            raise RuntimeError('attempt to set non-null hash')
+        self._bin_hash = value
+
+    @property
+    def dirty(self):
+        """
+        Whether the tree has been changed since its hash was last
+        computed; see upsert_leaf().
+        """
+        return self._dirty
+
     #################################################################
     # METHODS LIFTED FROM bindmgr/bindlib/MerkleTree.py
     #################################################################
@@ -645,7 +1346,10 @@ class MerkleTree(MerkleNode):
 
     @staticmethod
     def parse_other_line(line):
-        """ Parse a non-first line. """
+        """
+        Parse a non-first line.  The chunk size marking a chunked leaf's
+        hash is accepted but not returned.
+        """
         match_ = re.match(MerkleTree.OTHER_LINE_RE_1, line)
         if match_ is None:
             match_ = re.match(MerkleTree.OTHER_LINE_RE_2, line)
@@ -663,6 +1367,70 @@ class MerkleTree(MerkleNode):
             is_dir = False
         return (node_depth, node_hash, node_name, is_dir)
 
+    @staticmethod
+    def parse_other_line_fast(line, len_hash):
+        """
+        Parse a non-first line exactly as parse_other_line() does but
+        without regular expressions, given the length in bytes of the
+        hashes, which create_from_stream() learns from the first line.
+        The line must already have been rstripped.  Raises
+        MerkleParseError if the line is malformed.
+        """
+        return MerkleTree.parse_other_line_full(line, len_hash)[:4]
+
+    @staticmethod
+    def parse_other_line_full(line, len_hash):
+        """
+        Parse a non-first line as parse_other_line_fast() does, returning
+        (depth, hash, name, is_dir, chunk_bits), where chunk_bits is zero
+        unless the line is that of a ChunkedMerkleLeaf.
+        """
+        body = line.lstrip(MerkleTree.OTHER_LINE_INDENT)
+        hex_len = len_hash + len_hash
+        name_start = hex_len + 1
+        chunk_bits = 0
+        marker = body[hex_len:hex_len + 1]
+        if marker == '*':
+            name_start = body.find(' ', hex_len) + 1
+            digits = body[hex_len + 1:name_start - 1]
+            if name_start and digits and not digits.strip('0123456789'):
+                chunk_bits = int(digits)
+            if not MIN_CHUNK_BITS <= chunk_bits <= MAX_CHUNK_BITS:
+                raise MerkleParseError(
+                    "MerkleTree other line <%s> has bad chunk size" % line)
+        elif marker != ' ':
+            raise MerkleParseError(
+                "MerkleTree other line <%s> does not match expected pattern" %
+                line)
+        node_name = body[name_start:]
+        if node_name.endswith('/'):
+            if chunk_bits:
+                raise MerkleParseError(
+                    "MerkleTree other line <%s> has a chunked directory" %
+                    line)
+            node_name = node_name[:-1]
+            is_dir = True
+        else:
+            is_dir = False
+        if len_hash == SHA1_BIN_LEN:
+            name_chars = MerkleTree.OTHER_NAME_CHARS_1
+        else:
+            name_chars = MerkleTree.OTHER_NAME_CHARS_2
+        # stripping every permitted character must leave nothing
+        if not node_name or node_name.strip(name_chars):
+            raise MerkleParseError(
+                "MerkleTree other line <%s> has bad name" % line)
+        try:
+            node_hash = bytes.fromhex(body[:hex_len])
+        except ValueError:
+            node_hash = None
+        # fromhex() skips whitespace, so a short hash may slip through
+        if node_hash is None or len(node_hash) != len_hash:
+            raise MerkleParseError(
+                "MerkleTree other line <%s> has bad hash" % line)
+        return (len(line) - len(body), node_hash, node_name, is_dir,
+                chunk_bits)
+
     @staticmethod
     def create_from_string_array(strings, hashtype=HashTypes.SHA2):
         """
@@ -674,8 +1442,38 @@ class MerkleTree(MerkleNode):
         # XXX should check TYPE - must be array of strings
         if not strings:
             raise RuntimeError("empty strings array")
+        return MerkleTree.create_from_stream(strings, hashtype)
+
+    @staticmethod
+    def create_from_stream(lines, hashtype=HashTypes.SHA2):
+        """
+        Create a MerkleTree from its serialization, taking lines one
+        at a time from a file object or any other iterable of strings
+        (or of UTF-8 encoded bytes).  The lines are not retained, so
+        the peak memory needed is essentially that of the tree itself.
+        The same indentation rules as create_from_string_array() apply.
+
+        The hash width is fixed by the first line and the rest are
+        parsed without regular expressions.  Malformed lines raise a
+        MerkleParseError giving the line number.
+        """
+        return MerkleTree._create_from_stream(lines, hashtype, 1)
+
+    @staticmethod
+    def _create_from_stream(lines, hashtype, first_line_no):
+        """
+        Do the work of create_from_stream(), where first_line_no is the
+        number of the tree's first line in the input.
+        """
+        lines = iter(lines)
+        first_line = next(lines, None)
+        if first_line is None:
+            raise RuntimeError("empty strings array")
+        if isinstance(first_line, bytes):
+            first_line = str(first_line, 'utf-8')
+            lines = (str(line, 'utf-8') for line in lines)
         (indent, tree_hash, dir_name) =\
-            MerkleTree.parse_first_line(strings[0].rstrip())
+            MerkleTree.parse_first_line(first_line.rstrip())
         len_hash = len(tree_hash)
         if len_hash == SHA1_BIN_LEN:
             if hashtype != HashTypes.SHA1:
@@ -686,7 +1484,7 @@ class MerkleTree(MerkleNode):
                 len_hash, hashtype))
 
         root_tree = MerkleTree(dir_name, hashtype)    # an empty tree
-        root_tree.bin_hash = tree_hash
+        root_tree.bin_hash = _listed_hash(tree_hash)
 
         if indent != 0:
             print(("INTERNAL ERROR: initial line indent %d" % indent))
@@ -697,13 +1495,17 @@ class MerkleTree(MerkleNode):
         stack.append(cur_tree)           # rootTree
         stk_depth += 1                  # always step after pushing tree
 
-        for ndx in range(1, len(strings)):
-            line = strings[ndx].rstrip()
+        parse = MerkleTree.parse_other_line_full
+        for line_no, line in enumerate(lines, first_line_no + 1):
+            line = line.rstrip()
             if not line:
                 continue
-            # XXX SHOULD/COULD CHECK THAT HASHES ARE OF THE RIGHT TYPE
-            line_indent, hash_, name, is_dir = MerkleTree.parse_other_line(
-                line)
+            try:
+                line_indent, hash_, name, is_dir, chunk_bits = parse(
+                    line, len_hash)
+            except MerkleParseError as exc:
+                raise MerkleParseError("line %d: %s" % (line_no, exc)) \
+                    from None
             if line_indent < stk_depth:
                 while line_indent < stk_depth:
                     stk_depth -= 1
@@ -715,7 +1517,7 @@ class MerkleTree(MerkleNode):
             if is_dir:
                 # create and set attributes of new node
                 new_tree = MerkleTree(name, hashtype)  # , curTree)
-                new_tree.bin_hash = hash_
+                new_tree.bin_hash = _listed_hash(hash_)
                 # add the new node into the existing tree
                 cur_tree.add_node(new_tree)
                 stack.append(new_tree)
@@ -723,7 +1525,7 @@ class MerkleTree(MerkleNode):
                 cur_tree = new_tree
             else:
                 # create and set attributes of new node
-                new_node = MerkleLeaf(name, hashtype, hash_)
+                new_node = new_leaf(name, hashtype, hash_, chunk_bits)
                 # add the new node into the existing tree
                 cur_tree.add_node(new_node)
         return root_tree
@@ -742,28 +1544,201 @@ class MerkleTree(MerkleNode):
         return MerkleTree.create_from_string_array(s_array, hashtype)
 
     @staticmethod
-    def create_from_file(path_to_file, hashtype=HashTypes.SHA2):
+    def create_from_file(path_to_file, hashtype=HashTypes.SHA2, lazy=False):
         """
         Create a MerkleTree by parsing its on-disk serialization,
         given the SHA hash type used to create the MerkleTree.
+
+        If lazy is True, the file is mapped into memory and parsed only
+        as the tree is explored; see create_lazy().
         """
         if not os.path.exists(path_to_file):
             raise RuntimeError(
                 "MerkleTree.createFromFile: file '%s' does not exist" %
                 path_to_file)
-        with open(path_to_file, 'r') as file:
-            text = file.read()
-        return MerkleTree.create_from_serialization(text, hashtype)
+        if lazy:
+            with open(path_to_file, 'rb') as file:
+                # the map keeps its own reference to the file
+                if os.fstat(file.fileno()).st_size == 0:
+                    raise RuntimeError("empty strings array")
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            return MerkleTree.create_lazy(data, hashtype)
+        with open(path_to_file, 'r', encoding='utf-8') as file:
+            return MerkleTree.create_from_stream(file, hashtype)
+
+    # by depth, matches a LF and the indentation of a line at that depth
+    _CHILD_LINE_RES = {}
+
+    @staticmethod
+    def create_lazy(data, hashtype=HashTypes.SHA2):
+        """
+        Create a MerkleTree from its serialization, given as bytes, a
+        bytearray or an mmap, parsing only the first line.  Each
+        MerkleTree records just the range of the data holding the lines
+        below it, and these are parsed into MerkleTrees and MerkleLeafs
+        the first time its nodes are needed.  The root hash
+        or a single subtree can then be had without parsing the rest.
+
+        Since lines are not checked until they are parsed, errors in them
+        are reported, by offset in the data, when they are reached.
+        """
+        check_hashtype(hashtype)
+        end = data.find(b'\n')
+        if end < 0:
+            end = len(data)
+        (_, tree_hash, dir_name) = MerkleTree.parse_first_line(
+            str(data[:end], 'utf-8').rstrip())
+        len_hash = len(tree_hash)
+        if len_hash != bin_hash_len(hashtype):
+            raise RuntimeError("hash length %d inconsistent with %s" % (
+                len_hash, hashtype))
+        root = MerkleTree(dir_name, hashtype)
+        root.bin_hash = _listed_hash(tree_hash)
+        if end + 1 < len(data):
+            root._source = (data, end + 1, len(data), 1, len_hash)
+        return root
+
+    def _load_nodes(self):
+        """
+        Parse the lines recorded by create_lazy() into this MerkleTree's
+        nodes: those indented to the depth of its children, each of the
+        subtrees below them being left unparsed in turn.
+        """
+        (data, start, end, depth, len_hash) = self._source
+        child_re = MerkleTree._CHILD_LINE_RES.get(depth)
+        if child_re is None:
+            child_re = MerkleTree._CHILD_LINE_RES[depth] = re.compile(
+                b'\n[ XYZ]{%d}(?=[0-9a-fA-F])' % depth)
+        # start follows a LF, and each match begins with the LF
+        starts = [match_.start() + 1
+                  for match_ in child_re.finditer(data, start - 1, end)]
+        if data[start:starts[0] if starts else end].strip():
+            raise MerkleParseError("offset %d: badly indented line" % start)
+        hashtype = self._hashtype
+        nodes = []
+        for ndx, line_start in enumerate(starts):
+            line_end = data.find(b'\n', line_start, end)
+            if line_end < 0:
+                line_end = end
+            try:
+                (_, hash_, name, is_dir, chunk_bits) = \
+                    MerkleTree.parse_other_line_full(
+                        str(data[line_start:line_end], 'utf-8').rstrip(),
+                        len_hash)
+            except (MerkleParseError, UnicodeDecodeError) as exc:
+                raise MerkleParseError("offset %d: %s" % (line_start, exc)) \
+                    from None
+            if is_dir:
+                node = MerkleTree(name, hashtype)
+                node.bin_hash = _listed_hash(hash_)
+                sub_end = starts[ndx + 1] if ndx + 1 < len(starts) else end
+                if line_end + 1 < sub_end:
+                    node._source = (data, line_end + 1, sub_end, depth + 1,
+                                    len_hash)
+            else:
+                node = new_leaf(name, hashtype, hash_, chunk_bits)
+            nodes.append(node)
+        self._nodes = nodes
+        self._index = self._names = None
+        self._source = None
 
     @staticmethod
     def create_from_file_system(path_to_dir, hashtype=HashTypes.SHA2,
-                                ex_re=None, match_re=None):
+                                ex_re=None, match_re=None, workers=None,
+                                cache=None, stats=None, chunk_bits=None,
+                                processes=None):
         """
         Create a MerkleTree based on the information in the directory
         at pathToDir.  The name of the directory will be the last component
         of pathToDir.  Return the MerkleTree.
+
+        If workers is more than one, leaf hashing is handed to a pool of
+        that many threads while the directory walk runs ahead of it.
+        Directory hashes are computed once all of their leaves are in,
+        so the tree is identical to the one built serially.
+
+        If cache is a merkletree.cache.LeafHashCache, files whose stat()
+        key is unchanged since they were cached are not reread.
+
+        If stats is a merkletree.stats.BuildStats, counts and timings
+        are collected in it: the whole as the phase 'build', directory
+        reads as 'scan', file hashing as 'hash', and the computation of
+        directory hashes, including waiting for workers, as 'settle'.
+
+        If chunk_bits is set, files longer than 2**chunk_bits bytes are
+        hashed in chunks of that size by a separate pool of threads, as
+        many as workers or else one per CPU, and appear in the tree as
+        ChunkedMerkleLeafs.  See file_hash_chunked().
+
+        If processes is more than one, the tree is built in shares by
+        that many worker processes instead of threads, and workers is
+        ignored.  No cache can be used.  See
+        merkletree.sharded.create_sharded().
         """
+        if stats is not None:
+            with stats.phase('build'):
+                return MerkleTree._create_from_file_system(
+                    path_to_dir, hashtype, ex_re, match_re, workers, cache,
+                    stats, chunk_bits, processes)
+        return MerkleTree._create_from_file_system(
+            path_to_dir, hashtype, ex_re, match_re, workers, cache,
+            chunk_bits=chunk_bits, processes=processes)
+
+    @staticmethod
+    def _create_from_file_system(path_to_dir, hashtype, ex_re, match_re,
+                                 workers, cache, stats=None,
+                                 chunk_bits=None, processes=None):
+        """ Do the work of create_from_file_system(). """
+        if processes and processes > 1:
+            if cache is not None:
+                raise RuntimeError(
+                    "a LeafHashCache can't be shared by worker processes")
+            # imported here because merkletree.sharded imports merkletree
+            from merkletree.sharded import create_sharded
+            return create_sharded(path_to_dir, hashtype, ex_re, match_re,
+                                  processes, stats, chunk_bits)
         check_hashtype(hashtype)
+        name = MerkleTree.check_dir_path(path_to_dir)
+        chunk_pool = MerkleTree.make_chunk_pool(chunk_bits, workers)
+        trees = []                      # in the order walked, parents first
+        try:
+            if workers and workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    tree = MerkleTree._walk_file_system(
+                        path_to_dir, name, hashtype, ex_re, match_re,
+                        trees, cache, pool, stats, chunk_bits, chunk_pool,
+                        workers)
+                    MerkleTree.settle(trees, stats)
+            else:
+                tree = MerkleTree._walk_file_system(
+                    path_to_dir, name, hashtype, ex_re, match_re, trees,
+                    cache, None, stats, chunk_bits, chunk_pool)
+                MerkleTree.settle(trees, stats)
+        finally:
+            if chunk_pool is not None:
+                chunk_pool.shutdown()
+        return tree
+
+    @staticmethod
+    def make_chunk_pool(chunk_bits, workers):
+        """
+        Return the pool of threads hashing the chunks of large files, or
+        None if files are not to be chunked.  This must not be the pool
+        hashing whole files, which would deadlock waiting on itself.
+        """
+        if not chunk_bits:
+            return None
+        check_chunk_bits(chunk_bits)
+        return ThreadPoolExecutor(
+            max_workers=workers if workers and workers > 1
+            else os.cpu_count() or 1)
+
+    @staticmethod
+    def check_dir_path(path_to_dir):
+        """
+        Raise RuntimeError unless path_to_dir names an existing directory
+        with an inclusive path; return the last component of the path.
+        """
         if not path_to_dir:
             raise RuntimeError("cannot create a MerkleTree, no path set")
         if not os.path.exists(path_to_dir):
@@ -772,51 +1747,218 @@ class MerkleTree(MerkleNode):
         (path, _, name) = path_to_dir.rpartition('/')
         if not path:
             raise RuntimeError("can't parse inclusive path '%s'" % path_to_dir)
+        return name
 
-        tree = MerkleTree(name, hashtype, ex_re, match_re)
-        tree.bin_hash = None
-        sha = get_hash_func(hashtype)
+    @staticmethod
+    async def async_create_from_file_system(
+            path_to_dir, hashtype=HashTypes.SHA2, ex_re=None, match_re=None,
+            workers=None, cache=None, stats=None, executor=None,
+            chunk_bits=None):
+        """
+        Coroutine which builds the MerkleTree that create_from_file_system()
+        would, without blocking the event loop.  Directories are read,
+        files hashed and directory hashes computed by calls to executor,
+        by default the loop's own, with no more than workers (default
+        ASYNC_WORKERS) of these calls in progress at once.  The walk
+        runs ahead of the hashing by at most twice that many files.
+
+        If the build is cancelled, no further calls are started; those
+        already running in the executor complete, but their results are
+        discarded.  cache, stats and chunk_bits are as for
+        create_from_file_system().
+        """
+        check_hashtype(hashtype)
+        name = MerkleTree.check_dir_path(path_to_dir)
+        chunk_pool = MerkleTree.make_chunk_pool(chunk_bits, workers)
+        try:
+            if stats is not None:
+                with stats.phase('build'):
+                    return await MerkleTree._async_create_from_file_system(
+                        path_to_dir, name, hashtype, ex_re, match_re,
+                        workers, cache, stats, executor, chunk_bits,
+                        chunk_pool)
+            return await MerkleTree._async_create_from_file_system(
+                path_to_dir, name, hashtype, ex_re, match_re, workers, cache,
+                stats, executor, chunk_bits, chunk_pool)
+        finally:
+            if chunk_pool is not None:
+                # don't block the loop on chunks still being hashed
+                chunk_pool.shutdown(wait=False)
 
-        # Create data structures for constituent files and subdirectories
-        # These MUST BE SORTED by the bare name to meet specs.
-        files = sorted(os.listdir(path_to_dir))
-        if files:
-            sha_count = 0
-            for file in files:
+    @staticmethod
+    async def _async_create_from_file_system(path_to_dir, name, hashtype,
+                                             ex_re, match_re, workers,
+                                             cache, stats, executor,
+                                             chunk_bits, chunk_pool):
+        """
+        Do the work of async_create_from_file_system(), walking the
+        directories as _walk_file_system() does.
+        """
+        loop = asyncio.get_event_loop()
+        workers = workers if workers and workers > 0 else ASYNC_WORKERS
+        limit = asyncio.Semaphore(workers)
+
+        async def run(func, *args):
+            """ Run func(*args) in the executor when a slot is free. """
+            async with limit:
+                return await loop.run_in_executor(executor, func, *args)
+
+        root = MerkleTree(name, hashtype, ex_re, match_re)
+        trees = []                      # in the order walked, parents first
+        pending = deque()               # (node list, index, task)
+        try:
+            stack = [(root, path_to_dir)]
+            while stack:
+                tree, path = stack.pop()
+                trees.append(tree)
+                subdirs = []
+                nodes = tree.nodes
+                for (name, path_to_file, is_dir) in await run(
+                        MerkleTree.scan_dir, path, ex_re, match_re, stats):
+                    if is_dir:
+                        node = MerkleTree(name, hashtype, ex_re, match_re)
+                        subdirs.append((node, path_to_file))
+                        nodes.append(node)
+                        continue
+                    # the leaf replaces this placeholder when hashed
+                    pending.append((nodes, len(nodes), asyncio.ensure_future(
+                        run(MerkleLeaf.create_from_file_system,
+                            path_to_file, name, hashtype, cache, stats,
+                            chunk_bits, chunk_pool))))
+                    nodes.append(None)
+                    while len(pending) >= 2 * workers:
+                        (leaf_nodes, ndx, task) = pending.popleft()
+                        leaf_nodes[ndx] = await task
+                stack.extend(reversed(subdirs))
+            while pending:
+                (leaf_nodes, ndx, task) = pending.popleft()
+                leaf_nodes[ndx] = await task
+        except BaseException:
+            # including cancellation: don't start what is still queued
+            for (_, _, task) in pending:
+                task.cancel()
+            raise
+        await run(MerkleTree.settle, trees, stats)
+        return root
+
+    @staticmethod
+    def scan_dir(path_to_dir, ex_re=None, match_re=None, stats=None):
+        """
+        Return a list of (name, path, is_dir) for the members of the
+        directory at path_to_dir which belong in its MerkleTree, sorted
+        by the bare name.  Subdirectories are recognized without following
+        symbolic links, files by following them, and anything else is
+        ignored.  The type information comes from the directory read
+        itself, so no further stat() is needed except for symbolic links.
+        If stats is not None, the directory is recorded in it.
+        """
+        if stats is not None:
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+        members = []
+        excluded = ignored = 0
+        with os.scandir(path_to_dir) as entries:
+            for entry in entries:
+                name = entry.name
                 # exclusions take priority over matches
-                if ex_re and ex_re.search(file):
+                if ex_re and ex_re.search(name):
+                    excluded += 1
                     continue
-                if match_re and not match_re.search(file):
+                if match_re and not match_re.search(name):
+                    excluded += 1
                     continue
-                node = None
-                path_to_file = os.path.join(path_to_dir, file)
-                string = os.lstat(path_to_file)        # ignores symlinks
-                # os.path.isdir(path) follows symbolic links
-                if S_ISDIR(string.st_mode):
-                    node = MerkleTree.create_from_file_system(
-                        path_to_file, hashtype, ex_re, match_re)
-                # S_ISLNK(mode) is true if symbolic link
-                # isfile(path) follows symbolic links
-                elif os.path.isfile(path_to_file):        # S_ISREG(mode):
-                    node = MerkleLeaf.create_from_file_system(
-                        path_to_file, file, hashtype)
+                # like S_ISDIR(lstat(path).st_mode): ignores symlinks
+                if entry.is_dir(follow_symlinks=False):
+                    members.append((name, entry.path, True))
+                # like os.path.isfile(path): follows symbolic links
+                elif entry.is_file():
+                    members.append((name, entry.path, False))
                 # otherwise, just ignore it ;-)
+                else:
+                    ignored += 1
+
+        # These MUST BE SORTED by the bare name to meet specs.
+        members.sort()
+        if stats is not None:
+            stats.add_dir(path_to_dir, time.perf_counter() - wall,
+                          time.thread_time() - cpu, excluded, ignored)
+        return members
+
+    @staticmethod
+    def _walk_file_system(path_to_dir, name, hashtype, ex_re, match_re,
+                          trees, cache=None, pool=None, stats=None,
+                          chunk_bits=None, chunk_pool=None, workers=1):
+        """
+        Build the skeleton of the MerkleTree for the directory at
+        path_to_dir, appending each MerkleTree created to trees.  If
+        there is a pool, leaves are submitted to it and the tree's node
+        list holds Futures until settle() is called.  No directory
+        hashes are computed here.  The walk runs ahead of the pool's
+        workers by at most twice their number of files, waiting for the
+        oldest when it gets that far ahead, so that a big tree does not
+        fill the pool's queue.
+
+        The walk uses an explicit stack rather than recursion, so there
+        is no limit on the depth of the directory structure.
+        """
+        root = MerkleTree(name, hashtype, ex_re, match_re)
+        pending = deque()               # (node list, index, Future)
+        stack = [(root, path_to_dir)]
+        while stack:
+            tree, path = stack.pop()
+            trees.append(tree)
+            subdirs = []
+            for (name, path_to_file, is_dir) in MerkleTree.scan_dir(
+                    path, ex_re, match_re, stats):
+                if is_dir:
+                    node = MerkleTree(name, hashtype, ex_re, match_re)
+                    subdirs.append((node, path_to_file))
+                elif pool:
+                    node = pool.submit(MerkleLeaf.create_from_file_system,
+                                       path_to_file, name, hashtype, cache,
+                                       stats, chunk_bits, chunk_pool)
+                    pending.append((tree.nodes, len(tree.nodes), node))
+                    if len(pending) > 2 * workers:
+                        (nodes, ndx, future) = pending.popleft()
+                        nodes[ndx] = future.result()
+                else:
+                    node = MerkleLeaf.create_from_file_system(
+                        path_to_file, name, hashtype, cache, stats,
+                        chunk_bits, chunk_pool)
+                tree.nodes.append(node)
+            # visit subdirectories in order, each before its successors
+            stack.extend(reversed(subdirs))
+        return root
 
-                if node:
-                    # update tree-level hash
-                    if node.bin_hash:
-                        # note empty file has null hash  XXX NOT TRUE
-                        sha_count += 1
-                        sha.update(node.bin_hash)
-                    # SKIP NEXT TO EASE GARBAGE COLLECTION ??? XXX
-                    # but that won't be a good idea if we are
-                    # invoking toString()
-                    tree.nodes.append(node)
+    @staticmethod
+    def settle(trees, stats=None):
+        """
+        Given MerkleTrees listed parents first, in the order in which a
+        walk like _walk_file_system() creates them, replace any Futures
+        with the MerkleLeafs they yield and compute the tree-level
+        hashes.  Working backwards guarantees that subdirectories are
+        hashed before their parents.  If stats is not None, this is
+        timed as the phase 'settle'.
+        """
+        if stats is not None:
+            with stats.phase('settle'):
+                MerkleTree.settle(trees)
+            return
+        for tree in reversed(trees):
+            nodes = tree.nodes
+            sha = get_hash_func(tree.hashtype)
+            sha_count = 0
+            for ndx, node in enumerate(nodes):
+                if isinstance(node, Future):
+                    node = nodes[ndx] = node.result()
+                # update tree-level hash
+                if node.bin_hash:
+                    # note empty file has null hash  XXX NOT TRUE
+                    sha_count += 1
+                    sha.update(node.bin_hash)
             if sha_count:
                 tree.bin_hash = bytes(sha.digest())
 
-        return tree
-
     # OTHER METHODS AND PROPERTIES ##################################
     @classmethod
     def first_line_re_1(cls):
@@ -843,45 +1985,474 @@ class MerkleTree(MerkleNode):
         """
         DANGEROUS: returns a reference to the MerkleTree's node list.
         """
+        if self._source is not None:
+            self._load_nodes()
         return self._nodes
 
     def add_node(self, node):
-        """ Add a MerkleNode to a MerkleTree. """
+        """
+        Add a MerkleNode to a MerkleTree, keeping the nodes in order by
+        name, which is the order in which their hashes are combined.
+        Nodes normally arrive in that order, in which case this is an
+        append.
+        """
         if node is None:
             raise RuntimeError("attempt to add null node")
         if not isinstance(node, MerkleTree)\
                 and not isinstance(node, MerkleLeaf):
             raise RuntimeError("node being added not MerkleTree or MerkleLeaf")
-        self._nodes.append(node)
+        nodes = self.nodes
+        name = node.name
+        if not nodes or nodes[-1].name < name:
+            ndx = len(nodes)
+        else:
+            self._check_index()
+            ndx = bisect_left(self._names, name)
+            if self._names[ndx] == name:
+                raise RuntimeError(
+                    "MerkleTree %s already has a node named %s" % (
+                        self._name, name))
+        in_step = self._index_current()
+        nodes.insert(ndx, node)
+        if in_step:
+            self._names.insert(ndx, name)
+            self._index[name] = node
+
+    def _check_index(self):
+        """
+        Build the name index on first use, and again if the node list is
+        seen to have been changed other than through this MerkleTree:
+        if its length or its last node is not what the index expects.
+
+        The index is a dictionary from names to nodes and a list of the
+        names in order, which is searched by bisection.  add_node() and
+        the mutation methods keep both up to date, so inserting a node
+        anywhere costs no more than moving the list entries after it.
+        """
+        if not self._index_current():
+            nodes = self._nodes
+            self._names = [node.name for node in nodes]
+            self._index = {node.name: node for node in nodes}
+
+    def _index_current(self):
+        """ Whether the name index matches the node list. """
+        nodes = self.nodes
+        names = self._names
+        if names is None or len(names) != len(nodes):
+            return False
+        return not nodes or self._index.get(names[-1]) is nodes[-1]
 
-    # SERIALIZATION #################################################
-    def to_string_not_top(self, indent=0):
-        """ indent is the indentation to be used for the top node"""
-        string = []                             # a list of strings
-        spaces = SP.get_spaces(indent)
-        if self._bin_hash is None:
-            if self._hashtype == HashTypes.SHA1:
-                top = "%s%s %s/\n" % (spaces, SHA1_HEX_NONE, self.name)
-            elif self._hashtype == HashTypes.SHA2:
-                top = "%s%s %s/\n" % (spaces, SHA2_HEX_NONE, self.name)
-            elif self._hashtype == HashTypes.SHA3:
-                top = "%s%s %s/\n" % (spaces, SHA3_HEX_NONE, self.name)
-            elif self._hashtype == HashTypes.BLAKE2B_256:
-                top = "%s%s %s/\n" % (spaces, BLAKE2B_256_HEX_NONE, self.name)
-            else:
-                raise NotImplementedError
+    def _position(self, name):
+        """
+        Return the position in the node list of the child node with the
+        given name, or None.
+        """
+        self._check_index()
+        names = self._names
+        ndx = bisect_left(names, name)
+        if ndx < len(names) and names[ndx] == name:
+            return ndx
+        return None
+
+    def _child(self, name):
+        """ Return the child node with the given name, or None. """
+        self._check_index()
+        return self._index.get(name)
+
+    def get(self, path, default=None):
+        """
+        Return the node at path, a '/'-separated sequence of names below
+        this MerkleTree, or default if there is no such node.  The empty
+        path is the MerkleTree itself.  Each step is a dictionary lookup,
+        so the cost depends on the depth of the path but not on the
+        number of nodes in each directory.
+        """
+        node = self
+        for name in path.split('/'):
+            if not name:
+                continue            # leading, trailing, or doubled /
+            if node.is_leaf:
+                return default
+            node = MerkleTree._child(node, name)
+            if node is None:
+                return default
+        return node
+
+    def __getitem__(self, path):
+        node = self.get(path)
+        if node is None:
+            raise KeyError(path)
+        return node
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    # MUTATION ######################################################
+
+    def upsert_leaf(self, path, hash_, chunk_bits=0):
+        """
+        Set the hash of the file at path, a '/'-separated sequence of
+        names below this MerkleTree, adding a MerkleLeaf, and any
+        directories above it, if there is none.  hash_ is binary; if
+        chunk_bits is set, the leaf is a ChunkedMerkleLeaf.  Return the
+        MerkleLeaf replaced, or None.
+
+        Like remove() and replace_subtree(), this marks the MerkleTrees
+        on the path as out of date and returns without recomputing any
+        hashes.  The next time the hash of one of them is wanted, it is
+        recomputed, together with those of any other changed subtrees
+        below it, but no others.  So a batch of changes costs about as
+        much as their number times the depth of the tree, however big
+        the tree is.  Changes must be made through the top of the tree,
+        and a MerkleDoc's hash does not follow changes to its tree.
+        """
+        if not isinstance(hash_, bytes) or \
+                len(hash_) != bin_hash_len(self._hashtype):
+            raise RuntimeError("%s: not a binary %s hash" % (
+                path, self._hashtype.name))
+        if chunk_bits:
+            check_chunk_bits(chunk_bits)
+        (trail, name) = self._trail(path, True)
+        old = MerkleTree._child(trail[-1], name)
+        if old is not None and not old.is_leaf:
+            raise RuntimeError("%s is a directory, not a file" % path)
+        MerkleTree._put_child(trail[-1], new_leaf(name, self._hashtype,
+                                                  hash_, chunk_bits))
+        MerkleTree._mark_dirty(trail)
+        return old
+
+    def upsert_leaves(self, path, leaves):
+        """
+        Set the hashes of many files in the directory at path, which is
+        added if need be, as upsert_leaf() does for one; the empty path
+        is this MerkleTree.  leaves is an iterable of (name, hash_,
+        chunk_bits).  The new nodes are merged with the directory's in
+        a single sort, so the cost is about that of sorting the result,
+        whatever order the leaves come in.
+        """
+        new = {}
+        for (name, hash_, chunk_bits) in leaves:
+            if not isinstance(hash_, bytes) or \
+                    len(hash_) != bin_hash_len(self._hashtype):
+                raise RuntimeError("%s/%s: not a binary %s hash" % (
+                    path, name, self._hashtype.name))
+            if chunk_bits:
+                check_chunk_bits(chunk_bits)
+            new[name] = new_leaf(name, self._hashtype, hash_, chunk_bits)
+        if path.strip('/'):
+            (trail, name) = self._trail(path, True)
+            tree = MerkleTree._child(trail[-1], name)
+            if tree is None:
+                tree = MerkleTree(name, self._hashtype, self._ex_re,
+                                  self._match_re)
+                trail[-1].add_node(tree)
+            elif tree.is_leaf:
+                raise RuntimeError("%s is a file, not a directory" % path)
+            trail.append(tree)
         else:
-            top = "%s%s %s/\n" % (spaces, self.hex_hash, self.name)
-        string.append(top)
-        indent += 1              # <--- LEVEL 2+ NODE
-        for node in self.nodes:
+            trail = [self]
+        nodes = []
+        for node in trail[-1].nodes:
+            if node.name not in new:
+                nodes.append(node)
+            elif not node.is_leaf:
+                raise RuntimeError("%s/%s is a directory, not a file" % (
+                    path, node.name))
+        nodes.extend(new.values())
+        nodes.sort(key=lambda node: node.name)
+        MerkleTree._set_nodes(trail[-1], nodes)
+        MerkleTree._mark_dirty(trail)
+
+    def remove(self, path):
+        """
+        Remove the file or directory at path, returning its node; raise
+        KeyError if there is none.  Directories left empty are kept.
+        See upsert_leaf().
+        """
+        (trail, name) = self._trail(path, False)
+        old = MerkleTree._drop_child(trail[-1], name)
+        if old is None:
+            raise KeyError(path)
+        MerkleTree._mark_dirty(trail)
+        return old
+
+    def replace_subtree(self, path, tree):
+        """
+        Put tree, a MerkleTree named for the last component of path, at
+        path in this MerkleTree, replacing whatever is there and adding
+        any missing directories above it.  Return the node replaced, or
+        None.  See upsert_leaf().
+        """
+        if not isinstance(tree, MerkleTree):
+            raise RuntimeError("%s: not a MerkleTree" % path)
+        if tree.hashtype != self._hashtype:
+            raise RuntimeError("can't put %s tree in %s tree" % (
+                tree.hashtype.name, self._hashtype.name))
+        (trail, name) = self._trail(path, True)
+        if tree.name != name:
+            raise RuntimeError("tree named %s can't be put at %s" % (
+                tree.name, path))
+        old = MerkleTree._put_child(trail[-1], tree)
+        MerkleTree._mark_dirty(trail)
+        return old
+
+    def rehash(self):
+        """
+        Recompute the hash of this MerkleTree, and those of the changed
+        subtrees below it, if it has been changed since it was last
+        hashed.  Reading bin_hash or hex_hash does the same.
+        """
+        if self._dirty:
+            self._clean()
+
+    def _trail(self, path, create):
+        """
+        Return the list of MerkleTrees from this one down to the parent
+        of the node at path, and the last name in the path.  Missing
+        directories are added if create is set, and otherwise cause a
+        KeyError.
+        """
+        names = [name for name in path.split('/') if name]
+        if not names:
+            raise RuntimeError("no path below %s" % self._name)
+        trail = [self]
+        for name in names[:-1]:
+            node = MerkleTree._child(trail[-1], name)
+            if node is None:
+                if not create:
+                    raise KeyError(path)
+                node = MerkleTree(name, self._hashtype, self._ex_re,
+                                  self._match_re)
+                trail[-1].add_node(node)
+            elif node.is_leaf:
+                raise RuntimeError("%s: %s is a file" % (path, name))
+            trail.append(node)
+        return (trail, names[-1])
+
+    @staticmethod
+    def _mark_dirty(trail):
+        """ Mark the MerkleTrees in the list as needing new hashes. """
+        for tree in trail:
+            # pylint: disable=protected-access
+            tree._dirty = True
+
+    def _clean(self):
+        """
+        Recompute the hashes of this MerkleTree and of the changed
+        subtrees below it, children before their parents.
+        """
+        trees = []
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            trees.append(tree)
+            stack.extend(node for node in tree.nodes
+                         if not node.is_leaf and node.dirty)
+        for tree in reversed(trees):
+            MerkleTree._rehash(tree)
+
+    def _put_child(self, node):
+        """
+        Replace the child node with the same name as node, returning the
+        one replaced, or add node in order if there is none.  The tree is
+        not marked dirty.
+        """
+        ndx = self._position(node.name)
+        if ndx is None:
+            self.add_node(node)
+            return None
+        old = self._nodes[ndx]
+        self._nodes[ndx] = node
+        self._index[node.name] = node
+        return old
+
+    def _set_nodes(self, nodes):
+        """ Replace the node list with nodes, which are in order. """
+        self._nodes = nodes
+        self._index = self._names = None
+
+    def _drop_child(self, name):
+        """ Remove and return the child node with the name, or None. """
+        ndx = self._position(name)
+        if ndx is None:
+            return None
+        del self._names[ndx]
+        del self._index[name]
+        return self._nodes.pop(ndx)
+
+    def _rehash(self):
+        """
+        Recompute this MerkleTree's hash from those of its children, as
+        settle() does, feeding them to the hash function in one piece.
+        """
+        hashes = [hash_ for hash_ in (node.bin_hash for node in self.nodes)
+                  if hash_]
+        if hashes:
+            sha = get_hash_func(self._hashtype)
+            sha.update(b''.join(hashes))
+            self._bin_hash = bytes(sha.digest())
+        else:
+            self._bin_hash = None
+        self._dirty = False
+
+    def prove(self, path):
+        """
+        Return a proof that the node at path is part of this MerkleTree,
+        for use with verify_proof().  The proof is a list with one
+        (before, after) pair per level, starting at the node itself:
+        the hashes of its siblings in order, excluding empty directories,
+        which have no hash.  Raises KeyError if there is no such node
+        and RuntimeError if the node is an empty directory.
+        """
+        proof = []
+        tree = self
+        for name in path.split('/'):
+            if not name:
+                continue
+            if tree.is_leaf:
+                raise KeyError(path)
+            ndx = MerkleTree._position(tree, name)
+            if ndx is None:
+                raise KeyError(path)
+            nodes = tree.nodes
+            proof.append(([node.bin_hash for node in nodes[:ndx]
+                           if node.bin_hash],
+                          [node.bin_hash for node in nodes[ndx + 1:]
+                           if node.bin_hash]))
+            tree = nodes[ndx]
+        if not tree.bin_hash:
+            raise RuntimeError("%s has no hash" % path)
+        proof.reverse()
+        return proof
+
+    def prove_many(self, paths):
+        """
+        Return a single proof that all of the nodes at the given paths
+        are part of this MerkleTree, for use with verify_multiproof().
+        Each hash needed appears once, however many of the paths share
+        the directory it belongs to.
+
+        The proof is a list of tokens describing, in preorder, the part
+        of the tree that contains the paths: ('D', name, count) opens a
+        directory whose next count siblings-or-subtrees are its hashed
+        children, ('H', hash) is a child outside the paths, and
+        ('L', name) is a child whose hash the verifier is given.  The
+        top directory's name is ''.  Raises KeyError if a path is not in
+        the tree and RuntimeError if it is an empty directory.
+        """
+        wanted = {}             # a trie of names; None marks a path's end
+        for path in paths:
+            node = self.get(path)
+            if node is None:
+                raise KeyError(path)
+            if not node.bin_hash:
+                raise RuntimeError("%s has no hash" % path)
+            trie = wanted
+            for name in path.split('/'):
+                if name:
+                    trie = trie.setdefault(name, {})
+            trie[None] = True
+
+        proof = []
+        stack = [(self, '', wanted)]
+        while stack:
+            (node, name, trie) = stack.pop()
+            if trie is None:
+                proof.append(('H', node.bin_hash))
+            elif node.is_leaf or (len(trie) == 1 and None in trie):
+                proof.append(('L', name))
+            else:
+                children = [child for child in node.nodes if child.bin_hash]
+                proof.append(('D', name, len(children)))
+                stack.extend((child, child.name, trie.get(child.name))
+                             for child in reversed(children))
+        return proof
+
+    def verify_against_file_system(self, path_to_dir, workers=None,
+                                   fail_fast=False, exclusions=None,
+                                   matches=None, cache=None, ex_re=None,
+                                   match_re=None):
+        """
+        Generate a merkletree.diff.MerkleChange for each difference
+        between this MerkleTree and the directory at path_to_dir, which
+        is walked in parallel if workers is more than one, stopping
+        after the first if fail_fast is True.  Patterns may be given as
+        lists, exclusions and matches, or compiled, ex_re and match_re;
+        by default those the tree was built with are used.  See
+        merkletree.diff.verify().
+        """
+        # merkletree.diff imports this module, so it can't be imported
+        # at the top
+        from merkletree.diff import verify
+        return verify(self, path_to_dir, workers, fail_fast, exclusions,
+                      matches, cache, ex_re or self._ex_re,
+                      match_re or self._match_re)
+
+    # SERIALIZATION #################################################
+    def iter_lines(self, indent=0):
+        """
+        Generate the serialization of the MerkleTree one LF-terminated
+        line at a time; indent is the indentation of the top line.  Only
+        an iterator per level of depth is held, so memory use does not
+        grow with the size of the tree.
+        """
+        yield "%s%s %s/\n" % (SP.get_spaces(indent), self.hex_hash, self.name)
+        stack = [iter(self.nodes)]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                continue
             if isinstance(node, MerkleLeaf):
-                string.append(node.to_string(indent))
+                yield node.to_string(indent + len(stack))
             else:
-                # recurse
-                string.append(node.to_string_not_top(indent))
+                yield "%s%s %s/\n" % (SP.get_spaces(indent + len(stack)),
+                                      node.hex_hash, node.name)
+                stack.append(iter(node.nodes))
 
-        return ''.join(string)
+    def write_to(self, file, indent=0):
+        """
+        Write the serialization of the MerkleTree to a file object
+        without building it in memory.
+        """
+        write = file.write
+        for line in self.iter_lines(indent):
+            write(line)
+
+    def write_binary(self, file):
+        """
+        Write the binary serialization of the MerkleTree to a file object
+        opened in binary mode.
+        """
+        file.write(binary_header(self._hashtype, BIN_KIND_TREE))
+        _write_binary_nodes(self, file.write)
+
+    def to_bytes(self):
+        """ Return the binary serialization of the MerkleTree. """
+        buf = io.BytesIO()
+        self.write_binary(buf)
+        return buf.getvalue()
+
+    @staticmethod
+    def create_from_binary(data):
+        """
+        Create a MerkleTree from its binary serialization, given either as
+        a bytes-like object or as a file object opened in binary mode.
+        The hash type is taken from the serialization.
+        """
+        if hasattr(data, 'read'):
+            data = data.read()
+        view = memoryview(data)
+        (hashtype, offset) = read_binary_header(view, BIN_KIND_TREE)
+        (tree, offset) = _read_binary_nodes(view, offset, hashtype)
+        if offset != len(view):
+            raise MerkleParseError(
+                "%d bytes follow binary serialization" % (len(view) - offset))
+        return tree
+
+    def to_string_not_top(self, indent=0):
+        """ indent is the indentation to be used for the top node"""
+        return ''.join(self.iter_lines(indent))
 
     def to_string(self, indent=0):
         """
@@ -890,28 +2461,4 @@ class MerkleTree(MerkleNode):
         Using code should take into account that the last line is CR-LF
         terminated, and so a split on CRLF will generate an extra blank line
         """
-        string = []                             # a list of strings
-        spaces = SP.get_spaces(indent)
-        if self._bin_hash is None:
-            if self._hashtype == HashTypes.SHA1:
-                top = "%s%s %s/\n" % (spaces, SHA1_HEX_NONE, self.name)
-            elif self._hashtype == HashTypes.SHA2:
-                top = "%s%s %s/\n" % (spaces, SHA2_HEX_NONE, self.name)
-            elif self._hashtype == HashTypes.SHA3:
-                top = "%s%s %s/\n" % (spaces, SHA3_HEX_NONE, self.name)
-            elif self._hashtype == HashTypes.BLAKE2B_256:
-                top = "%s%s %s/\n" % (spaces, BLAKE2B_256_HEX_NONE, self.name)
-            else:
-                raise NotImplementedError
-        else:
-            top = "%s%s %s/\n" % (spaces, self.hex_hash, self.name)
-        string.append(top)                       # <--- LEVEL 0 NODE
-        my_indent = indent + 1               # <--- LEVEL 1 NODE
-        for node in self.nodes:
-            if isinstance(node, MerkleLeaf):
-                string.append(node.to_string(my_indent))
-            else:
-                # recurse
-                string.append(node.to_string_not_top(my_indent))
-
-        return ''.join(string)
+        return ''.join(self.iter_lines(indent))
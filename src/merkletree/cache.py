@@ -0,0 +1,190 @@
+# merkletree/cache.py
+
+"""
+A persistent cache of MerkleLeaf hashes keyed by what stat() says about
+each file, so that rebuilding a MerkleTree over a mostly unchanged
+directory costs little more than walking it.
+"""
+
+import sqlite3
+import threading
+
+from xlattice import check_hashtype
+
+__all__ = ['LeafHashCache', 'DEFAULT_KEEP_RUNS', ]
+
+# entries not used in this many runs are evicted when the cache is closed
+DEFAULT_KEEP_RUNS = 8
+
+CACHE_VERSION = 1
+
+
+class LeafHashCache(object):
+    """
+    An sqlite3 database mapping (device, inode, size, mtime_ns, hashtype)
+    to a file's binary hash.  A hash is only returned if every element
+    of the key still matches, so any change to a file's size or
+    modification time forces it to be reread.
+
+    Each time the cache is opened the run number is bumped, and every
+    entry read or written is stamped with it.  On close() entries which
+    have not been used in the last keep_runs runs are evicted, and the
+    database is compacted if a significant fraction of it was dropped.
+
+    A LeafHashCache may be shared by the threads of a parallel build.
+    """
+
+    def __init__(self, path_to_cache, keep_runs=DEFAULT_KEEP_RUNS):
+        if not path_to_cache:
+            raise RuntimeError("LeafHashCache: no path to cache")
+        if keep_runs < 1:
+            raise RuntimeError(
+                "LeafHashCache: keep_runs must be positive, not %d" %
+                keep_runs)
+        self._path = path_to_cache
+        self._keep_runs = keep_runs
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        self._conn = sqlite3.connect(path_to_cache, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS meta ('
+            '    key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS leaves ('
+            '    dev INTEGER NOT NULL, ino INTEGER NOT NULL,'
+            '    hashtype INTEGER NOT NULL,'
+            '    size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            '    hash BLOB NOT NULL, run INTEGER NOT NULL,'
+            '    PRIMARY KEY (dev, ino, hashtype)) WITHOUT ROWID')
+        version = self._get_meta('version')
+        if version is None:
+            self._set_meta('version', CACHE_VERSION)
+        elif version != CACHE_VERSION:
+            self._conn.close()
+            raise RuntimeError(
+                "LeafHashCache: %s has version %d, expected %d" % (
+                    path_to_cache, version, CACHE_VERSION))
+        self._run = (self._get_meta('run') or 0) + 1
+        self._set_meta('run', self._run)
+        self._conn.commit()
+
+    def _get_meta(self, key):
+        row = self._conn.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            (key, value))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def path(self):
+        """ Return the path to the on-disk cache. """
+        return self._path
+
+    @property
+    def run(self):
+        """ Return the number of the current run. """
+        return self._run
+
+    @property
+    def hits(self):
+        """ Return the number of lookups satisfied from the cache. """
+        return self._hits
+
+    @property
+    def misses(self):
+        """ Return the number of lookups which found no usable entry. """
+        return self._misses
+
+    def get(self, stat_, hashtype):
+        """
+        Given the result of os.stat() on a file, return its cached
+        binary hash or None if there is no entry or the entry is stale.
+        """
+        check_hashtype(hashtype)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size, mtime_ns, hash, run FROM leaves '
+                'WHERE dev = ? AND ino = ? AND hashtype = ?',
+                (stat_.st_dev, stat_.st_ino, int(hashtype))).fetchone()
+            if row is None or row[0] != stat_.st_size or \
+                    row[1] != stat_.st_mtime_ns:
+                self._misses += 1
+                return None
+            if row[3] != self._run:
+                self._conn.execute(
+                    'UPDATE leaves SET run = ? '
+                    'WHERE dev = ? AND ino = ? AND hashtype = ?',
+                    (self._run, stat_.st_dev, stat_.st_ino, int(hashtype)))
+            self._hits += 1
+            return bytes(row[2])
+
+    def put(self, stat_, hashtype, hash_):
+        """
+        Record the binary hash of the file described by stat_, which
+        must have been taken before the file was read.
+        """
+        check_hashtype(hashtype)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO leaves '
+                '(dev, ino, hashtype, size, mtime_ns, hash, run) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (stat_.st_dev, stat_.st_ino, int(hashtype),
+                 stat_.st_size, stat_.st_mtime_ns, hash_, self._run))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM leaves').fetchone()[0]
+
+    def flush(self):
+        """ Commit any outstanding changes to disk. """
+        with self._lock:
+            self._conn.commit()
+
+    def evict(self, keep_runs=None):
+        """
+        Drop entries not used in the last keep_runs runs, returning
+        the number of entries dropped.
+        """
+        if keep_runs is None:
+            keep_runs = self._keep_runs
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM leaves WHERE run <= ?',
+                (self._run - keep_runs,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def compact(self):
+        """ Rewrite the database, reclaiming the space of dropped entries. """
+        with self._lock:
+            self._conn.commit()
+            self._conn.execute('VACUUM')
+
+    def close(self):
+        """
+        Evict stale entries, compacting the cache if at least a quarter
+        of it was dropped, and close it.
+        """
+        if self._conn is None:
+            return
+        before = len(self)
+        dropped = self.evict()
+        if dropped and dropped * 4 >= before:
+            self.compact()
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
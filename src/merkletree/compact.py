@@ -0,0 +1,492 @@
+# merkletree/compact.py
+
+"""
+An array-backed equivalent of MerkleTree for very large trees.  Rather
+than an object per node it keeps a handful of arrays indexed by node
+number, so that a node costs some tens of bytes instead of hundreds.
+"""
+
+import io
+from array import array
+
+from xlattice import (SHA1_HEX_NONE, SHA2_HEX_NONE, SHA3_HEX_NONE,
+                      BLAKE2B_256_HEX_NONE, HashTypes, check_hashtype)
+from xlcrypto import SP   # for getSpaces()
+
+from merkletree import (MerkleLeaf, MerkleTree, MerkleParseError,
+                        get_hash_func, BIN_KIND_TREE, BIN_FLAG_DIR,
+                        BIN_FLAG_HASH, BIN_FLAGS, BIN_CHUNK_SHIFT,
+                        bin_chunk_bits, bin_hash_len, binary_header,
+                        new_leaf, read_binary_header, varint, read_varint)
+
+__all__ = ['CompactMerkleTree', ]
+
+FLAG_DIR = BIN_FLAG_DIR
+FLAG_HASH = BIN_FLAG_HASH
+CHUNK_SHIFT = BIN_CHUNK_SHIFT           # the rest of the flags: chunk_bits
+
+
+class CompactMerkleTree(object):
+    """
+    A MerkleTree held as arrays.  Nodes are numbered in preorder, the
+    top directory being node 0, so that each subtree occupies a range of
+    consecutive numbers; ends[n] is one past the last node in the
+    subtree at n, which makes n + 1 its first child and ends[c] the
+    sibling following child c.  All hashes are held in one bytearray,
+    nodes without a hash (empty directories) having zeroes there, and
+    each distinct name is stored once, in UTF-8 in another.
+
+    A CompactMerkleTree is built by one of the create_from_*() methods
+    and is not modified afterwards.
+    """
+
+    __slots__ = ['_hashtype', '_hash_len', '_digests', '_flags',
+                 '_name_ids', '_ends', '_names', '_name_offsets',
+                 '_name_table', ]
+
+    def __init__(self, hashtype=HashTypes.SHA2):
+        check_hashtype(hashtype)
+        self._hashtype = hashtype
+        self._hash_len = bin_hash_len(hashtype)
+        self._digests = bytearray()
+        self._flags = bytearray()
+        self._name_ids = array('I')
+        self._ends = array('I')
+        self._names = bytearray()        # distinct names, UTF-8
+        self._name_offsets = array('Q', [0])
+        self._name_table = {}            # name -> id; used while building
+
+    # BUILDING ######################################################
+
+    def _append(self, name, hash_, is_dir, chunk_bits=0):
+        """
+        Add a node at the end, returning its number.  Its parent is the
+        last directory added which has not yet been closed.
+        """
+        ndx = len(self._flags)
+        name_id = self._name_table.get(name)
+        if name_id is None:
+            name_id = self._name_table[name] = len(self._name_offsets) - 1
+            self._names += name.encode('utf-8')
+            self._name_offsets.append(len(self._names))
+        flags = FLAG_DIR if is_dir else chunk_bits << CHUNK_SHIFT
+        if hash_:
+            if len(hash_) != self._hash_len:
+                raise RuntimeError("hash of %s has length %d, not %d" % (
+                    name, len(hash_), self._hash_len))
+            flags |= FLAG_HASH
+            self._digests += hash_
+        else:
+            self._digests += bytes(self._hash_len)
+        self._flags.append(flags)
+        self._name_ids.append(name_id)
+        self._ends.append(ndx + 1)       # extended when a directory closes
+        return ndx
+
+    def _close(self, ndx):
+        """ Mark the end of the subtree of directory ndx. """
+        self._ends[ndx] = len(self._flags)
+
+    def _set_hash(self, ndx, hash_):
+        start = ndx * self._hash_len
+        self._digests[start:start + self._hash_len] = hash_
+        self._flags[ndx] |= FLAG_HASH
+
+    def _finish(self):
+        """ Release what is only needed while building. """
+        self._name_table = None
+        return self
+
+    @classmethod
+    def create_from_tree(cls, tree):
+        """ Create a CompactMerkleTree equivalent to a MerkleTree. """
+        compact = cls(tree.hashtype)
+        top = compact._append(tree.name, tree.bin_hash, True)
+        stack = [(iter(tree.nodes), top)]
+        while stack:
+            (nodes, parent) = stack[-1]
+            node = next(nodes, None)
+            if node is None:
+                compact._close(parent)
+                stack.pop()
+                continue
+            if node.is_leaf:
+                compact._append(node.name, node.bin_hash, False,
+                                node.chunk_bits)
+            else:
+                ndx = compact._append(node.name, node.bin_hash, True)
+                stack.append((iter(node.nodes), ndx))
+        return compact._finish()
+
+    @classmethod
+    def create_from_file_system(cls, path_to_dir, hashtype=HashTypes.SHA2,
+                                ex_re=None, match_re=None, cache=None,
+                                stats=None, chunk_bits=None):
+        """
+        Create a CompactMerkleTree for the directory at path_to_dir,
+        selecting and hashing files exactly as MerkleTree does, but
+        without building a MerkleTree.  If stats is a BuildStats, the
+        build is recorded in it as by MerkleTree, and if chunk_bits is
+        set, large files are hashed in chunks as by MerkleTree.
+        """
+        chunk_pool = MerkleTree.make_chunk_pool(chunk_bits, None)
+        try:
+            if stats is not None:
+                with stats.phase('build'):
+                    return cls._create_from_file_system(
+                        path_to_dir, hashtype, ex_re, match_re, cache, stats,
+                        chunk_bits, chunk_pool)
+            return cls._create_from_file_system(
+                path_to_dir, hashtype, ex_re, match_re, cache, None,
+                chunk_bits, chunk_pool)
+        finally:
+            if chunk_pool is not None:
+                chunk_pool.shutdown()
+
+    @classmethod
+    def _create_from_file_system(cls, path_to_dir, hashtype, ex_re, match_re,
+                                 cache, stats, chunk_bits, chunk_pool):
+        """ Do the work of create_from_file_system(). """
+        compact = cls(hashtype)
+        name = path_to_dir.rstrip('/').rpartition('/')[2]
+        top = compact._append(name, None, True)
+        stack = [(iter(MerkleTree.scan_dir(path_to_dir, ex_re, match_re,
+                                           stats)), top)]
+        while stack:
+            (members, parent) = stack[-1]
+            member = next(members, None)
+            if member is None:
+                compact._close(parent)
+                stack.pop()
+                continue
+            (name, path, is_dir) = member
+            if is_dir:
+                ndx = compact._append(name, None, True)
+                stack.append((iter(MerkleTree.scan_dir(
+                    path, ex_re, match_re, stats)), ndx))
+            else:
+                leaf = MerkleLeaf.create_from_file_system(
+                    path, name, hashtype, cache, stats, chunk_bits,
+                    chunk_pool)
+                compact._append(name, leaf.bin_hash, False, leaf.chunk_bits)
+
+        # a directory's children all follow it, so working backwards
+        # hashes them before it
+        for ndx in range(len(compact) - 1, -1, -1):
+            if compact._flags[ndx] & FLAG_DIR:
+                sha = get_hash_func(hashtype)
+                sha_count = 0
+                for child in compact.children_of(ndx):
+                    if compact._flags[child] & FLAG_HASH:
+                        sha.update(compact.hash_of(child))
+                        sha_count += 1
+                if sha_count:
+                    compact._set_hash(ndx, bytes(sha.digest()))
+        return compact._finish()
+
+    @classmethod
+    def create_from_stream(cls, lines, hashtype=HashTypes.SHA2):
+        """
+        Create a CompactMerkleTree from the serialization of a MerkleTree,
+        taking lines one at a time as MerkleTree.create_from_stream()
+        does.
+        """
+        check_hashtype(hashtype)
+        lines = iter(lines)
+        first_line = next(lines, None)
+        if first_line is None:
+            raise RuntimeError("empty strings array")
+        if isinstance(first_line, bytes):
+            first_line = str(first_line, 'utf-8')
+            lines = (str(line, 'utf-8') for line in lines)
+        (_, tree_hash, dir_name) = \
+            MerkleTree.parse_first_line(first_line.rstrip())
+        len_hash = len(tree_hash)
+        if len_hash != bin_hash_len(hashtype):
+            raise RuntimeError("hash length %d inconsistent with %s" % (
+                len_hash, hashtype))
+
+        compact = cls(hashtype)
+        # empty directories are listed with a hash of zeroes
+        stack = [compact._append(dir_name, tree_hash if any(tree_hash)
+                                 else None, True)]
+        parse = MerkleTree.parse_other_line_full
+        for line_no, line in enumerate(lines, 2):
+            line = line.rstrip()
+            if not line:
+                continue
+            try:
+                (indent, hash_, name, is_dir, chunk_bits) = parse(
+                    line, len_hash)
+            except MerkleParseError as exc:
+                raise MerkleParseError("line %d: %s" % (line_no, exc)) \
+                    from None
+            if indent > len(stack) or indent < 1:
+                raise MerkleParseError("line %d: unexpected indent %d" % (
+                    line_no, indent))
+            while indent < len(stack):
+                compact._close(stack.pop())
+            if is_dir and not any(hash_):
+                hash_ = None
+            ndx = compact._append(name, hash_, is_dir, chunk_bits)
+            if is_dir:
+                stack.append(ndx)
+        while stack:
+            compact._close(stack.pop())
+        return compact._finish()
+
+    @classmethod
+    def create_from_binary(cls, data):
+        """
+        Create a CompactMerkleTree from the binary serialization of a
+        MerkleTree, given as a bytes-like object or a file object opened
+        in binary mode.
+        """
+        if hasattr(data, 'read'):
+            data = data.read()
+        view = memoryview(data)
+        (hashtype, offset) = read_binary_header(view, BIN_KIND_TREE)
+        hash_len = bin_hash_len(hashtype)
+        compact = cls(hashtype)
+        stack = []              # [directory, count of children to come]
+        try:
+            while True:
+                flags = view[offset]
+                if flags & ~BIN_FLAGS:
+                    raise MerkleParseError(
+                        "unknown flags 0x%02x at offset %d" % (flags, offset))
+                (name_len, offset) = read_varint(view, offset + 1)
+                name = str(view[offset:offset + name_len], 'utf-8')
+                offset += name_len
+                hash_ = None
+                if flags & BIN_FLAG_HASH:
+                    hash_ = bytes(view[offset:offset + hash_len])
+                    offset += hash_len
+                    if len(hash_) != hash_len:
+                        raise IndexError
+                is_dir = bool(flags & BIN_FLAG_DIR)
+                chunk_bits = bin_chunk_bits(flags, name)
+                if not stack and not is_dir:
+                    raise MerkleParseError("binary serialization has no tree")
+                if stack:
+                    stack[-1][1] -= 1
+                ndx = compact._append(name, hash_, is_dir, chunk_bits)
+                if is_dir:
+                    (count, offset) = read_varint(view, offset)
+                    stack.append([ndx, count])
+                while stack and stack[-1][1] == 0:
+                    compact._close(stack.pop()[0])
+                if not stack:
+                    break
+        except IndexError:
+            raise MerkleParseError(
+                "binary serialization is truncated") from None
+        if offset != len(view):
+            raise MerkleParseError(
+                "%d bytes follow binary serialization" % (len(view) - offset))
+        return compact._finish()
+
+    # ACCESS ########################################################
+
+    def __len__(self):
+        return len(self._flags)
+
+    @property
+    def hashtype(self):
+        """ Return the hash type used in the tree. """
+        return self._hashtype
+
+    @property
+    def name(self):
+        """ Return the name of the top directory. """
+        return self.name_of(0)
+
+    @property
+    def bin_hash(self):
+        """ Return the binary hash of the top directory. """
+        return self.hash_of(0)
+
+    @property
+    def hex_hash(self):
+        """ Return the hash of the top directory as a hex value. """
+        return self._hex_hash_of(0)
+
+    def _name_bytes(self, ndx):
+        name_id = self._name_ids[ndx]
+        return self._names[self._name_offsets[name_id]:
+                           self._name_offsets[name_id + 1]]
+
+    def name_of(self, ndx):
+        """ Return the name of node ndx. """
+        return str(self._name_bytes(ndx), 'utf-8')
+
+    def hash_of(self, ndx):
+        """ Return the binary hash of node ndx, or None if it has none. """
+        if not self._flags[ndx] & FLAG_HASH:
+            return None
+        start = ndx * self._hash_len
+        return bytes(self._digests[start:start + self._hash_len])
+
+    def _hex_hash_of(self, ndx):
+        if not self._flags[ndx] & FLAG_HASH:
+            if self._hashtype == HashTypes.SHA1:
+                return SHA1_HEX_NONE
+            elif self._hashtype == HashTypes.SHA2:
+                return SHA2_HEX_NONE
+            elif self._hashtype == HashTypes.SHA3:
+                return SHA3_HEX_NONE
+            elif self._hashtype == HashTypes.BLAKE2B_256:
+                return BLAKE2B_256_HEX_NONE
+            raise NotImplementedError
+        start = ndx * self._hash_len
+        return self._digests[start:start + self._hash_len].hex()
+
+    def is_dir(self, ndx):
+        """ Return whether node ndx is a directory. """
+        return bool(self._flags[ndx] & FLAG_DIR)
+
+    def chunk_bits_of(self, ndx):
+        """
+        Return the chunk_bits of node ndx if it is a chunked leaf, or
+        else zero.
+        """
+        return self._flags[ndx] >> CHUNK_SHIFT
+
+    def ancestors_of(self, ndx):
+        """
+        Return the numbers of the directories containing node ndx, from
+        the top down.  Parents are not stored, so this descends from the
+        top, taking at each level the child whose subtree contains ndx.
+        """
+        ancestors = []
+        node = 0
+        while node != ndx:
+            ancestors.append(node)
+            for child in self.children_of(node):
+                if ndx < self._ends[child]:
+                    node = child
+                    break
+        return ancestors
+
+    def children_of(self, ndx):
+        """ Generate the numbers of the children of node ndx, in order. """
+        ends = self._ends
+        child = ndx + 1
+        end = ends[ndx]
+        while child < end:
+            yield child
+            child = ends[child]
+
+    def path_of(self, ndx):
+        """ Return the path of node ndx relative to the top directory. """
+        return '/'.join(self.name_of(node)
+                        for node in self.ancestors_of(ndx)[1:] + [ndx]
+                        if node)
+
+    def find(self, path):
+        """
+        Return the number of the node at path, a '/'-separated sequence
+        of names below the top directory, or None if there is none.
+        """
+        ndx = 0
+        for name in path.split('/'):
+            if not name:
+                continue
+            name = name.encode('utf-8')
+            for child in self.children_of(ndx):
+                if self._name_bytes(child) == name:
+                    ndx = child
+                    break
+            else:
+                return None
+        return ndx
+
+    def get_hash(self, path):
+        """
+        Return the binary hash of the node at path, None for an empty
+        directory.  Raises KeyError if there is no such node.
+        """
+        ndx = self.find(path)
+        if ndx is None:
+            raise KeyError(path)
+        return self.hash_of(ndx)
+
+    # CONVERSION AND SERIALIZATION ##################################
+
+    def to_merkle_tree(self):
+        """ Return the equivalent MerkleTree. """
+        hashtype = self._hashtype
+        top = MerkleTree(self.name_of(0), hashtype)
+        top.bin_hash = self.hash_of(0)
+        trees = [top]           # the open directories, by depth
+        ends = [self._ends[0]]
+        for ndx in range(1, len(self)):
+            while ndx >= ends[-1]:
+                trees.pop()
+                ends.pop()
+            if self._flags[ndx] & FLAG_DIR:
+                node = MerkleTree(self.name_of(ndx), hashtype)
+                node.bin_hash = self.hash_of(ndx)
+                trees[-1].nodes.append(node)
+                trees.append(node)
+                ends.append(self._ends[ndx])
+            else:
+                trees[-1].nodes.append(new_leaf(
+                    self.name_of(ndx), hashtype, self.hash_of(ndx),
+                    self.chunk_bits_of(ndx)))
+        return top
+
+    def iter_lines(self, indent=0):
+        """
+        Generate the serialization of the tree, which is identical to
+        that of the equivalent MerkleTree, one line at a time.
+        """
+        ends = []               # of the open directories
+        for ndx in range(len(self)):
+            while ends and ndx >= ends[-1]:
+                ends.pop()
+            name = self.name_of(ndx)
+            if self._flags[ndx] & FLAG_DIR:
+                yield "%s%s %s/\n" % (SP.get_spaces(indent + len(ends)),
+                                      self._hex_hash_of(ndx), name)
+                ends.append(self._ends[ndx])
+            else:
+                hex_hash = self._hex_hash_of(ndx)
+                chunk_bits = self._flags[ndx] >> CHUNK_SHIFT
+                if chunk_bits:
+                    hex_hash += '*%d' % chunk_bits
+                yield "%s%s %s\n" % (SP.get_spaces(indent + len(ends)),
+                                     hex_hash, name)
+
+    def write_to(self, file, indent=0):
+        """ Write the serialization of the tree to a file object. """
+        write = file.write
+        for line in self.iter_lines(indent):
+            write(line)
+
+    def to_string(self, indent=0):
+        """ Return the serialization of the tree. """
+        return ''.join(self.iter_lines(indent))
+
+    def write_binary(self, file):
+        """
+        Write the binary serialization of the tree, identical to that of
+        the equivalent MerkleTree, to a file object opened in binary mode.
+        """
+        write = file.write
+        write(binary_header(self._hashtype, BIN_KIND_TREE))
+        for ndx in range(len(self)):
+            flags = self._flags[ndx]
+            name = self._name_bytes(ndx)
+            parts = [bytes([flags]), varint(len(name)), name]
+            if flags & FLAG_HASH:
+                parts.append(self.hash_of(ndx))
+            if flags & FLAG_DIR:
+                parts.append(varint(sum(1 for _ in self.children_of(ndx))))
+            write(b''.join(parts))
+
+    def to_bytes(self):
+        """ Return the binary serialization of the tree. """
+        buf = io.BytesIO()
+        self.write_binary(buf)
+        return buf.getvalue()
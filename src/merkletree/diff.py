@@ -0,0 +1,275 @@
+# merkletree/diff.py
+
+"""
+Report the differences between two MerkleTrees, visiting only those
+subtrees whose hashes differ, or between a MerkleTree and the directory
+it should describe.
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from xlutil import make_ex_re, make_match_re
+
+from merkletree import MerkleDoc, MerkleLeaf, MerkleTree
+
+__all__ = ['ADDED', 'REMOVED', 'MODIFIED', 'MerkleChange', 'diff',
+           'verify', ]
+
+ADDED = '+'
+REMOVED = '-'
+MODIFIED = 'M'
+
+# kind is one of ADDED, REMOVED, MODIFIED; path is relative to the top
+# of the trees; old_hash and new_hash are binary and None on the side
+# where the node is absent
+MerkleChange = namedtuple(
+    'MerkleChange', ['kind', 'path', 'is_dir', 'old_hash', 'new_hash'])
+
+
+def diff(old, new):
+    """
+    Generate a MerkleChange for each difference between two MerkleTrees
+    or MerkleDocs, in order by path.  The names of the top directories
+    are ignored.
+
+    Any pair of subtrees with the same hash is skipped without being
+    visited, so the work done is proportional to the number of changes
+    and their depth rather than to the size of the trees.  A directory
+    which appears or disappears is reported once, not file by file.  A
+    file which becomes a directory, or the reverse, is reported as
+    removed and then added.  MODIFIED is only reported for files.
+
+    Because names are not hashed, renaming a file within a directory
+    in a way that leaves the order of the directory unchanged does not
+    change any hash, and so is not reported.
+    """
+    if isinstance(old, MerkleDoc):
+        old = old.tree
+    if isinstance(new, MerkleDoc):
+        new = new.tree
+    if old.hashtype != new.hashtype:
+        raise RuntimeError("can't compare %s tree with %s tree" % (
+            old.hashtype.name, new.hashtype.name))
+
+    # a stack of MerkleChanges and of (path, old_tree, new_tree) pairs
+    # still to be compared; each directory's items are pushed in reverse
+    stack = [('', old, new)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, MerkleChange):
+            yield item
+            continue
+        (path, old_tree, new_tree) = item
+        if old_tree.bin_hash == new_tree.bin_hash:
+            continue
+        prefix = path + '/' if path else ''
+        pending = []
+        old_nodes = old_tree.nodes
+        new_nodes = new_tree.nodes
+        old_ndx = new_ndx = 0
+        while old_ndx < len(old_nodes) or new_ndx < len(new_nodes):
+            o_node = old_nodes[old_ndx] if old_ndx < len(old_nodes) else None
+            n_node = new_nodes[new_ndx] if new_ndx < len(new_nodes) else None
+            if n_node is None or \
+                    (o_node is not None and o_node.name < n_node.name):
+                pending.append(_removed(prefix, o_node))
+                old_ndx += 1
+            elif o_node is None or n_node.name < o_node.name:
+                pending.append(_added(prefix, n_node))
+                new_ndx += 1
+            else:
+                old_ndx += 1
+                new_ndx += 1
+                if o_node.bin_hash == n_node.bin_hash and \
+                        o_node.is_leaf == n_node.is_leaf:
+                    continue
+                child_path = prefix + o_node.name
+                if o_node.is_leaf and n_node.is_leaf:
+                    pending.append(MerkleChange(
+                        MODIFIED, child_path, False,
+                        o_node.bin_hash, n_node.bin_hash))
+                elif not o_node.is_leaf and not n_node.is_leaf:
+                    pending.append((child_path, o_node, n_node))
+                else:
+                    pending.append(_removed(prefix, o_node))
+                    pending.append(_added(prefix, n_node))
+        stack.extend(reversed(pending))
+
+
+def _added(prefix, node):
+    return MerkleChange(ADDED, prefix + node.name, not node.is_leaf,
+                        None, node.bin_hash)
+
+
+def _removed(prefix, node):
+    return MerkleChange(REMOVED, prefix + node.name, not node.is_leaf,
+                        node.bin_hash, None)
+
+
+def verify(tree, path_to_dir, workers=None, fail_fast=False,
+           exclusions=None, matches=None, cache=None, ex_re=None,
+           match_re=None):
+    """
+    Generate a MerkleChange for each difference between a MerkleTree or
+    MerkleDoc and the directory at path_to_dir, in order by path, as
+    diff() would between the tree and one built from the directory.
+    old_hash is the hash expected and new_hash that found, if known.
+
+    Only files present on both sides are hashed, by a pool of workers
+    threads if workers is more than one; the walk is then parallel too,
+    the pool scanning the directories next in line while those before
+    them are compared.  A file or directory on one
+    side only is reported without reading it, so a directory missing
+    from the file system or not in the tree is reported once rather
+    than file by file.  Files are hashed the way the tree's leaves
+    were, in chunks for ChunkedMerkleLeafs.  Differences are yielded as
+    soon as they and everything before them are settled, with the walk
+    running at most a few files ahead of the hashing.  If fail_fast is
+    True, nothing more is done after the first difference.
+
+    exclusions and matches select the files to be compared, as for
+    MerkleDoc.create_from_file_system(), or else the compiled ex_re and
+    match_re as for MerkleTree.create_from_file_system().  cache is an
+    optional LeafHashCache.  Raises RuntimeError at once if path_to_dir
+    is not a directory.
+    """
+    if isinstance(tree, MerkleDoc):
+        tree = tree.tree
+    MerkleTree.check_dir_path(path_to_dir)
+    if exclusions:
+        ex_re = make_ex_re(exclusions)
+    if matches:
+        match_re = make_match_re(matches)
+    return _verify(tree, path_to_dir, workers, fail_fast, cache, ex_re,
+                   match_re)
+
+
+def _verify(tree, path_to_dir, workers, fail_fast, cache, ex_re, match_re):
+    """ Do the work of verify(). """
+    hashtype = tree.hashtype
+    pool = None
+    if workers and workers > 1:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    chunk_pool = None
+    window = deque()            # MerkleChanges and (path, leaf, Futures)
+    limit = 2 * workers if pool else 1
+    scans = {}                  # path -> Future of _verify_dir()
+
+    def check_leaf(path_to_file, leaf):
+        """ Return the hash of the file, made like that of the leaf. """
+        return MerkleLeaf.create_from_file_system(
+            path_to_file, leaf.name, hashtype, cache, None,
+            leaf.chunk_bits, chunk_pool).bin_hash
+
+    def settle(item):
+        """ Return the MerkleChange for a window item, or None. """
+        if isinstance(item, MerkleChange):
+            return item
+        (path, leaf, future) = item
+        found = future.result()
+        if found == leaf.bin_hash:
+            return None
+        return MerkleChange(MODIFIED, path, False, leaf.bin_hash, found)
+
+    try:
+        # as in diff(), a stack of items still to be compared, each
+        # directory's being pushed in reverse
+        stack = [('', tree, path_to_dir)]
+        while stack:
+            if pool:
+                # scan the directories which will be visited soonest
+                for item in stack[-limit:]:
+                    if not isinstance(item, MerkleChange) and \
+                            not item[1].is_leaf and item[0] not in scans:
+                        scans[item[0]] = pool.submit(
+                            _verify_dir, item[0], item[1], item[2], ex_re,
+                            match_re)
+            item = stack.pop()
+            if isinstance(item, MerkleChange):
+                window.append(item)
+            else:
+                (path, node, path_on_disk) = item
+                if node.is_leaf:
+                    if node.chunk_bits and chunk_pool is None:
+                        chunk_pool = MerkleTree.make_chunk_pool(
+                            node.chunk_bits, workers)
+                    if pool:
+                        future = pool.submit(check_leaf, path_on_disk, node)
+                    else:
+                        future = _Done(check_leaf(path_on_disk, node))
+                    window.append((path, node, future))
+                elif path in scans:
+                    stack.extend(reversed(scans.pop(path).result()))
+                else:
+                    stack.extend(reversed(_verify_dir(
+                        path, node, path_on_disk, ex_re, match_re)))
+            while len(window) >= limit or (window and not stack):
+                change = settle(window.popleft())
+                if change is not None:
+                    yield change
+                    if fail_fast:
+                        return
+    finally:
+        for item in window:
+            if not isinstance(item, MerkleChange):
+                item[2].cancel()
+        for future in scans.values():
+            future.cancel()
+        if pool is not None:
+            pool.shutdown()
+        if chunk_pool is not None:
+            chunk_pool.shutdown()
+
+
+class _Done(object):
+    """ Stands in for the Future of a leaf hashed without a pool. """
+
+    __slots__ = ['_result', ]
+
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        """ Return the hash, as Future.result() would. """
+        return self._result
+
+    def cancel(self):
+        """ The work is done, so like a finished Future it can't be. """
+        return False
+
+
+def _verify_dir(path, tree, path_to_dir, ex_re, match_re):
+    """
+    Compare the children of a directory in the tree with the entries
+    of the directory on disk, returning in order by name MerkleChanges
+    for those on one side only and (path, node, path on disk) for those
+    still to be compared.
+    """
+    prefix = path + '/' if path else ''
+    items = []
+    nodes = tree.nodes
+    members = MerkleTree.scan_dir(path_to_dir, ex_re, match_re)
+    ndx = m_ndx = 0
+    while ndx < len(nodes) or m_ndx < len(members):
+        node = nodes[ndx] if ndx < len(nodes) else None
+        (name, path_on_disk, is_dir) = (members[m_ndx]
+                                        if m_ndx < len(members)
+                                        else (None, None, None))
+        if name is None or (node is not None and node.name < name):
+            items.append(_removed(prefix, node))
+            ndx += 1
+        elif node is None or name < node.name:
+            items.append(MerkleChange(ADDED, prefix + name, is_dir,
+                                      None, None))
+            m_ndx += 1
+        else:
+            ndx += 1
+            m_ndx += 1
+            if node.is_leaf == (not is_dir):
+                items.append((prefix + name, node, path_on_disk))
+            else:
+                items.append(_removed(prefix, node))
+                items.append(MerkleChange(ADDED, prefix + name, is_dir,
+                                          None, None))
+    return items
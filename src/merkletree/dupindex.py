@@ -0,0 +1,170 @@
+# merkletree/dupindex.py
+
+"""
+Find duplicated files and directories in a MerkleTree by their hashes,
+reporting each set of identical subtrees once, at its highest level.
+"""
+
+import os
+from collections import namedtuple
+
+from merkletree import MerkleDoc
+
+__all__ = ['DuplicateGroup', 'DuplicateIndex', ]
+
+# paths are relative to the top of the tree, in preorder; size is that
+# of one copy in bytes, and reclaimable that of all copies but one;
+# both are None if sizes are not known
+DuplicateGroup = namedtuple(
+    'DuplicateGroup', ['bin_hash', 'is_dir', 'paths', 'size', 'reclaimable'])
+
+
+class DuplicateIndex(object):
+    """
+    Counts the occurrences of each distinct hash in a MerkleTree or
+    MerkleDoc, files and directories alike, and groups the paths of
+    those occurring more than once.  Nodes without a hash (empty
+    directories) are ignored.
+
+    A directory which is duplicated is reported as one group.  Its
+    contents are then considered only within the first copy, in
+    preorder, so a file inside it is reported separately only if it
+    also has a copy outside the group.  Within a group of directories,
+    deleting all but one removes every duplicate inside them.
+
+    If path_to_dir is the directory from which the tree was built, the
+    size of each file in a group is taken from the file system, once
+    per distinct hash, and the size of a directory is the sum of those
+    of the files in it.
+
+    Apart from the groups themselves, only a count is held for each
+    distinct hash, so memory use grows with the number of distinct
+    hashes rather than with the number of paths.
+    """
+
+    def __init__(self, tree, path_to_dir=None):
+        if isinstance(tree, MerkleDoc):
+            tree = tree.tree
+        self._tree = tree
+        self._path_to_dir = path_to_dir
+        self._counts = {}
+        self._sizes = {}                # leaf hash -> bytes, when known
+        counts = self._counts
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            hash_ = node.bin_hash
+            if hash_:
+                counts[hash_] = counts.get(hash_, 0) + 1
+            if not node.is_leaf:
+                stack.extend(node.nodes)
+        self._groups = self._find_groups()
+
+    def _find_groups(self):
+        """
+        Walk the tree in preorder collecting the paths of duplicated
+        nodes, not descending into any copy of a directory but the first.
+        """
+        counts = self._counts
+        groups = {}                     # hash -> [is_dir, paths, node]
+        stack = [('', node) for node in reversed(self._tree.nodes)]
+        while stack:
+            (prefix, node) = stack.pop()
+            path = prefix + node.name
+            hash_ = node.bin_hash
+            if hash_ and counts[hash_] > 1:
+                group = groups.get(hash_)
+                if group is None:
+                    groups[hash_] = [not node.is_leaf, [path], node]
+                else:
+                    group[1].append(path)
+                    continue            # a later copy: skip its contents
+            if not node.is_leaf:
+                stack.extend((path + '/', child)
+                             for child in reversed(node.nodes))
+
+        result = []
+        for (hash_, (is_dir, paths, node)) in groups.items():
+            if len(paths) < 2:
+                continue                # other copies lie in later copies
+            size = self._size_of(paths[0], node)
+            result.append(DuplicateGroup(
+                hash_, is_dir, paths, size,
+                None if size is None else size * (len(paths) - 1)))
+        if self._path_to_dir is None:
+            result.sort(key=lambda g: (-len(g.paths), g.paths[0]))
+        else:
+            result.sort(key=lambda g: (-(g.reclaimable or 0), g.paths[0]))
+        return result
+
+    def _size_of(self, path, node):
+        """
+        Return the number of bytes in the file or directory at path, or
+        None if the tree's directory is unknown or a file can't be read.
+        """
+        if self._path_to_dir is None:
+            return None
+        total = 0
+        stack = [(os.path.join(self._path_to_dir, path), node)]
+        while stack:
+            (path, node) = stack.pop()
+            if not node.is_leaf:
+                stack.extend((os.path.join(path, child.name), child)
+                             for child in node.nodes)
+                continue
+            size = self._sizes.get(node.bin_hash)
+            if size is None:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    return None
+                self._sizes[node.bin_hash] = size
+            total += size
+        return total
+
+    # ACCESS ########################################################
+
+    def __len__(self):
+        """ Return the number of distinct hashes in the tree. """
+        return len(self._counts)
+
+    def __contains__(self, bin_hash):
+        return bin_hash in self._counts
+
+    def count(self, bin_hash):
+        """ Return the number of nodes in the tree with the hash. """
+        return self._counts.get(bin_hash, 0)
+
+    @property
+    def groups(self):
+        """
+        The list of DuplicateGroups, those with the most reclaimable
+        bytes first if sizes are known and otherwise those with the most
+        copies first.
+        """
+        return self._groups
+
+    @property
+    def reclaimable(self):
+        """
+        The total number of bytes which deleting all but one copy in
+        each group would free, or None if sizes are not known.
+        """
+        if self._path_to_dir is None:
+            return None
+        return sum(group.reclaimable or 0 for group in self._groups)
+
+    def find(self, bin_hash):
+        """
+        Generate the path of every node in the tree with the hash, in
+        preorder.  This walks the whole tree.
+        """
+        stack = [('', node) for node in reversed(self._tree.nodes)]
+        while stack:
+            (prefix, node) = stack.pop()
+            path = prefix + node.name
+            if node.bin_hash == bin_hash:
+                yield path
+            if not node.is_leaf:
+                stack.extend((path + '/', child)
+                             for child in reversed(node.nodes))
@@ -0,0 +1,347 @@
+# merkletree/indexed.py
+
+"""
+An on-disk layout for a MerkleTree or MerkleDoc which can be opened with
+mmap and queried without being loaded: the hash of any node is found in
+O(depth * log(fanout)) and any subtree can be enumerated on its own.
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from collections import deque
+
+from xlattice import HashTypes
+
+from merkletree import (MerkleDoc, MerkleTree, MerkleParseError,
+                        bin_hash_len, new_leaf)
+
+__all__ = ['IndexedMerkleFile', 'write_indexed', ]
+
+# The file is a fixed header, the document hash (all zeroes for a bare
+# tree), a table of fixed-size node records in breadth-first order, and
+# a table of UTF-8 names.  Because nodes are numbered breadth-first the
+# children of a directory occupy consecutive records, in order by name,
+# and so can be binary searched.
+
+INDEXED_MAGIC = b'MRKI'
+INDEXED_VERSION = 1
+
+# magic, version, hashtype, kind, flags, node count, offset of names,
+# offset and length of the document path within the names
+HEADER = struct.Struct('<4sBBBBQQQI')
+
+# offset and length of the name, first child, count of children, flags;
+# followed by the hash
+RECORD = struct.Struct('<QIIIB')
+
+KIND_TREE = 0
+KIND_DOC = 1
+FLAG_DIR = 0x01
+FLAG_HASH = 0x02
+CHUNK_SHIFT = 2                 # the rest of the flags: a leaf's chunk_bits
+
+
+def write_indexed(node, path_to_file):
+    """
+    Write a MerkleTree or MerkleDoc to path_to_file in indexed form.
+    Children are written in order by name, which is the order in
+    which create_from_file_system() builds them.
+    """
+    if isinstance(node, MerkleDoc):
+        kind = KIND_DOC
+        tree = node.tree
+        doc_path = node.path.encode('utf-8')
+        doc_hash = node.bin_hash
+    elif isinstance(node, MerkleTree):
+        kind = KIND_TREE
+        tree = node
+        doc_path = b''
+        doc_hash = None
+    else:
+        raise RuntimeError("can only index a MerkleTree or MerkleDoc")
+    hashtype = tree.hashtype
+    hash_len = bin_hash_len(hashtype)
+    no_hash = bytes(hash_len)
+    if not doc_hash:
+        doc_hash = no_hash
+
+    with open(path_to_file, 'wb') as file, \
+            tempfile.TemporaryFile() as names:
+        file.write(HEADER.pack(INDEXED_MAGIC, 0, 0, 0, 0, 0, 0, 0, 0))
+        file.write(doc_hash)
+        names.write(doc_path)
+        name_offset = len(doc_path)
+
+        queue = deque([tree])
+        next_ndx = 1                    # the number of the next child
+        count = 0
+        while queue:
+            node = queue.popleft()
+            count += 1
+            name = node.name.encode('utf-8')
+            names.write(name)
+            flags = 0
+            first_child = 0
+            child_count = 0
+            if node.is_leaf:
+                flags |= node.chunk_bits << CHUNK_SHIFT
+            else:
+                flags |= FLAG_DIR
+                children = sorted(node.nodes, key=lambda n: n.name)
+                first_child = next_ndx
+                child_count = len(children)
+                next_ndx += child_count
+                queue.extend(children)
+            hash_ = node.bin_hash
+            if hash_:
+                flags |= FLAG_HASH
+            else:
+                hash_ = no_hash
+            file.write(RECORD.pack(name_offset, len(name), first_child,
+                                   child_count, flags))
+            file.write(hash_)
+            name_offset += len(name)
+
+        names_offset = file.tell()
+        names.seek(0)
+        shutil.copyfileobj(names, file)
+        file.seek(0)
+        file.write(HEADER.pack(INDEXED_MAGIC, INDEXED_VERSION,
+                               int(hashtype), kind, 0, count,
+                               names_offset, 0, len(doc_path)))
+
+
+class IndexedMerkleFile(object):
+    """
+    Read-only access to a file written by write_indexed().  Nothing is
+    read until it is asked for, so a multi-gigabyte file opens at once
+    and queries touch only the pages they need.
+
+    Paths are relative to the top directory, whose own path is ''.
+    """
+
+    def __init__(self, path_to_file):
+        self._file = open(path_to_file, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size < HEADER.size:
+                raise MerkleParseError(
+                    "%s is not an indexed merkletree file" % path_to_file)
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+        (magic, version, hashtype, kind, _, count, names_offset,
+         doc_path_offset, doc_path_len) = HEADER.unpack_from(self._map, 0)
+        try:
+            if magic != INDEXED_MAGIC:
+                raise MerkleParseError(
+                    "%s is not an indexed merkletree file" % path_to_file)
+            if version != INDEXED_VERSION:
+                raise MerkleParseError(
+                    "unsupported indexed file version %d" % version)
+            try:
+                self._hashtype = HashTypes(hashtype)
+            except ValueError:
+                raise MerkleParseError(
+                    "unknown hashtype %d" % hashtype) from None
+            self._hash_len = bin_hash_len(self._hashtype)
+            self._kind = kind
+            self._count = count
+            self._names = names_offset
+            self._records = HEADER.size + self._hash_len
+            self._record_size = RECORD.size + self._hash_len
+            if count == 0 or self._records + count * self._record_size \
+                    != names_offset or names_offset > len(self._map):
+                raise MerkleParseError("%s is corrupt" % path_to_file)
+        except BaseException:
+            self.close()
+            raise
+        self._doc_path = None
+        self._doc_hash = None
+        if kind == KIND_DOC:
+            start = names_offset + doc_path_offset
+            self._doc_path = str(
+                self._map[start:start + doc_path_len], 'utf-8')
+            self._doc_hash = self._map[HEADER.size:self._records]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Unmap and close the file. """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # PROPERTIES ####################################################
+
+    @property
+    def hashtype(self):
+        """ Return the hash type used in the tree. """
+        return self._hashtype
+
+    @property
+    def node_count(self):
+        """ Return the number of nodes, directories and files, stored. """
+        return self._count
+
+    @property
+    def name(self):
+        """ Return the name of the top directory. """
+        return self._name(0)
+
+    @property
+    def bin_hash(self):
+        """ Return the binary hash of the top directory. """
+        return self._hash(0)
+
+    @property
+    def doc_path(self):
+        """ Return the path of the MerkleDoc stored, or None. """
+        return self._doc_path
+
+    @property
+    def doc_hash(self):
+        """ Return the binary hash of the MerkleDoc stored, or None. """
+        return self._doc_hash
+
+    # INTERNALS #####################################################
+
+    def _record(self, ndx):
+        """
+        Return (name offset, name length, first child, child count, flags)
+        for node ndx.
+        """
+        return RECORD.unpack_from(self._map,
+                                  self._records + ndx * self._record_size)
+
+    def _name_bytes(self, ndx):
+        (name_offset, name_len, _, _, _) = self._record(ndx)
+        start = self._names + name_offset
+        return self._map[start:start + name_len]
+
+    def _name(self, ndx):
+        return str(self._name_bytes(ndx), 'utf-8')
+
+    def _hash(self, ndx):
+        start = self._records + ndx * self._record_size
+        if not self._map[start + RECORD.size - 1] & FLAG_HASH:
+            return None
+        start += RECORD.size
+        return self._map[start:start + self._hash_len]
+
+    def _find(self, path):
+        """
+        Return the number of the node at path, binary searching each
+        directory on the way, or None if there is no such node.
+        """
+        ndx = 0
+        for part in path.split('/'):
+            if not part:
+                continue            # tolerate leading, trailing, double /
+            (_, _, first, count, flags) = self._record(ndx)
+            if not flags & FLAG_DIR:
+                return None
+            key = part.encode('utf-8')
+            low, high = first, first + count
+            while low < high:
+                mid = (low + high) // 2
+                if self._name_bytes(mid) < key:
+                    low = mid + 1
+                else:
+                    high = mid
+            if low == first + count or self._name_bytes(low) != key:
+                return None
+            ndx = low
+        return ndx
+
+    def _find_or_raise(self, path):
+        ndx = self._find(path)
+        if ndx is None:
+            raise KeyError(path)
+        return ndx
+
+    # QUERIES #######################################################
+
+    def __contains__(self, path):
+        return self._find(path) is not None
+
+    def get_hash(self, path):
+        """
+        Return the binary hash of the node at path, which is None for
+        an empty directory.  Raises KeyError if there is no such node.
+        """
+        return self._hash(self._find_or_raise(path))
+
+    def get_hex_hash(self, path):
+        """ Return the hash of the node at path as a hex value. """
+        hash_ = self.get_hash(path)
+        if hash_ is None:
+            return '0' * (2 * self._hash_len)
+        return hash_.hex()
+
+    def is_dir(self, path):
+        """ Return whether the node at path is a directory. """
+        (_, _, _, _, flags) = self._record(self._find_or_raise(path))
+        return bool(flags & FLAG_DIR)
+
+    def list_dir(self, path=''):
+        """ Return the names of the members of the directory at path. """
+        (_, _, first, count, flags) = self._record(self._find_or_raise(path))
+        if not flags & FLAG_DIR:
+            raise NotADirectoryError(path)
+        return [self._name(ndx) for ndx in range(first, first + count)]
+
+    def iter_subtree(self, path=''):
+        """
+        Generate (path, binary hash, is_dir) for the node at path and
+        everything below it, in preorder.  Paths are relative to the top
+        directory.
+        """
+        path = '/'.join(part for part in path.split('/') if part)
+        stack = [(path, self._find_or_raise(path))]
+        while stack:
+            (path, ndx) = stack.pop()
+            (_, _, first, count, flags) = self._record(ndx)
+            is_dir = bool(flags & FLAG_DIR)
+            yield (path, self._hash(ndx), is_dir)
+            if is_dir:
+                prefix = path + '/' if path else ''
+                for child in range(first + count - 1, first - 1, -1):
+                    stack.append((prefix + self._name(child), child))
+
+    def to_merkle_tree(self, path=''):
+        """
+        Materialize the subtree at path, which must be a directory,
+        as a MerkleTree.
+        """
+        ndx = self._find_or_raise(path)
+        (_, _, first, count, flags) = self._record(ndx)
+        if not flags & FLAG_DIR:
+            raise NotADirectoryError(path)
+        root = MerkleTree(self._name(ndx), self._hashtype)
+        root.bin_hash = self._hash(ndx)
+        stack = [(root, first, count)]
+        while stack:
+            (tree, first, count) = stack.pop()
+            for child in range(first, first + count):
+                (_, _, c_first, c_count, flags) = self._record(child)
+                if flags & FLAG_DIR:
+                    node = MerkleTree(self._name(child), self._hashtype)
+                    node.bin_hash = self._hash(child)
+                    stack.append((node, c_first, c_count))
+                else:
+                    node = new_leaf(self._name(child), self._hashtype,
+                                    self._hash(child), flags >> CHUNK_SHIFT)
+                tree.nodes.append(node)
+        return root
@@ -0,0 +1,63 @@
+# merkletree/merge.py
+
+"""
+Combine MerkleTrees built separately, such as those written by several
+machines each hashing some of the subdirectories of a shared file
+system, into the tree for the directory above them.
+"""
+
+from xlattice import HashTypes, check_hashtype
+
+from merkletree import MerkleDoc, MerkleTree
+
+__all__ = ['merge', ]
+
+
+def merge(name, pieces, hashtype=HashTypes.SHA2):
+    """
+    Return a new MerkleTree called name with each of the MerkleTrees in
+    pieces grafted below it.  A piece is a MerkleTree or MerkleDoc,
+    which becomes a child of the top of the new tree, or a (path, tree)
+    pair, where path is '/'-separated, relative to the top, and ends in
+    the tree's name.  Directories on the way to a graft point which are
+    not themselves pieces are added, and hold only what is grafted into
+    them.  The order of the pieces does not matter.
+
+    The hashes of the pieces are used as they are, and only those of
+    the directories above the graft points are computed, so the cost is
+    proportional to the number of pieces times their depth.
+
+    Raises RuntimeError if a piece is not of the hashtype, if two pieces
+    have the same path or one would be grafted inside another, or if a
+    path does not end in the name of its tree.
+    """
+    check_hashtype(hashtype)
+    grafts = {}
+    for piece in pieces:
+        if isinstance(piece, (MerkleTree, MerkleDoc)):
+            (path, tree) = (None, piece)
+        else:
+            (path, tree) = piece
+        if isinstance(tree, MerkleDoc):
+            tree = tree.tree
+        if not isinstance(tree, MerkleTree):
+            raise RuntimeError("can't merge %r: not a MerkleTree" % (tree,))
+        if path is None:
+            path = tree.name
+        path = '/'.join(part for part in path.split('/') if part)
+        if path in grafts:
+            raise RuntimeError("more than one tree to merge at %s" % path)
+        grafts[path] = tree
+    for path in grafts:
+        parent = path
+        while '/' in parent:
+            parent = parent.rpartition('/')[0]
+            if parent in grafts:
+                raise RuntimeError("can't merge %s into the tree at %s" % (
+                    path, parent))
+
+    root = MerkleTree(name, hashtype)
+    for (path, tree) in grafts.items():
+        root.replace_subtree(path, tree)
+    root.rehash()                       # the hashes above the grafts
+    return root
@@ -0,0 +1,159 @@
+# merkletree/sharded.py
+
+"""
+Build the MerkleTree for a large directory structure in several
+processes, each hashing a share of it, and stitch the pieces together
+into the tree which a serial build would produce.
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from xlattice import HashTypes, check_hashtype
+
+from merkletree import MerkleLeaf, MerkleTree, check_chunk_bits
+from merkletree.stats import BuildStats
+
+__all__ = ['create_sharded', 'SHARD_FILES', 'SHARD_BYTES', ]
+
+# a worker stops taking on more of its share of the tree once it has
+# hashed this many files or read this many bytes
+SHARD_FILES = 4096
+SHARD_BYTES = 1024 * 1024 * 1024
+
+
+def create_sharded(path_to_dir, hashtype=HashTypes.SHA2, ex_re=None,
+                   match_re=None, processes=None, stats=None,
+                   chunk_bits=None, shard_files=SHARD_FILES,
+                   shard_bytes=SHARD_BYTES):
+    """
+    Return the MerkleTree for the directory at path_to_dir, built by a
+    ProcessPoolExecutor with processes workers, by default one per CPU.
+
+    The first worker builds the tree from the top down until it has
+    hashed shard_files files or read shard_bytes bytes.  Directories it
+    has not reached are left empty and handed back to be built by other
+    workers in the same way, so big subtrees are subdivided as often as
+    need be while small ones cost a single task.  The files of any one
+    directory holding more than shard_files of them are hashed in
+    slices of that many.  Each worker returns its piece of the tree in
+    binary form, which is grafted into place with replace_subtree() or
+    upsert_leaf().  Slices finish in any order, so they are collected
+    and put into their directories with one upsert_leaves() each once
+    all are done.  The hashes above the graft points are recomputed
+    once at the end.  The tree is identical to the serial one.
+
+    ex_re, match_re and chunk_bits are as for
+    MerkleTree.create_from_file_system(); large files are hashed in
+    chunks one at a time within each worker.  If stats is a BuildStats,
+    the counts and timings of every worker are added to it.
+    """
+    check_hashtype(hashtype)
+    name = MerkleTree.check_dir_path(path_to_dir)
+    if chunk_bits:
+        check_chunk_bits(chunk_bits)
+    if shard_files < 1 or shard_bytes < 1:
+        raise RuntimeError("shard_files and shard_bytes must be positive")
+    root = MerkleTree(name, hashtype, ex_re, match_re)
+    args = (path_to_dir, hashtype, ex_re, match_re, chunk_bits,
+            shard_files, shard_bytes)
+    slices = {}                         # relative path -> list of leaves
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        pending = {pool.submit(_build_shard, '', None, *args): ('', None)}
+        try:
+            while pending:
+                (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    (rel, names) = pending.pop(future)
+                    (piece, deferred, piece_stats) = future.result()
+                    if names is None:
+                        _graft(root, rel, piece)
+                    else:
+                        slices.setdefault(rel, []).extend(piece)
+                    if stats is not None:
+                        stats.merge(piece_stats)
+                    for (rel, names) in deferred:
+                        pending[pool.submit(
+                            _build_shard, rel, names, *args)] = (rel, names)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    for (rel, leaves) in slices.items():
+        root.upsert_leaves(rel, leaves)
+    root.rehash()
+    return root
+
+
+def _graft(root, rel, piece):
+    """
+    Put the binary form of the MerkleTree which a worker built for the
+    directory at the relative path rel into the tree.
+    """
+    tree = MerkleTree.create_from_binary(piece)
+    if rel:
+        root.replace_subtree(rel, tree)
+        return
+    for node in tree.nodes:             # the top, built first
+        if node.is_leaf:
+            root.upsert_leaf(node.name, node.bin_hash, node.chunk_bits)
+        else:
+            root.replace_subtree(node.name, node)
+
+
+def _build_shard(rel, names, path_to_dir, hashtype, ex_re, match_re,
+                 chunk_bits, shard_files, shard_bytes):
+    """
+    Run in a worker process to build the part of the tree below the
+    directory at the relative path rel, returning it with a list of the
+    (rel, names) still to be done and the BuildStats for the work.
+
+    If names is None, the MerkleTree for the directory is built as
+    create_sharded() describes, and returned in binary form.  Otherwise
+    the named files in the directory are hashed, and a list of (name,
+    hash, chunk_bits) is returned.
+    """
+    stats = BuildStats()
+    top = os.path.join(path_to_dir, rel) if rel else path_to_dir
+    if names is not None:
+        leaves = []
+        for name in names:
+            leaf = MerkleLeaf.create_from_file_system(
+                os.path.join(top, name), name, hashtype, None, stats,
+                chunk_bits)
+            leaves.append((name, leaf.bin_hash, leaf.chunk_bits))
+        return (leaves, [], stats)
+
+    tree = MerkleTree(top.rpartition('/')[2], hashtype, ex_re, match_re)
+    trees = []                          # in the order walked, parents first
+    deferred = []
+    stack = [(tree, rel, top)]
+    while stack:
+        (tree, rel, path) = stack.pop()
+        if trees and (stats.files + stats.cached_files >= shard_files or
+                      stats.bytes_read >= shard_bytes):
+            deferred.append((rel, None))            # left empty for now
+            continue
+        trees.append(tree)
+        members = MerkleTree.scan_dir(path, ex_re, match_re, stats)
+        files = [name for (name, _, is_dir) in members if not is_dir]
+        sliced = len(files) > shard_files
+        if sliced:
+            deferred.extend((rel, files[start:start + shard_files])
+                            for start in range(0, len(files), shard_files))
+        subdirs = []
+        for (name, path_to_file, is_dir) in members:
+            child_rel = rel + '/' + name if rel else name
+            if is_dir:
+                node = MerkleTree(name, hashtype, ex_re, match_re)
+                subdirs.append((node, child_rel, path_to_file))
+            elif sliced:
+                continue
+            else:
+                node = MerkleLeaf.create_from_file_system(
+                    path_to_file, name, hashtype, None, stats, chunk_bits)
+            tree.nodes.append(node)
+        # visit subdirectories in order, each before its successors
+        stack.extend(reversed(subdirs))
+    MerkleTree.settle(trees)
+    return (trees[0].to_bytes(), deferred, stats)
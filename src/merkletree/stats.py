@@ -0,0 +1,190 @@
+# merkletree/stats.py
+
+"""
+Counters and timings collected while building a MerkleTree from the
+file system.  Pass a BuildStats as the stats argument to
+create_from_file_system(); when none is passed nothing is collected.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = ['BuildStats', ]
+
+
+class BuildStats(object):
+    """
+    Collects, for one or more builds: the numbers of directories, files
+    hashed, files taken from a cache, bytes read, entries excluded by
+    the regular expressions, entries ignored because they are neither
+    files nor directories, and read errors; wall clock and CPU time by
+    phase; and the time spent in each directory, from which the slowest
+    subtrees are found.
+
+    The 'scan' and 'hash' phases are summed over directories and files
+    respectively, so with several workers their wall clock time can
+    exceed that of the build as a whole, and their CPU time is that of
+    the threads doing the work.  Other phases are timed as a whole.
+    It is safe to update a BuildStats from several threads.  One may be
+    pickled, as a worker process returns it, and added to another with
+    merge().
+    """
+
+    def __init__(self):
+        self.dirs = 0
+        self.files = 0
+        self.cached_files = 0
+        self.bytes_read = 0
+        self.excluded = 0
+        self.ignored = 0
+        self.errors = 0
+        self._phases = {}               # name -> [wall, cpu]
+        self._dir_times = {}            # directory path -> seconds
+        self._lock = threading.Lock()
+
+    # COLLECTION ####################################################
+
+    def _add_time(self, phase, wall, cpu):
+        times = self._phases.get(phase)
+        if times is None:
+            times = self._phases[phase] = [0.0, 0.0]
+        times[0] += wall
+        times[1] += cpu
+
+    @contextmanager
+    def phase(self, name):
+        """ Time the body of a with statement as the named phase. """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield self
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            with self._lock:
+                self._add_time(name, wall, cpu)
+
+    def add_dir(self, path, wall, cpu, excluded=0, ignored=0):
+        """ Record the scan of a directory. """
+        with self._lock:
+            self.dirs += 1
+            self.excluded += excluded
+            self.ignored += ignored
+            self._add_time('scan', wall, cpu)
+            self._dir_times[path] = self._dir_times.get(path, 0.0) + wall
+
+    def add_file(self, path, size, wall, cpu, cached=False):
+        """
+        Record a file hashed, or found in the cache, with the bytes read
+        and the time taken, which is charged to its directory.
+        """
+        dir_path = os.path.dirname(path)
+        with self._lock:
+            if cached:
+                self.cached_files += 1
+            else:
+                self.files += 1
+                self.bytes_read += size
+            self._add_time('hash', wall, cpu)
+            self._dir_times[dir_path] = \
+                self._dir_times.get(dir_path, 0.0) + wall
+
+    def add_error(self):
+        """ Record a file which could not be read. """
+        with self._lock:
+            self.errors += 1
+
+    def merge(self, other):
+        """
+        Add everything collected in another BuildStats, such as one
+        returned by a worker process, to this one.
+        """
+        state = other.__getstate__()
+        with self._lock:
+            self.dirs += state['dirs']
+            self.files += state['files']
+            self.cached_files += state['cached_files']
+            self.bytes_read += state['bytes_read']
+            self.excluded += state['excluded']
+            self.ignored += state['ignored']
+            self.errors += state['errors']
+            for (name, (wall, cpu)) in state['_phases'].items():
+                self._add_time(name, wall, cpu)
+            for (path, secs) in state['_dir_times'].items():
+                self._dir_times[path] = self._dir_times.get(path, 0.0) + secs
+
+    def __getstate__(self):
+        with self._lock:
+            state = dict(self.__dict__)
+            state['_phases'] = {name: list(times)
+                                for (name, times) in self._phases.items()}
+            state['_dir_times'] = dict(self._dir_times)
+        del state['_lock']              # which can't be pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    # REPORTING #####################################################
+
+    @property
+    def phases(self):
+        """ Return a dictionary mapping phase names to (wall, cpu). """
+        with self._lock:
+            return {name: tuple(times)
+                    for (name, times) in self._phases.items()}
+
+    def slowest_subtrees(self, count=10):
+        """
+        Return up to count (seconds, path) pairs for the directories
+        whose subtrees took longest to scan and hash, slowest first.
+        A subtree's time is that of its own directory and files plus
+        those of all directories below it.
+        """
+        with self._lock:
+            own = dict(self._dir_times)
+        totals = dict(own)
+        for (path, secs) in own.items():
+            parent = os.path.dirname(path)
+            while parent in own and parent != path:
+                totals[parent] += secs
+                (path, parent) = (parent, os.path.dirname(parent))
+        return sorted(((secs, path) for (path, secs) in totals.items()),
+                      reverse=True)[:count]
+
+    def as_dict(self, count=10):
+        """ Return everything collected as a dictionary. """
+        return {
+            'dirs': self.dirs,
+            'files': self.files,
+            'cached_files': self.cached_files,
+            'bytes_read': self.bytes_read,
+            'excluded': self.excluded,
+            'ignored': self.ignored,
+            'errors': self.errors,
+            'phases': {name: {'wall': wall, 'cpu': cpu}
+                       for (name, (wall, cpu)) in self.phases.items()},
+            'slowest_subtrees': [{'path': path, 'seconds': secs} for
+                                 (secs, path) in self.slowest_subtrees(count)],
+        }
+
+    def __str__(self):
+        lines = ["directories:   %d" % self.dirs,
+                 "files hashed:  %d" % self.files,
+                 "files cached:  %d" % self.cached_files,
+                 "bytes read:    %d" % self.bytes_read,
+                 "excluded:      %d" % self.excluded,
+                 "ignored:       %d" % self.ignored,
+                 "read errors:   %d" % self.errors]
+        for (name, (wall, cpu)) in sorted(self.phases.items()):
+            lines.append("%-14s %9.3f s wall %9.3f s cpu" % (
+                name + ':', wall, cpu))
+        slowest = self.slowest_subtrees()
+        if slowest:
+            lines.append("slowest subtrees:")
+            for (secs, path) in slowest:
+                lines.append("  %9.3f s  %s" % (secs, path))
+        return '\n'.join(lines) + '\n'
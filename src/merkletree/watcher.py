@@ -0,0 +1,488 @@
+# merkletree/watcher.py
+
+"""
+Keep the MerkleTree of a directory up to date as its contents change,
+using Linux inotify through ctypes, so that its hash can be read at any
+moment without rebuilding the tree.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from xlattice import HashTypes, check_hashtype
+
+from merkletree import MerkleLeaf, MerkleTree
+
+__all__ = ['MerkleWatcher', 'DEFAULT_DEBOUNCE', 'DEFAULT_MAX_DELAY', ]
+
+# a batch of events is applied once none has arrived for DEFAULT_DEBOUNCE
+# seconds, or DEFAULT_MAX_DELAY seconds after the first, if sooner
+DEFAULT_DEBOUNCE = 0.1
+DEFAULT_MAX_DELAY = 1.0
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# what is watched in each directory: changes to the contents of files
+# in it, and entries appearing and disappearing
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def _libc():
+    """
+    Return the C library, with the inotify functions declared; it is
+    loaded only once.
+    """
+    if not sys.platform.startswith('linux'):
+        raise RuntimeError("MerkleWatcher: inotify needs Linux")
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def _parse_events(data):
+    """ Generate (wd, mask, name) for each inotify_event in data. """
+    offset = 0
+    end = len(data)
+    while offset < end:
+        (wd_, mask, _, length) = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        yield (wd_, mask, os.fsdecode(name))
+
+
+class MerkleWatcher(object):
+    """
+    Builds the MerkleTree for the directory at path_to_dir, then keeps
+    it current by watching every directory in it with inotify.
+
+    Events are collected until none has arrived for debounce seconds,
+    or for at most max_delay seconds, and then applied together, so a
+    storm of writes to a file costs one rehash of it.  Only the files
+    named in the events are rehashed, and only the directories above
+    them have their hashes recomputed.  A directory which appears is
+    scanned as a whole.  If the kernel's event queue overflows, events
+    have been lost without trace of where, so the whole tree is
+    rescanned; files whose stat() is unchanged keep their hashes and
+    only directories with changes below them are rehashed.
+
+    Call poll() to wait for and apply changes, or start() to do so in
+    a background thread.  bin_hash and hex_hash are those of the top of
+    the tree as of the last batch applied, and reading them takes
+    constant time.  Anything else read from the tree while changes may
+    be being applied should be read holding lock.
+
+    ex_re, match_re, cache and chunk_bits are as for
+    MerkleTree.create_from_file_system(); if workers is more than one,
+    the files in directories being scanned are hashed by that many
+    threads.  The top directory itself must not be moved or removed
+    while it is watched.
+    """
+
+    def __init__(self, path_to_dir, hashtype=HashTypes.SHA2, ex_re=None,
+                 match_re=None, workers=None, cache=None, chunk_bits=None,
+                 debounce=DEFAULT_DEBOUNCE, max_delay=DEFAULT_MAX_DELAY):
+        check_hashtype(hashtype)
+        self._name = MerkleTree.check_dir_path(path_to_dir)
+        self._path = path_to_dir
+        self._hashtype = hashtype
+        self._ex_re = ex_re
+        self._match_re = match_re
+        self._cache = cache
+        self._chunk_bits = chunk_bits
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._lock = threading.RLock()
+        self._wds = {}                  # watch descriptor -> relative path
+        self._dirs = {}                 # relative path -> watch descriptor
+        self._keys = {}                 # relative path -> file's stat key
+        self._thread = None
+        self._wake = None               # pipe interrupting the thread
+        self._pool = ThreadPoolExecutor(max_workers=workers) \
+            if workers and workers > 1 else None
+        self._chunk_pool = MerkleTree.make_chunk_pool(chunk_bits, workers)
+
+        libc = _libc()
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_init1: " + os.strerror(errno))
+        try:
+            self._tree = self._scan('', None)
+        except BaseException:
+            self.close()
+            raise
+        self._hashes = (self._tree.bin_hash, self._tree.hex_hash)
+
+    # PROPERTIES ####################################################
+
+    @property
+    def tree(self):
+        """ The MerkleTree being maintained. """
+        return self._tree
+
+    @property
+    def bin_hash(self):
+        """ The binary hash of the top of the tree. """
+        return self._hashes[0]
+
+    @property
+    def hex_hash(self):
+        """ The hash of the top of the tree as a hex value. """
+        return self._hashes[1]
+
+    @property
+    def lock(self):
+        """ The lock held while changes are applied to the tree. """
+        return self._lock
+
+    # WATCHING ######################################################
+
+    def poll(self, timeout=None):
+        """
+        Wait up to timeout seconds, or indefinitely if timeout is None,
+        for events; when some arrive, collect them until they stop and
+        apply them to the tree.  Return True if any were applied.
+        """
+        batch = {}
+        if not self._collect(timeout, batch):
+            return False
+        deadline = time.monotonic() + self._max_delay
+        while True:
+            wait = min(self._debounce, deadline - time.monotonic())
+            if wait <= 0 or not self._collect(wait, batch):
+                break
+        with self._lock:
+            self._apply(batch)
+        return True
+
+    def rescan(self):
+        """
+        Rescan the whole directory now, as is done when the kernel's
+        event queue overflows.  Files whose stat() is unchanged keep
+        their hashes.
+        """
+        with self._lock:
+            self._apply({'': True})
+
+    def start(self):
+        """ Apply changes as they happen in a background thread. """
+        if self._thread is not None:
+            raise RuntimeError("MerkleWatcher is already running")
+        self._wake = os.pipe()
+        self._thread = threading.Thread(
+            target=self._run, name='MerkleWatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the background thread, if there is one. """
+        if self._thread is None:
+            return
+        os.write(self._wake[1], b'x')
+        self._thread.join()
+        for fd_ in self._wake:
+            os.close(fd_)
+        self._thread = self._wake = None
+
+    def close(self):
+        """ Stop watching and release the resources held. """
+        self.stop()
+        if self._fd >= 0:
+            os.close(self._fd)          # which removes all the watches
+            self._fd = -1
+        self._wds.clear()
+        self._dirs.clear()
+        for pool in [self._pool, self._chunk_pool]:
+            if pool is not None:
+                pool.shutdown()
+        self._pool = self._chunk_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _run(self):
+        """ The body of the background thread. """
+        while self._collect(None, None):
+            self.poll(0)
+
+    def _collect(self, timeout, batch):
+        """
+        Wait up to timeout seconds for events and add those which arrive
+        to batch, a dictionary mapping the relative path of each entry
+        affected to True if it must be scanned as a directory.  Return
+        False if there were no events.  If batch is None, just wait for
+        the inotify descriptor to become readable, returning False if
+        instead the background thread has been stopped.
+        """
+        fds = [self._fd]
+        if self._wake is not None:
+            fds.append(self._wake[0])
+        ready = select.select(fds, [], [], timeout)[0]
+        if batch is None:
+            return self._fd in ready and self._wake[0] not in ready
+        if self._fd not in ready:
+            return False
+        found = False
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            found = True
+            self._add_events(_parse_events(data), batch)
+        return found
+
+    def _add_events(self, events, batch):
+        """ Add (wd, mask, name) inotify events to batch. """
+        for (wd_, mask, name) in events:
+            if mask & IN_Q_OVERFLOW:
+                batch[''] = True        # rescan everything
+                continue
+            rel = self._wds.get(wd_)
+            if mask & IN_IGNORED:       # the directory itself is gone
+                if rel is not None and self._dirs.get(rel) == wd_:
+                    del self._dirs[rel]
+                if rel is not None:
+                    del self._wds[wd_]
+                continue
+            if rel is None or not name or not self._wanted(name):
+                continue
+            path = rel + '/' + name if rel else name
+            batch[path] = batch.get(path, False) or bool(
+                mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO))
+
+    def _wanted(self, name):
+        """ Whether the name passes the exclusion and match patterns. """
+        if self._ex_re and self._ex_re.search(name):
+            return False
+        if self._match_re and not self._match_re.search(name):
+            return False
+        return True
+
+    # UPDATING THE TREE #############################################
+
+    def _apply(self, batch):
+        """
+        Bring the entry at each relative path in batch up to date, then
+        recompute the hashes of the directories above those changed.
+        The hashes of the top are kept, so that reading them does not
+        touch the tree.
+        """
+        scanned = set()
+        for path in sorted(batch):
+            # anything below a directory scanned in this batch is done
+            prefix = path
+            while prefix and prefix not in scanned:
+                prefix = prefix.rpartition('/')[0]
+            if prefix in scanned:
+                continue
+            if batch[path]:
+                scanned.add(path)
+            if path:
+                self._update(path, batch[path])
+            else:
+                self._tree = self._scan('', self._tree)
+        self._tree.rehash()
+        self._hashes = (self._tree.bin_hash, self._tree.hex_hash)
+
+    def _update(self, path, rescan):
+        """
+        Make the node for the entry at the relative path match what is
+        on disk, scanning it as a whole if it is a directory which is
+        new or rescan is set.
+        """
+        tree = self._tree
+        parent = tree.get(path.rpartition('/')[0])
+        if parent is None or parent.is_leaf:
+            return                      # went with its parent
+        old = tree.get(path)
+        path_on_disk = os.path.join(self._path, path)
+        try:
+            is_dir = stat.S_ISDIR(os.lstat(path_on_disk).st_mode)
+        except OSError:
+            is_dir = False
+        if is_dir:
+            if old is not None and not old.is_leaf and not rescan:
+                return                  # its own watch reports its contents
+            try:
+                node = self._scan(path, old if rescan and old is not None
+                                  and not old.is_leaf else None)
+            except OSError:
+                node = None             # removed while being scanned
+        elif os.path.isfile(path_on_disk):
+            node = self._leaf(path, path.rpartition('/')[2], None)
+        else:
+            node = None
+        if old is not None and (node is None or old.is_leaf != node.is_leaf):
+            self._forget(path, old)
+            tree.remove(path)
+        if node is None or (node.is_leaf and old == node):
+            return                      # gone, or the same contents
+        if node.is_leaf:
+            tree.upsert_leaf(path, node.bin_hash, node.chunk_bits)
+        else:
+            tree.replace_subtree(path, node)
+
+    def _scan(self, path, old):
+        """
+        Watch the directory at the relative path and everything below
+        it, returning its MerkleTree.  Where old is the MerkleTree it
+        replaces, files whose stat() has not changed since they were
+        hashed keep their MerkleLeafs, and whatever is no longer there
+        is forgotten.
+        """
+        top = path
+        name = path.rpartition('/')[2] if path else self._name
+        root = MerkleTree(name, self._hashtype, self._ex_re, self._match_re)
+        trees = []                      # in the order walked, parents first
+        seen = set()                    # (relative path, is_leaf)
+        stack = [(root, path, old)]
+        while stack:
+            (tree, path, old) = stack.pop()
+            trees.append(tree)
+            seen.add((path, False))
+            self._watch(path)
+            subdirs = []
+            try:
+                members = MerkleTree.scan_dir(
+                    os.path.join(self._path, path) if path else self._path,
+                    self._ex_re, self._match_re)
+            except OSError:
+                if tree is root:
+                    raise               # the top of the scan is gone
+                members = []            # its parent will hear about it
+            for (name, _, is_dir) in members:
+                child_path = path + '/' + name if path else name
+                prev = old.get(name) if old is not None else None
+                if is_dir:
+                    node = MerkleTree(name, self._hashtype, self._ex_re,
+                                      self._match_re)
+                    subdirs.append((node, child_path, None if prev is None
+                                    or prev.is_leaf else prev))
+                    tree.nodes.append(node)
+                    continue
+                seen.add((child_path, True))
+                if self._pool is not None:
+                    node = self._pool.submit(self._leaf, child_path, name,
+                                             prev)
+                else:
+                    node = self._leaf(child_path, name, prev)
+                tree.nodes.append(node)
+            # visit subdirectories in order, each before its successors
+            stack.extend(reversed(subdirs))
+        MerkleTree.settle(trees)
+        if old is not None:
+            self._forget_unseen(top, old, seen)
+        return root
+
+    def _leaf(self, path, name, prev):
+        """
+        Return the MerkleLeaf for the file at the relative path, which
+        is prev if that is a MerkleLeaf and the file's stat() key is the
+        one recorded when it was hashed.
+        """
+        path_on_disk = os.path.join(self._path, path)
+        try:
+            stat_ = os.stat(path_on_disk)
+            key = (stat_.st_dev, stat_.st_ino, stat_.st_size,
+                   stat_.st_mtime_ns)
+        except OSError:
+            key = None
+        if prev is not None and prev.is_leaf and key is not None and \
+                self._keys.get(path) == key:
+            return prev
+        leaf = MerkleLeaf.create_from_file_system(
+            path_on_disk, name, self._hashtype, self._cache, None,
+            self._chunk_bits, self._chunk_pool)
+        if key is not None:
+            self._keys[path] = key
+        return leaf
+
+    def _watch(self, path):
+        """ Add an inotify watch on the directory at the relative path. """
+        path_on_disk = os.path.join(self._path, path) if path else self._path
+        wd_ = _libc().inotify_add_watch(
+            self._fd, os.fsencode(path_on_disk), WATCH_MASK)
+        if wd_ < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_add_watch: " + os.strerror(errno),
+                          path_on_disk)
+        old = self._dirs.get(path)
+        if old is not None and old != wd_ and self._wds.get(old) == path:
+            self._unwatch(path)
+        self._wds[wd_] = path           # a moved directory keeps its wd
+        self._dirs[path] = wd_
+
+    def _unwatch(self, path):
+        """
+        Remove the watch on the directory at the relative path, unless
+        the directory has since been moved to another watched path.
+        """
+        wd_ = self._dirs.pop(path, None)
+        if wd_ is not None and self._wds.get(wd_) == path:
+            del self._wds[wd_]
+            _libc().inotify_rm_watch(self._fd, wd_)     # may be gone
+
+    def _forget(self, path, node):
+        """
+        Drop the watches and stat keys for node, which was at the
+        relative path and has been replaced or removed.
+        """
+        stack = [(path, node)]
+        while stack:
+            (path, node) = stack.pop()
+            if node.is_leaf:
+                self._keys.pop(path, None)
+                continue
+            self._unwatch(path)
+            stack.extend((path + '/' + child.name, child)
+                         for child in node.nodes)
+
+    def _forget_unseen(self, path, old, seen):
+        """
+        Having rescanned the directory at the relative path, forget
+        whatever was in old, its previous MerkleTree, but was not seen.
+        """
+        stack = [(path, old)]
+        while stack:
+            (path, node) = stack.pop()
+            if (path, node.is_leaf) not in seen:
+                self._forget(path, node)
+            elif not node.is_leaf:
+                prefix = path + '/' if path else ''
+                stack.extend((prefix + child.name, child)
+                             for child in node.nodes)
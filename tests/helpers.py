@@ -0,0 +1,51 @@
+# helpers.py
+
+""" Quasi-random files and directory trees shared by the tests. """
+
+import os
+
+MAX_NAME_LEN = 16
+
+
+def unique_path(rng, name_len=MAX_NAME_LEN):
+    """ Return a path under tmp/ which does not yet exist. """
+    path = os.path.join('tmp', rng.next_file_name(name_len))
+    while os.path.exists(path):
+        path = os.path.join('tmp', rng.next_file_name(name_len))
+    return path
+
+
+def write_file(rng, path, size=None):
+    """
+    Write size random bytes, by default between 1 and 512 of them, to
+    the file at path.
+    """
+    if size is None:
+        size = 1 + rng.next_int16(512)
+    with open(path, 'wb') as file:
+        file.write(rng.some_bytes(size))
+
+
+def make_data_dir(rng, depth, width, max_len=256, path=None):
+    """
+    Create a quasi-random directory tree of the given depth and width
+    at path, by default a new one under tmp/, and return the path.
+    """
+    if path is None:
+        path = unique_path(rng)
+    rng.next_data_dir(path, depth=depth, width=width, max_len=max_len)
+    return path
+
+
+def make_mixed_dir(rng):
+    """
+    Create a directory under tmp/ holding a quasi-random tree r beside
+    the directories a and b/c, each of which holds a file f1, and
+    return its path.
+    """
+    top = unique_path(rng)
+    make_data_dir(rng, 3, 3, path=os.path.join(top, 'r'))
+    for sub in ['a', 'b/c']:
+        os.makedirs(os.path.join(top, sub))
+        write_file(rng, os.path.join(top, sub, 'f1'))
+    return top
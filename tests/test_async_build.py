@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# test_async_build.py
+
+""" Test building MerkleTrees and MerkleDocs from asyncio. """
+
+import asyncio
+import os
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleDoc, MerkleTree
+from merkletree.stats import BuildStats
+from helpers import make_data_dir
+
+
+class TestAsyncBuild(unittest.TestCase):
+    """ Test building MerkleTrees and MerkleDocs from asyncio. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    # actual unit tests #############################################
+
+    def do_test_same_tree(self, hashtype):
+        """
+        Verify that asynchronous builds produce the same trees as
+        synchronous ones, however many workers are used.
+        """
+        tree_top = make_data_dir(self.rng, 4, 4)
+        os.mkdir(os.path.join(tree_top, 'empty'))
+        expected = MerkleTree.create_from_file_system(tree_top, hashtype)
+        for workers in [None, 1, 3]:
+            tree = self.loop.run_until_complete(
+                MerkleTree.async_create_from_file_system(
+                    tree_top, hashtype, workers=workers))
+            self.assertEqual(expected, tree)
+            self.assertEqual(expected.to_string(), tree.to_string())
+
+        expected = MerkleDoc.create_from_file_system(tree_top, hashtype)
+        doc = self.loop.run_until_complete(
+            MerkleDoc.async_create_from_file_system(tree_top, hashtype))
+        self.assertEqual(expected, doc)
+        self.assertEqual(expected.bin_hash, doc.bin_hash)
+
+    def test_same_tree(self):
+        """ Test asynchronous builds using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_same_tree(hashtype)
+
+    def test_concurrent_builds(self):
+        """
+        Run several builds at once on one loop and a shared executor,
+        verifying that the loop stays responsive while they run.
+        """
+        tops = [make_data_dir(self.rng, 3, 4) for _ in range(3)]
+        expected = [MerkleTree.create_from_file_system(top) for top in tops]
+        stats = BuildStats()
+        ticks = []
+
+        async def ticker(done):
+            while not done.done():
+                ticks.append(time.time())
+                await asyncio.sleep(0)
+
+        async def build_all(executor):
+            done = self.loop.create_future()
+            tick = asyncio.ensure_future(ticker(done))
+            trees = await asyncio.gather(*[
+                MerkleTree.async_create_from_file_system(
+                    top, workers=2, stats=stats, executor=executor)
+                for top in tops])
+            done.set_result(None)
+            await tick
+            return trees
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            trees = self.loop.run_until_complete(build_all(executor))
+        self.assertEqual(expected, trees)
+        self.assertTrue(len(ticks) > 1)
+        self.assertEqual(sum(len(list(os.walk(top))) for top in tops),
+                         stats.dirs)
+
+    def test_cancel(self):
+        """ Verify that a build which has started can be cancelled. """
+        tree_top = make_data_dir(self.rng, 4, 5)
+
+        async def start_and_cancel():
+            task = asyncio.ensure_future(
+                MerkleTree.async_create_from_file_system(tree_top,
+                                                         workers=2))
+            await asyncio.sleep(0)              # let it start
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        self.loop.run_until_complete(start_and_cancel())
+        # and the loop can still be used afterwards
+        tree = self.loop.run_until_complete(
+            MerkleTree.async_create_from_file_system(tree_top))
+        self.assertEqual(MerkleTree.create_from_file_system(tree_top), tree)
+
+    def test_bad_path(self):
+        """ Verify that bad paths are rejected as they are synchronously. """
+        for path in ['', 'tmp/no-such-dir']:
+            with self.assertRaises(RuntimeError):
+                self.loop.run_until_complete(
+                    MerkleTree.async_create_from_file_system(path))
+            with self.assertRaises(RuntimeError):
+                self.loop.run_until_complete(
+                    MerkleDoc.async_create_from_file_system(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
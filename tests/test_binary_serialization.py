@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# test_binary_serialization.py
+
+""" Test the binary serialization of MerkleTrees and MerkleDocs. """
+
+import io
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleDoc, MerkleTree, MerkleParseError
+from helpers import make_data_dir
+
+
+class TestBinarySerialization(unittest.TestCase):
+    """ Test the binary serialization of MerkleTrees and MerkleDocs. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # actual unit tests #############################################
+
+    def do_test_listing(self, path_to_data, hashtype):
+        """
+        Round trip a stored listing through the binary form, which
+        should be lossless and about half the size.
+        """
+        with open(path_to_data, 'r', encoding='utf-8') as file:
+            serialization = file.read()
+        tree = MerkleTree.create_from_serialization(serialization, hashtype)
+
+        data = tree.to_bytes()
+        self.assertTrue(len(data) < len(serialization.encode('utf-8')) * 2 / 3)
+        tree2 = MerkleTree.create_from_binary(data)
+        self.assertEqual(hashtype, tree2.hashtype)
+        self.assertEqual(tree, tree2)
+        self.assertEqual(serialization, tree2.to_string())
+
+        # from a file object
+        tree3 = MerkleTree.create_from_binary(io.BytesIO(data))
+        self.assertEqual(tree, tree3)
+
+    def test_listings(self):
+        """ Round trip the test data listings. """
+        self.do_test_listing('tests/test_data/dat.xlattice.org',
+                             HashTypes.SHA1)
+        self.do_test_listing('tests/test_data/dat2.xlattice.org',
+                             HashTypes.SHA2)
+
+    def do_test_file_system(self, hashtype):
+        """
+        Round trip trees and documents built from the file system,
+        including an empty directory, which has no hash.
+        """
+        tree_top = make_data_dir(self.rng, 4, 4, max_len=1024)
+        os.mkdir(os.path.join(tree_top, 'empty'))
+
+        tree = MerkleTree.create_from_file_system(tree_top, hashtype)
+        tree2 = MerkleTree.create_from_binary(tree.to_bytes())
+        self.assertEqual(tree, tree2)
+        self.assertEqual(tree.to_string(), tree2.to_string())
+
+        doc = MerkleDoc.create_from_file_system(tree_top, hashtype)
+        buf = io.BytesIO()
+        doc.write_binary(buf)
+        self.assertEqual(doc.to_bytes(), buf.getvalue())
+        doc2 = MerkleDoc.create_from_binary(buf.getvalue())
+        self.assertTrue(doc == doc2)
+        self.assertEqual(doc.to_string(), doc2.to_string())
+
+    def test_file_system(self):
+        """ Round trip file system trees using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_file_system(hashtype)
+
+    def test_bad_input(self):
+        """ Verify that malformed binary serializations are rejected. """
+        tree_top = make_data_dir(self.rng, 2, 4, max_len=1024)
+        doc = MerkleDoc.create_from_file_system(tree_top, HashTypes.SHA2)
+        data = doc.tree.to_bytes()
+        doc_data = doc.to_bytes()
+
+        for bad in [b'', b'MRKL', b'XXXX' + data[4:],
+                    data[:4] + b'\x63' + data[5:],      # version
+                    data[:-1],                          # truncated
+                    data + b'\x00',                     # trailing junk
+                    doc_data]:                          # wrong kind
+            with self.assertRaises(MerkleParseError):
+                MerkleTree.create_from_binary(bad)
+
+        # corrupt the first byte of the document hash
+        bad = bytearray(doc_data)
+        bad[8] ^= 0xff
+        with self.assertRaises(MerkleParseError):
+            MerkleDoc.create_from_binary(bytes(bad))
+
+
+if __name__ == '__main__':
+    unittest.main()
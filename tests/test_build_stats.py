@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# test_build_stats.py
+
+""" Test the counters and timings collected by BuildStats. """
+
+import os
+import re
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleDoc, MerkleTree
+from merkletree.cache import LeafHashCache
+from merkletree.compact import CompactMerkleTree
+from merkletree.stats import BuildStats
+from helpers import make_data_dir
+
+MAX_NAME_LEN = 16
+
+
+class TestBuildStats(unittest.TestCase):
+    """ Test the counters and timings collected by BuildStats. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    @staticmethod
+    def count_files(tree_top):
+        """ Return the numbers of directories, files and bytes. """
+        (dirs, files, size) = (0, 0, 0)
+        for (dir_path, _, names) in os.walk(tree_top):
+            dirs += 1
+            for name in names:
+                files += 1
+                size += os.path.getsize(os.path.join(dir_path, name))
+        return (dirs, files, size)
+
+    # actual unit tests #############################################
+
+    def test_counts(self):
+        """
+        Verify that counts match the file system however the tree is
+        built, and that collecting them does not change the tree.
+        """
+        tree_top = make_data_dir(self.rng, 3, 4)
+        (dirs, files, size) = self.count_files(tree_top)
+        with open(os.path.join(tree_top, 'skip.o'), 'wb') as file:
+            file.write(b'excluded')
+        os.symlink('no-such-target', os.path.join(tree_top, 'dangling'))
+
+        ex_re = re.compile(r'^skip\.o$')
+        expected = MerkleTree.create_from_file_system(
+            tree_top, HashTypes.SHA2, ex_re)
+        for workers in [None, 4]:
+            stats = BuildStats()
+            tree = MerkleTree.create_from_file_system(
+                tree_top, HashTypes.SHA2, ex_re, None, workers,
+                stats=stats)
+            self.assertEqual(expected, tree)
+            self.assertEqual(dirs, stats.dirs)
+            self.assertEqual(files, stats.files)
+            self.assertEqual(size, stats.bytes_read)
+            self.assertEqual(1, stats.excluded)
+            self.assertEqual(1, stats.ignored)      # the dangling link
+            self.assertEqual(0, stats.cached_files)
+            self.assertEqual(0, stats.errors)
+            phases = stats.phases
+            for name in ['build', 'scan', 'hash', 'settle']:
+                self.assertIn(name, phases)
+            self.assertTrue(phases['build'][0] >= phases['settle'][0])
+
+            # the top directory's subtree includes everything else
+            slowest = stats.slowest_subtrees(count=1000)
+            self.assertEqual(dirs, len(slowest))
+            self.assertEqual(tree_top, slowest[0][1])
+            self.assertTrue(stats.as_dict()['phases']['hash']['wall'] > 0)
+            self.assertIn('files hashed:  %d' % files, str(stats))
+
+        stats = BuildStats()
+        compact = CompactMerkleTree.create_from_file_system(
+            tree_top, HashTypes.SHA2, ex_re, stats=stats)
+        self.assertEqual(expected.bin_hash, compact.bin_hash)
+        self.assertEqual((dirs, files, size),
+                         (stats.dirs, stats.files, stats.bytes_read))
+
+    def test_cached(self):
+        """ Verify that files found in a cache are counted as such. """
+        tree_top = make_data_dir(self.rng, 2, 3)
+        (_, files, _) = self.count_files(tree_top)
+        cache_path = os.path.join('tmp', self.rng.next_file_name(
+            MAX_NAME_LEN) + '.cache')
+        with LeafHashCache(cache_path) as cache:
+            MerkleDoc.create_from_file_system(tree_top, cache=cache)
+            stats = BuildStats()
+            MerkleDoc.create_from_file_system(tree_top, cache=cache,
+                                              stats=stats)
+        self.assertEqual(0, stats.files)
+        self.assertEqual(0, stats.bytes_read)
+        self.assertEqual(files, stats.cached_files)
+
+
+if __name__ == '__main__':
+    unittest.main()
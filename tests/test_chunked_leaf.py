@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# test_chunked_leaf.py
+
+""" Test hashing large files in chunks and ChunkedMerkleLeafs. """
+
+import io
+import os
+import struct
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import (ChunkedMerkleLeaf, MerkleDoc, MerkleLeaf,
+                        MerkleTree, MerkleParseError, file_hash_bin,
+                        file_hash_chunked, get_hash_func, CHUNK_HASH_PREFIX,
+                        MIN_CHUNK_BITS)
+from merkletree.compact import CompactMerkleTree
+from merkletree.indexed import IndexedMerkleFile, write_indexed
+from helpers import make_data_dir, unique_path, write_file
+
+CHUNK_BITS = MIN_CHUNK_BITS
+CHUNK_SIZE = 1 << CHUNK_BITS
+
+
+class TestChunkedLeaf(unittest.TestCase):
+    """ Test hashing large files in chunks and ChunkedMerkleLeafs. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    def make_chunked_data_dir(self, depth, width):
+        """
+        Create a quasi-random directory tree under tmp/, adding files of
+        one chunk, of several chunks and of several chunks and a bit.
+        """
+        tree_top = make_data_dir(self.rng, depth, width)
+        for (name, size) in [('one', CHUNK_SIZE),
+                             ('four', 4 * CHUNK_SIZE),
+                             ('five_and_a_bit', 5 * CHUNK_SIZE + 17)]:
+            write_file(self.rng, os.path.join(tree_top, name), size)
+        return tree_top
+
+    @staticmethod
+    def chunked_hash(data, hashtype, chunk_bits):
+        """ Hash data in chunks the slow way. """
+        size = 1 << chunk_bits
+        hashes = []
+        for offset in range(0, len(data) or 1, size):
+            sha = get_hash_func(hashtype)
+            sha.update(data[offset:offset + size])
+            hashes.append(sha.digest())
+        while len(hashes) > 1:
+            pairs = []
+            for ndx in range(0, len(hashes), 2):
+                if ndx + 1 == len(hashes):
+                    pairs.append(hashes[ndx])
+                    continue
+                sha = get_hash_func(hashtype)
+                sha.update(hashes[ndx] + hashes[ndx + 1])
+                pairs.append(sha.digest())
+            hashes = pairs
+        sha = get_hash_func(hashtype)
+        sha.update(CHUNK_HASH_PREFIX + struct.pack('<BQ', chunk_bits,
+                                                   len(data)))
+        sha.update(hashes[0])
+        return sha.digest()
+
+    # actual unit tests #############################################
+
+    def test_file_hash_chunked(self):
+        """ Check file_hash_chunked() against a simple implementation. """
+        path = unique_path(self.rng)
+        os.makedirs('tmp', exist_ok=True)
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            for size in [0, 1, CHUNK_SIZE, 3 * CHUNK_SIZE - 1,
+                         7 * CHUNK_SIZE + 5]:
+                data = self.rng.some_bytes(size) if size else b''
+                with open(path, 'wb') as file:
+                    file.write(data)
+                for hashtype in HashTypes:
+                    expected = self.chunked_hash(data, hashtype, CHUNK_BITS)
+                    self.assertEqual(expected, file_hash_chunked(
+                        path, hashtype, CHUNK_BITS))
+                    self.assertEqual(expected, file_hash_chunked(
+                        path, hashtype, CHUNK_BITS, pool))
+                    self.assertNotEqual(expected,
+                                        file_hash_bin(path, hashtype))
+                    self.assertNotEqual(expected, file_hash_chunked(
+                        path, hashtype, CHUNK_BITS + 1))
+        for bad in [0, MIN_CHUNK_BITS - 1, 41, '12']:
+            with self.assertRaises(RuntimeError):
+                file_hash_chunked(path, HashTypes.SHA2, bad)
+
+    def do_test_tree(self, hashtype):
+        """
+        Build trees with chunking, verifying that only large files are
+        chunked and that every serialization preserves the leaf kind.
+        """
+        tree_top = self.make_chunked_data_dir(3, 3)
+        plain = MerkleTree.create_from_file_system(tree_top, hashtype)
+        tree = MerkleTree.create_from_file_system(tree_top, hashtype,
+                                                  chunk_bits=CHUNK_BITS)
+        self.assertNotEqual(plain, tree)
+        self.assertNotEqual(plain.bin_hash, tree.bin_hash)
+        chunked = 0
+        for (old, new) in zip(plain.nodes, tree.nodes):
+            self.assertEqual(old.name, new.name)
+            path = os.path.join(tree_top, new.name)
+            if new.is_leaf and os.path.getsize(path) > CHUNK_SIZE:
+                chunked += 1
+                self.assertIsInstance(new, ChunkedMerkleLeaf)
+                self.assertEqual(CHUNK_BITS, new.chunk_bits)
+                self.assertEqual(file_hash_chunked(path, hashtype,
+                                                   CHUNK_BITS), new.bin_hash)
+                self.assertNotEqual(old, new)
+            elif new.is_leaf:
+                self.assertEqual(0, new.chunk_bits)
+                self.assertEqual(old, new)
+        self.assertEqual(2, chunked)
+        self.assertEqual(tree, MerkleTree.create_from_file_system(
+            tree_top, hashtype, workers=3, chunk_bits=CHUNK_BITS))
+
+        # text, lazy text, binary, compact and indexed forms
+        text = tree.to_string()
+        self.assertIn('*%d four\n' % CHUNK_BITS, text)
+        self.assertEqual(tree, MerkleTree.create_from_serialization(
+            text, hashtype))
+        lazy = MerkleTree.create_lazy(text.encode('utf-8'), hashtype)
+        self.assertEqual(tree, lazy)
+        self.assertEqual(tree, MerkleTree.create_from_binary(tree.to_bytes()))
+        compact = CompactMerkleTree.create_from_file_system(
+            tree_top, hashtype, chunk_bits=CHUNK_BITS)
+        self.assertEqual(tree, compact.to_merkle_tree())
+        self.assertEqual(text, compact.to_string())
+        self.assertEqual(tree.to_bytes(), compact.to_bytes())
+        self.assertEqual(text, CompactMerkleTree.create_from_stream(
+            io.StringIO(text), hashtype).to_string())
+        self.assertEqual(tree, CompactMerkleTree.create_from_binary(
+            tree.to_bytes()).to_merkle_tree())
+        path = tree_top + '.idx'
+        write_indexed(tree, path)
+        with IndexedMerkleFile(path) as indexed:
+            self.assertEqual(tree, indexed.to_merkle_tree())
+
+        doc = MerkleDoc.create_from_file_system(tree_top, hashtype,
+                                                chunk_bits=CHUNK_BITS)
+        self.assertEqual(tree, doc.tree)
+
+    def test_tree(self):
+        """ Test chunked trees using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_tree(hashtype)
+
+    def test_leaf_equality(self):
+        """ Leaves differing only in their kind are not equal. """
+        hash_ = bytes(range(32))
+        leaf = MerkleLeaf('foo', HashTypes.SHA2, hash_)
+        chunked = ChunkedMerkleLeaf('foo', HashTypes.SHA2, hash_, 20)
+        self.assertNotEqual(leaf, chunked)
+        self.assertNotEqual(chunked, leaf)
+        self.assertNotEqual(chunked, ChunkedMerkleLeaf(
+            'foo', HashTypes.SHA2, hash_, 21))
+        self.assertEqual(chunked, ChunkedMerkleLeaf(
+            'foo', HashTypes.SHA2, hash_, 20))
+        self.assertEqual(hash_.hex() + '*20 foo\n', chunked.to_string())
+
+    def test_bad_markers(self):
+        """ Verify that malformed chunk markers are rejected. """
+        top = '0' * 64 + ' top/'
+        for marker in ['*', '*x', '*3', '*99', '*12*', '**12']:
+            with self.assertRaises(MerkleParseError):
+                MerkleTree.create_from_string_array(
+                    [top, ' ' + 'a' * 64 + marker + ' foo'], HashTypes.SHA2)
+        with self.assertRaises(MerkleParseError):
+            MerkleTree.create_from_string_array(
+                [top, ' ' + 'a' * 64 + '*12 foo/'], HashTypes.SHA2)
+        tree = MerkleTree.create_from_string_array(
+            [top, ' ' + 'a' * 64 + '*12 foo'], HashTypes.SHA2)
+        self.assertEqual(12, tree.nodes[0].chunk_bits)
+
+
+if __name__ == '__main__':
+    unittest.main()
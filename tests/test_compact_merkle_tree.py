@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# test_compact_merkle_tree.py
+
+""" Test the array-backed CompactMerkleTree. """
+
+import io
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleTree, MerkleParseError
+from merkletree.compact import CompactMerkleTree
+from helpers import make_data_dir
+
+
+class TestCompactMerkleTree(unittest.TestCase):
+    """ Test the array-backed CompactMerkleTree. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    def check_equivalent(self, compact, tree):
+        """ Verify that a CompactMerkleTree matches a MerkleTree. """
+        self.assertEqual(tree.hashtype, compact.hashtype)
+        self.assertEqual(tree.name, compact.name)
+        self.assertEqual(tree.bin_hash, compact.bin_hash)
+        self.assertEqual(tree.hex_hash, compact.hex_hash)
+        self.assertEqual(tree.to_string(), compact.to_string())
+        self.assertEqual(tree.to_bytes(), compact.to_bytes())
+        self.assertEqual(tree, compact.to_merkle_tree())
+
+        count = 0
+        stack = [('', tree)]
+        while stack:
+            (path, node) = stack.pop()
+            count += 1
+            ndx = compact.find(path)
+            self.assertEqual(path, compact.path_of(ndx))
+            self.assertEqual(node.name, compact.name_of(ndx))
+            self.assertEqual(node.bin_hash, compact.hash_of(ndx))
+            self.assertEqual(node.bin_hash, compact.get_hash(path))
+            self.assertEqual(not node.is_leaf, compact.is_dir(ndx))
+            if not node.is_leaf:
+                self.assertEqual(
+                    [child.name for child in node.nodes],
+                    [compact.name_of(c) for c in compact.children_of(ndx)])
+                prefix = path + '/' if path else ''
+                for child in node.nodes:
+                    stack.append((prefix + child.name, child))
+        self.assertEqual(count, len(compact))
+        self.assertIsNone(compact.find('no/such/node'))
+        with self.assertRaises(KeyError):
+            compact.get_hash('no-such-node')
+
+    # actual unit tests #############################################
+
+    def do_test_file_system(self, hashtype):
+        """
+        Build a CompactMerkleTree directly from the file system and
+        from the equivalent MerkleTree.
+        """
+        tree_top = make_data_dir(self.rng, 4, 4)
+        os.mkdir(os.path.join(tree_top, 'empty'))
+        tree = MerkleTree.create_from_file_system(tree_top, hashtype)
+
+        compact = CompactMerkleTree.create_from_file_system(tree_top,
+                                                            hashtype)
+        self.check_equivalent(compact, tree)
+        self.assertIsNone(compact.get_hash('empty'))
+        self.check_equivalent(CompactMerkleTree.create_from_tree(tree), tree)
+
+        # round trip through both serializations; in text form the empty
+        # directory's missing hash is written as zeroes
+        self.check_equivalent(CompactMerkleTree.create_from_binary(
+            io.BytesIO(compact.to_bytes())), tree)
+        text = compact.to_string()
+        parsed = CompactMerkleTree.create_from_stream(io.StringIO(text),
+                                                      hashtype)
+        self.check_equivalent(parsed, tree)
+        self.assertIsNone(parsed.get_hash('empty'))
+        self.check_equivalent(
+            parsed, MerkleTree.create_from_stream(io.StringIO(text), hashtype))
+
+    def test_file_system(self):
+        """ Test building from the file system with various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_file_system(hashtype)
+
+    def test_listings(self):
+        """ Load the stored listings. """
+        for (name, hashtype) in [('tests/test_data/dat.xlattice.org',
+                                  HashTypes.SHA1),
+                                 ('tests/test_data/dat2.xlattice.org',
+                                  HashTypes.SHA2)]:
+            tree = MerkleTree.create_from_file(name, hashtype)
+            with open(name, 'r', encoding='utf-8') as file:
+                compact = CompactMerkleTree.create_from_stream(file, hashtype)
+            self.check_equivalent(compact, tree)
+
+    def test_bad_input(self):
+        """ Verify that malformed serializations are rejected. """
+        top = '0' * 64 + ' top/\n'
+        line = 'a' * 64 + ' foo'
+        for bad in [top + '  ' + line + '\n',       # indented too far
+                    top + ' ' + 'g' * 64 + ' foo\n']:     # not hex
+            with self.assertRaises(MerkleParseError):
+                CompactMerkleTree.create_from_stream(bad.split('\n'))
+        data = MerkleTree.create_from_stream(
+            [top, ' ' + line], HashTypes.SHA2).to_bytes()
+        for bad in [data[:-1], data + b'\x00']:
+            with self.assertRaises(MerkleParseError):
+                CompactMerkleTree.create_from_binary(bad)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# test_dup_index.py
+
+""" Test finding duplicated files and directories in a MerkleTree. """
+
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleDoc, MerkleTree
+from merkletree.dupindex import DuplicateIndex
+from helpers import unique_path
+
+
+class TestDupIndex(unittest.TestCase):
+    """ Test finding duplicated files and directories in a MerkleTree. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    def make_tree(self, path):
+        """
+        Build a directory tree in which a and b are identical, x/f1 is
+        a copy of a/f1, y/g and y/h are identical, and there are two
+        empty files and two empty directories.
+        """
+        for sub in ['a', 'x', 'y', 'z', 'z/empty1', 'z/empty2']:
+            os.makedirs(os.path.join(path, sub))
+        data = self.rng.some_bytes(64)
+        for name in ['a/f1', 'x/f1']:
+            with open(os.path.join(path, name), 'wb') as file:
+                file.write(data)
+        with open(os.path.join(path, 'a/f2'), 'wb') as file:
+            file.write(self.rng.some_bytes(80))
+        data = self.rng.some_bytes(100)
+        for name in ['y/g', 'y/h']:
+            with open(os.path.join(path, name), 'wb') as file:
+                file.write(data)
+        for name in ['z/e1', 'z/e2']:
+            open(os.path.join(path, name), 'wb').close()
+        shutil.copytree(os.path.join(path, 'a'), os.path.join(path, 'b'))
+
+    # actual unit tests #############################################
+
+    def do_test_groups(self, hashtype):
+        """ Verify the groups found in a tree with known duplicates. """
+        tree_top = unique_path(self.rng)
+        self.make_tree(tree_top)
+        tree = MerkleTree.create_from_file_system(tree_top, hashtype)
+
+        index = DuplicateIndex(tree, tree_top)
+        self.assertEqual(
+            [(True, ['a', 'b'], 144, 144),
+             (False, ['y/g', 'y/h'], 100, 100),
+             (False, ['a/f1', 'x/f1'], 64, 64),
+             (False, ['z/e1', 'z/e2'], 0, 0)],
+            [(g.is_dir, g.paths, g.size, g.reclaimable)
+             for g in index.groups])
+        self.assertEqual(308, index.reclaimable)
+        self.assertEqual(tree['a'].bin_hash, index.groups[0].bin_hash)
+
+        f1_hash = tree['a/f1'].bin_hash
+        self.assertIn(f1_hash, index)
+        self.assertEqual(3, index.count(f1_hash))
+        self.assertEqual(['a/f1', 'b/f1', 'x/f1'], list(index.find(f1_hash)))
+        self.assertEqual(0, index.count(b'no such hash'))
+        # the empty directories have no hash and are not counted
+        self.assertEqual(len(set(
+            node.bin_hash for (_, node) in self.walk(tree)
+            if node.bin_hash)), len(index))
+
+        # without sizes, from a MerkleDoc
+        doc = MerkleDoc.create_from_file_system(tree_top, hashtype)
+        index = DuplicateIndex(doc)
+        self.assertEqual(['a', 'b'], index.groups[0].paths)
+        self.assertEqual(4, len(index.groups))
+        self.assertIsNone(index.groups[0].size)
+        self.assertIsNone(index.reclaimable)
+
+    @staticmethod
+    def walk(tree):
+        """ Generate (relative path, node) for every node in tree. """
+        stack = [('', tree)]
+        while stack:
+            (path, node) = stack.pop()
+            yield (path, node)
+            if not node.is_leaf:
+                for child in node.nodes:
+                    stack.append((path + '/' + child.name, child))
+
+    def test_groups(self):
+        """ Test duplicate groups using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_groups(hashtype)
+
+    def test_nested(self):
+        """
+        A file duplicated only within copies of a directory is covered
+        by the directory's group; one duplicated within the first copy
+        is reported in its own group.
+        """
+        tree_top = unique_path(self.rng)
+        os.makedirs(os.path.join(tree_top, 'd'))
+        data = self.rng.some_bytes(50)
+        for name in ['d/p', 'd/q']:
+            with open(os.path.join(tree_top, name), 'wb') as file:
+                file.write(data)
+        with open(os.path.join(tree_top, 'd/r'), 'wb') as file:
+            file.write(self.rng.some_bytes(30))
+        shutil.copytree(os.path.join(tree_top, 'd'),
+                        os.path.join(tree_top, 'e'))
+        index = DuplicateIndex(MerkleTree.create_from_file_system(tree_top),
+                               tree_top)
+        self.assertEqual([(['d', 'e'], 130), (['d/p', 'd/q'], 50)],
+                         [(g.paths, g.reclaimable) for g in index.groups])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# test_indexed_merkle_file.py
+
+""" Test memory-mapped indexed MerkleTree files. """
+
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleDoc, MerkleTree, MerkleParseError
+from merkletree.indexed import IndexedMerkleFile, write_indexed
+from helpers import unique_path
+
+
+class TestIndexedMerkleFile(unittest.TestCase):
+    """ Test memory-mapped indexed MerkleTree files. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    @staticmethod
+    def walk(tree):
+        """ Generate (relative path, node) for every node, in preorder. """
+        stack = [('', tree)]
+        while stack:
+            (path, node) = stack.pop()
+            yield (path, node)
+            if not node.is_leaf:
+                prefix = path + '/' if path else ''
+                for child in reversed(node.nodes):
+                    stack.append((prefix + child.name, child))
+
+    # actual unit tests #############################################
+
+    def do_test_file_system(self, hashtype):
+        """
+        Index a tree built from the file system and look up every node
+        in it by path.
+        """
+        tree_top = unique_path(self.rng)
+        self.rng.next_data_dir(tree_top, depth=4, width=5, max_len=256)
+        os.mkdir(os.path.join(tree_top, 'empty'))
+        tree = MerkleTree.create_from_file_system(tree_top, hashtype)
+        path_to_index = unique_path(self.rng, 8)
+        write_indexed(tree, path_to_index)
+
+        expected = list(self.walk(tree))
+        with IndexedMerkleFile(path_to_index) as index:
+            self.assertEqual(hashtype, index.hashtype)
+            self.assertEqual(len(expected), index.node_count)
+            self.assertEqual(tree.name, index.name)
+            self.assertEqual(tree.bin_hash, index.bin_hash)
+            self.assertIsNone(index.doc_path)
+
+            for (path, node) in expected:
+                self.assertTrue(path in index)
+                self.assertEqual(node.bin_hash, index.get_hash(path))
+                self.assertEqual(node.hex_hash, index.get_hex_hash(path))
+                self.assertEqual(not node.is_leaf, index.is_dir(path))
+            self.assertIsNone(index.get_hash('empty'))
+            self.assertEqual(index.get_hash('empty'),
+                             index.get_hash('/empty/'))
+
+            self.assertFalse('no/such/file' in index)
+            with self.assertRaises(KeyError):
+                index.get_hash('no-such-file')
+            leaf = [path for (path, node) in expected if node.is_leaf][0]
+            with self.assertRaises(KeyError):
+                index.get_hash(leaf + '/below-a-leaf')
+
+            self.assertEqual([(path, node.bin_hash, not node.is_leaf)
+                              for (path, node) in expected],
+                             list(index.iter_subtree()))
+            self.assertEqual(tree, index.to_merkle_tree())
+
+            # any subtree on its own
+            for (path, node) in expected:
+                if node.is_leaf or not path:
+                    continue
+                self.assertEqual([node.name for node in node.nodes],
+                                 index.list_dir(path))
+                prefix = path + '/'
+                self.assertEqual(
+                    [(p, n.bin_hash, not n.is_leaf) for (p, n) in expected
+                     if p == path or p.startswith(prefix)],
+                    list(index.iter_subtree(path)))
+                self.assertEqual(node, index.to_merkle_tree(path))
+
+    def test_file_system(self):
+        """ Index file system trees using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_file_system(hashtype)
+
+    def test_doc(self):
+        """ Index a MerkleDoc, which also records its path and hash. """
+        tree_top = unique_path(self.rng)
+        self.rng.next_data_dir(tree_top, depth=2, width=4, max_len=256)
+        doc = MerkleDoc.create_from_file_system(tree_top, HashTypes.SHA2)
+        path_to_index = unique_path(self.rng, 8)
+        write_indexed(doc, path_to_index)
+        with IndexedMerkleFile(path_to_index) as index:
+            self.assertEqual(doc.path, index.doc_path)
+            self.assertEqual(doc.bin_hash, index.doc_hash)
+            self.assertEqual(doc.tree.bin_hash, index.bin_hash)
+            self.assertEqual(doc.tree, index.to_merkle_tree())
+
+    def test_listing(self):
+        """ Index a stored listing with many entries per directory. """
+        tree = MerkleTree.create_from_file(
+            'tests/test_data/dat2.xlattice.org', HashTypes.SHA2)
+        os.makedirs('tmp', exist_ok=True)
+        path_to_index = unique_path(self.rng, 8)
+        write_indexed(tree, path_to_index)
+        with IndexedMerkleFile(path_to_index) as index:
+            for (path, node) in self.walk(tree):
+                self.assertEqual(node.bin_hash, index.get_hash(path))
+
+    def test_bad_file(self):
+        """ Files which are not indexed trees are rejected. """
+        os.makedirs('tmp', exist_ok=True)
+        path = unique_path(self.rng, 8)
+        for data in [b'', b'MRKI', b'XXXX' + bytes(64)]:
+            with open(path, 'wb') as file:
+                file.write(data)
+            with self.assertRaises(MerkleParseError):
+                IndexedMerkleFile(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# test_leaf_hash_cache.py
+
+""" Test the persistent cache of leaf hashes. """
+
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleLeaf, MerkleTree
+from merkletree.cache import LeafHashCache
+from helpers import unique_path
+
+
+class TestLeafHashCache(unittest.TestCase):
+    """ Test the persistent cache of leaf hashes. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # actual unit tests #############################################
+
+    def do_test_incremental_rebuild(self, hashtype):
+        """
+        Verify that a tree built through the cache is identical to one
+        built without it, before and after a file is changed.
+        """
+        tree_top = unique_path(self.rng)
+        self.rng.next_data_dir(tree_top, depth=4, width=4, max_len=4096)
+        path_to_cache = unique_path(self.rng)
+
+        tree = MerkleTree.create_from_file_system(tree_top, hashtype)
+        with LeafHashCache(path_to_cache) as cache:
+            tree1 = MerkleTree.create_from_file_system(
+                tree_top, hashtype, cache=cache)
+            self.assertEqual(0, cache.hits)
+            self.assertTrue(cache.misses > 0)
+        self.assertEqual(tree, tree1)
+
+        with LeafHashCache(path_to_cache) as cache:
+            tree2 = MerkleTree.create_from_file_system(
+                tree_top, hashtype, cache=cache)
+            self.assertEqual(0, cache.misses)
+            self.assertTrue(cache.hits > 0)
+        self.assertEqual(tree, tree2)
+
+        # change the contents and size of one of the files
+        path_to_file = None
+        for dir_path, _, files in os.walk(tree_top):
+            if files:
+                path_to_file = os.path.join(dir_path, sorted(files)[0])
+                break
+        self.assertFalse(path_to_file is None)
+        with open(path_to_file, 'ab') as file:
+            file.write(b'the quick brown fox')
+
+        tree3 = MerkleTree.create_from_file_system(tree_top, hashtype)
+        self.assertNotEqual(tree.hex_hash, tree3.hex_hash)
+        with LeafHashCache(path_to_cache) as cache:
+            tree4 = MerkleTree.create_from_file_system(
+                tree_top, hashtype, workers=4, cache=cache)
+            self.assertEqual(1, cache.misses)
+        self.assertEqual(tree3, tree4)
+
+    def test_incremental_rebuild(self):
+        """ Test incremental rebuilds using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_incremental_rebuild(hashtype)
+
+    def test_key_must_match(self):
+        """
+        Verify that a cached hash is used only if the file's stat()
+        key matches.
+        """
+        os.makedirs('tmp', exist_ok=True)
+        path_to_file = unique_path(self.rng)
+        with open(path_to_file, 'wb') as file:
+            file.write(self.rng.some_bytes(64))
+        stat_ = os.stat(path_to_file)
+        fake_hash = bytes(self.rng.some_bytes(32))
+
+        path_to_cache = unique_path(self.rng)
+        with LeafHashCache(path_to_cache) as cache:
+            cache.put(stat_, HashTypes.SHA2, fake_hash)
+            self.assertEqual(fake_hash, cache.get(stat_, HashTypes.SHA2))
+            self.assertEqual(None, cache.get(stat_, HashTypes.SHA3))
+            leaf = MerkleLeaf.create_from_file_system(
+                path_to_file, 'foo', HashTypes.SHA2, cache)
+            self.assertEqual(fake_hash, leaf.bin_hash)
+
+        # a different mtime invalidates the entry
+        os.utime(path_to_file, ns=(stat_.st_atime_ns,
+                                   stat_.st_mtime_ns + 1000000000))
+        with LeafHashCache(path_to_cache) as cache:
+            leaf = MerkleLeaf.create_from_file_system(
+                path_to_file, 'foo', HashTypes.SHA2, cache)
+            self.assertNotEqual(fake_hash, leaf.bin_hash)
+            self.assertEqual(leaf.bin_hash, MerkleLeaf.create_from_file_system(
+                path_to_file, 'foo', HashTypes.SHA2).bin_hash)
+
+    def test_eviction(self):
+        """ Verify that entries unused for keep_runs runs are evicted. """
+        os.makedirs('tmp', exist_ok=True)
+        path_to_file = unique_path(self.rng)
+        with open(path_to_file, 'wb') as file:
+            file.write(self.rng.some_bytes(64))
+        stat_ = os.stat(path_to_file)
+        path_to_cache = unique_path(self.rng)
+
+        with LeafHashCache(path_to_cache, keep_runs=2) as cache:
+            run = cache.run
+            cache.put(stat_, HashTypes.SHA2, bytes(32))
+        with LeafHashCache(path_to_cache, keep_runs=2) as cache:
+            self.assertEqual(run + 1, cache.run)
+            self.assertEqual(1, len(cache))
+        with LeafHashCache(path_to_cache, keep_runs=2) as cache:
+            self.assertEqual(1, len(cache))     # evicted as this closes
+        with LeafHashCache(path_to_cache, keep_runs=2) as cache:
+            self.assertEqual(0, len(cache))
+            self.assertEqual(None, cache.get(stat_, HashTypes.SHA2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# test_merkle_diff.py
+
+""" Test comparison of MerkleTrees. """
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleDoc, MerkleTree
+from merkletree.diff import ADDED, REMOVED, MODIFIED, diff, verify
+from helpers import make_data_dir, unique_path, write_file
+
+MERKLEIZE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'src', 'merkleize')
+
+
+class TestMerkleDiff(unittest.TestCase):
+    """ Test comparison of MerkleTrees. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    def make_base(self, path):
+        """ Build a small directory tree with known names. """
+        for sub in ['a', 'b', 'c', 'c/d', 'e']:
+            os.makedirs(os.path.join(path, sub))
+        for name in ['a/f1', 'a/f2', 'b/f3', 'c/f4', 'c/d/f5', 'e/f6', 'f7',
+                     'f8']:
+            write_file(self.rng, os.path.join(path, name))
+
+    # actual unit tests #############################################
+
+    def do_test_diff(self, hashtype):
+        """
+        Apply known changes to a copy of a directory tree and verify that
+        exactly those are reported.
+        """
+        old_top = unique_path(self.rng)
+        self.make_base(old_top)
+        new_top = unique_path(self.rng)
+        shutil.copytree(old_top, new_top)
+
+        write_file(self.rng, os.path.join(new_top, 'a', 'f2'))   # modify
+        write_file(self.rng, os.path.join(new_top, 'a', 'f2a'))  # add
+        os.unlink(os.path.join(new_top, 'c', 'd', 'f5'))        # remove
+        os.mkdir(os.path.join(new_top, 'g'))                    # new dir
+        write_file(self.rng, os.path.join(new_top, 'g', 'f9'))
+        shutil.rmtree(os.path.join(new_top, 'e'))               # dir gone
+        os.unlink(os.path.join(new_top, 'f8'))                  # file to dir
+        os.mkdir(os.path.join(new_top, 'f8'))
+        write_file(self.rng, os.path.join(new_top, 'f8', 'f10'))
+
+        old = MerkleTree.create_from_file_system(old_top, hashtype)
+        new = MerkleTree.create_from_file_system(new_top, hashtype)
+        changes = list(diff(old, new))
+        self.assertEqual([(MODIFIED, 'a/f2', False),
+                          (ADDED, 'a/f2a', False),
+                          (REMOVED, 'c/d/f5', False),
+                          (REMOVED, 'e', True),
+                          (REMOVED, 'f8', False),
+                          (ADDED, 'f8', True),
+                          (ADDED, 'g', True)],
+                         [(c.kind, c.path, c.is_dir) for c in changes])
+        self.assertEqual(old['a/f2'].bin_hash, changes[0].old_hash)
+        self.assertEqual(new['a/f2'].bin_hash, changes[0].new_hash)
+        self.assertIsNone(changes[1].old_hash)
+        self.assertIsNone(changes[3].new_hash)
+
+        # reversing the arguments reverses the changes
+        (first, second) = (new, old)
+        self.assertEqual(
+            [{ADDED: REMOVED, REMOVED: ADDED}.get(c.kind, c.kind)
+             for c in changes if c.path != 'f8'],
+            [c.kind for c in diff(first, second) if c.path != 'f8'])
+
+        # identical trees, and documents, differ in nothing
+        self.assertEqual([], list(diff(old, old)))
+        doc = MerkleDoc.create_from_file_system(old_top, hashtype)
+        self.assertEqual([], list(diff(doc, old)))
+
+    def test_diff(self):
+        """ Compare trees using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_diff(hashtype)
+
+    def test_pruning(self):
+        """ Verify that subtrees with equal hashes are not visited. """
+        old_top = unique_path(self.rng)
+        self.make_base(old_top)
+        old = MerkleTree.create_from_file_system(old_top, HashTypes.SHA2)
+        write_file(self.rng, os.path.join(old_top, 'b', 'f3'))
+        new = MerkleTree.create_from_file_system(old_top, HashTypes.SHA2)
+
+        # make the unchanged directories unreadable
+        for tree in [old, new]:
+            for path in ['a', 'c', 'e']:
+                tree[path]._nodes = None    # pylint: disable=W0212
+        self.assertEqual([(MODIFIED, 'b/f3')],
+                         [(c.kind, c.path) for c in diff(old, new)])
+
+    def do_test_verify(self, hashtype):
+        """
+        Verify a directory against a tree built before changes were made
+        to it, serially and in parallel, reporting what diff() would.
+        """
+        top = unique_path(self.rng)
+        self.make_base(top)
+        write_file(self.rng, os.path.join(top, 'big'))
+        with open(os.path.join(top, 'big'), 'ab') as file:
+            file.write(self.rng.some_bytes(5000))
+        doc = MerkleDoc.create_from_file_system(top, hashtype,
+                                                chunk_bits=12)
+        old = doc.tree
+        self.assertEqual([], list(old.verify_against_file_system(top)))
+        self.assertEqual([], list(doc.verify_against_file_system(top, 3)))
+
+        write_file(self.rng, os.path.join(top, 'a', 'f2'))      # modify
+        write_file(self.rng, os.path.join(top, 'a', 'f2a'))     # add
+        os.unlink(os.path.join(top, 'c', 'd', 'f5'))            # remove
+        shutil.rmtree(os.path.join(top, 'e'))                   # dir gone
+        os.unlink(os.path.join(top, 'f8'))                      # file to dir
+        os.mkdir(os.path.join(top, 'f8'))
+        write_file(self.rng, os.path.join(top, 'f8', 'f10'))
+        with open(os.path.join(top, 'big'), 'ab') as file:      # chunked
+            file.write(b'x')
+        new = MerkleTree.create_from_file_system(top, hashtype,
+                                                 chunk_bits=12)
+        expected = [(c.kind, c.path, c.is_dir, c.old_hash)
+                    for c in diff(old, new)]
+        self.assertEqual(7, len(expected))
+        for workers in [None, 1, 4]:
+            changes = list(old.verify_against_file_system(top, workers))
+            self.assertEqual(expected,
+                             [(c.kind, c.path, c.is_dir, c.old_hash)
+                              for c in changes])
+            found = {c.path: c.new_hash for c in changes}
+            self.assertEqual(new['a/f2'].bin_hash, found['a/f2'])
+            self.assertEqual(new['big'].bin_hash, found['big'])
+            self.assertIsNone(found['a/f2a'])
+        self.assertEqual(expected[:1], [
+            (c.kind, c.path, c.is_dir, c.old_hash)
+            for c in verify(doc, top, 4, fail_fast=True)])
+
+        # excluded files are not compared
+        self.assertEqual(
+            [c for c in expected if not c[1].startswith('a/')],
+            [(c.kind, c.path, c.is_dir, c.old_hash)
+             for c in verify(old, top, exclusions=['f2*'])
+             if not c.path.startswith('a/')])
+        with self.assertRaises(RuntimeError):
+            verify(old, top + '-not-there')
+
+    def test_verify(self):
+        """ Verify directories using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_verify(hashtype)
+
+    def test_parallel_walk(self):
+        """
+        Verify a deep and wide tree with directories scanned by the pool,
+        finding what a serial walk finds.
+        """
+        top = make_data_dir(self.rng, 4, 4)
+        tree = MerkleTree.create_from_file_system(top, HashTypes.SHA2)
+        self.assertEqual([], list(verify(tree, top, 8)))
+        for (dir_path, _, files) in list(os.walk(top))[::3]:
+            if files:
+                write_file(self.rng, os.path.join(dir_path, files[0]))
+            write_file(self.rng, os.path.join(dir_path, 'new'))
+        serial = list(verify(tree, top))
+        self.assertTrue(serial)
+        for workers in [2, 8]:
+            self.assertEqual(serial, list(verify(tree, top, workers)))
+
+    def test_command_line(self):
+        """
+        merkleize diff accepts directories named without a path or with
+        a trailing slash, and reports bad arguments as usage errors.
+        """
+        top = unique_path(self.rng)
+        self.make_base(os.path.join(top, 'old'))
+        shutil.copytree(os.path.join(top, 'old'), os.path.join(top, 'new'))
+        write_file(self.rng, os.path.join(top, 'new', 'a', 'f2'))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(MERKLEIZE)] + sys.path)
+
+        def merkleize_diff(*args):
+            """ Run merkleize diff in top, returning the result. """
+            return subprocess.run(
+                [sys.executable, MERKLEIZE, 'diff'] + list(args), cwd=top,
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, check=False)
+        for args in [('old', 'new'), ('./old/', './new/'),
+                     (os.path.abspath(os.path.join(top, 'old')), 'new/')]:
+            result = merkleize_diff(*args)
+            self.assertEqual(1, result.returncode, result.stderr)
+            self.assertEqual('M a/f2\n', result.stdout)
+        self.assertEqual(0, merkleize_diff('old', 'old/').returncode)
+
+        with open(os.path.join(top, 'junk'), 'wb') as file:
+            file.write(b'not a merkletree\n')
+        result = merkleize_diff('old', 'junk')
+        self.assertEqual(2, result.returncode)
+        self.assertIn('usage:', result.stderr)
+        self.assertNotIn('Traceback', result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
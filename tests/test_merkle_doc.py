@@ -3,6 +3,7 @@
 
 """ Test Merkletree functionality at the Document level. """
 
+import io
 import os
 import shutil
 import time
@@ -185,6 +186,17 @@ class TestMerkleDoc(unittest.TestCase):
         # END
         self.assertTrue(doc1 == doc1_rebuilt)
 
+        # the streaming serialization must be identical
+        file = io.StringIO()
+        doc1.write_to(file)
+        self.assertEqual(doc1_str, file.getvalue())
+        self.assertEqual(doc1_str, ''.join(doc1.iter_lines()))
+
+        # and so must be the result of parsing it as a stream
+        file.seek(0)
+        doc1_streamed = MerkleDoc.create_from_stream(file, hashtype)
+        self.assertTrue(doc1 == doc1_streamed)
+
     def test_bound_needle_dirs(self):
         """test directories four deep with one data file at the lowest level"""
         for hashtype in HashTypes:
@@ -3,6 +3,7 @@
 """ Test MerkleLeaf functionality. """
 
 # testMerkleLeaf.py
+import os
 import sys
 import time
 import unittest
@@ -10,7 +11,7 @@ import unittest
 from rnglib import SimpleRNG
 from xlattice import HashTypes, check_hashtype
 from xlcrypto.hash import XLSHA1, XLSHA2, XLSHA3, XLBLAKE2B_256
-from merkletree import MerkleLeaf
+from merkletree import MerkleLeaf, file_hash_bin, READ_BUF_SIZE
 
 # This is the SHA1 test
 
@@ -79,6 +80,50 @@ class TestMerkleLeaf(unittest.TestCase):
         for hashtype in HashTypes:
             self.do_test_simple_constructor(hashtype=hashtype)
 
+    def do_test_file_hash(self, hashtype):
+        """
+        Verify that file_hash_bin() and MerkleLeaf.create_from_file_system()
+        agree with a simple in-memory hash at sizes on either side of
+        the buffer size, and for a file of many buffers.
+        """
+        if hashtype == HashTypes.SHA1:
+            sha_class = XLSHA1
+        elif hashtype == HashTypes.SHA2:
+            sha_class = XLSHA2
+        elif hashtype == HashTypes.SHA3:
+            sha_class = XLSHA3
+        elif hashtype == HashTypes.BLAKE2B:
+            sha_class = XLBLAKE2B_256
+        else:
+            raise NotImplementedError
+
+        os.makedirs('tmp', exist_ok=True)
+        chunk = bytes(self.rng.some_bytes(1024))
+        for size in [0, 1, READ_BUF_SIZE - 1, READ_BUF_SIZE,
+                     READ_BUF_SIZE + 1, 3 * READ_BUF_SIZE,
+                     64 * READ_BUF_SIZE + 1]:
+            data = (chunk * (size // len(chunk) + 1))[:size]
+            path_to_file = os.path.join('tmp', self.rng.next_file_name(16))
+            while os.path.exists(path_to_file):
+                path_to_file = os.path.join(
+                    'tmp', self.rng.next_file_name(16))
+            with open(path_to_file, 'wb') as file:
+                file.write(data)
+            sha = sha_class()
+            sha.update(data)
+            expected = sha.digest()
+
+            self.assertEqual(expected, file_hash_bin(path_to_file, hashtype))
+            leaf = MerkleLeaf.create_from_file_system(
+                path_to_file, 'foo', hashtype)
+            self.assertEqual(expected, leaf.bin_hash)
+            os.unlink(path_to_file)
+
+    def test_file_hash(self):
+        """ Test file hashing for various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_file_hash(hashtype)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# test_merkle_merge.py
+
+""" Test merging MerkleTrees built separately. """
+
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import MerkleDoc, MerkleTree
+from merkletree.merge import merge
+from helpers import make_data_dir, unique_path
+
+
+class TestMerkleMerge(unittest.TestCase):
+    """ Test merging MerkleTrees built separately. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    def make_pieces_dir(self):
+        """
+        Create a directory under tmp/ holding only the quasi-random
+        directory trees a, b and c/d.
+        """
+        top = unique_path(self.rng)
+        for sub in ['a', 'b', 'c/d']:
+            make_data_dir(self.rng, 3, 3, path=os.path.join(top, sub))
+        return top
+
+    def load(self, path, hashtype):
+        """ Build the tree at path and return its text serialization. """
+        return MerkleTree.create_from_file_system(path, hashtype).to_string()
+
+    # actual unit tests #############################################
+
+    def do_test_merge(self, hashtype):
+        """
+        Merging the serialized trees of the subdirectories gives the
+        tree of the whole.
+        """
+        top = self.make_pieces_dir()
+        whole = MerkleTree.create_from_file_system(top, hashtype)
+        name = whole.name
+        pieces = {sub: MerkleTree.create_from_serialization(
+            self.load(os.path.join(top, sub), hashtype), hashtype)
+            for sub in ['a', 'b', 'c/d']}
+
+        # pylint: disable=protected-access
+        calls = []
+        rehash = MerkleTree._rehash
+
+        def counting_rehash(self):
+            calls.append(self.name)
+            rehash(self)
+        MerkleTree._rehash = counting_rehash
+        try:
+            tree = merge(name, [pieces['a'],
+                                MerkleDoc('tmp', hashtype, tree=pieces['b']),
+                                ('/c/d/', pieces['c/d'])], hashtype)
+        finally:
+            MerkleTree._rehash = rehash
+        self.assertEqual(sorted([name, 'c']), sorted(calls))
+        self.assertEqual(whole.bin_hash, tree.bin_hash)
+        self.assertEqual(whole.to_string(), tree.to_string())
+        self.assertEqual(whole, tree)
+
+        # in any order, from binary serializations too
+        tree = merge(name, [('c/d', MerkleTree.create_from_binary(
+            pieces['c/d'].to_bytes())), ('b', pieces['b']), pieces['a']],
+            hashtype)
+        self.assertEqual(whole, tree)
+
+    def test_merge(self):
+        """ Merge trees using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_merge(hashtype)
+
+    def test_bad_merges(self):
+        """ Verify that conflicting pieces are refused. """
+        top = self.make_pieces_dir()
+        (piece_a, piece_b, piece_d) = [MerkleTree.create_from_file_system(
+            os.path.join(top, sub)) for sub in ['a', 'b', 'c/d']]
+        sha1_b = MerkleTree.create_from_file_system(os.path.join(top, 'b'),
+                                                    HashTypes.SHA1)
+        for pieces in [[piece_a, ('a', piece_a)],           # the same path
+                       [('c', piece_b), ('c/d', piece_d)],  # named wrongly
+                       [piece_a, ('a/d', piece_d)],         # inside another
+                       [('a/d', piece_d), piece_a],
+                       [piece_a, sha1_b],                   # wrong hashtype
+                       [piece_a, ('', piece_b)],            # no path
+                       [piece_a, ('x', 'not a tree')]]:
+            with self.assertRaises(RuntimeError):
+                merge('top', pieces)
+        self.assertIsNone(merge('top', []).bin_hash)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# test_merkle_mutation.py
+
+""" Test changing a MerkleTree in place. """
+
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import (ChunkedMerkleLeaf, MerkleTree, file_hash_bin,
+                        get_hash_func)
+from helpers import make_mixed_dir, write_file
+
+
+class TestMerkleMutation(unittest.TestCase):
+    """ Test changing a MerkleTree in place. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    def check(self, tree, top, hashtype):
+        """ Verify that tree is what a new build of top gives. """
+        fresh = MerkleTree.create_from_file_system(top, hashtype)
+        self.assertEqual(fresh.bin_hash, tree.bin_hash)
+        self.assertEqual(fresh.to_string(), tree.to_string())
+        self.assertEqual(fresh, tree)
+
+    # actual unit tests #############################################
+
+    def do_test_mutation(self, hashtype):
+        """
+        Make changes on disk and the same changes to the tree through
+        upsert_leaf(), remove() and replace_subtree().
+        """
+        top = make_mixed_dir(self.rng)
+        tree = MerkleTree.create_from_file_system(top, hashtype)
+        untouched = tree['r']
+
+        def upsert(path):
+            """ Write the file at path and upsert its hash. """
+            path_on_disk = os.path.join(top, path)
+            os.makedirs(os.path.dirname(path_on_disk), exist_ok=True)
+            write_file(self.rng, path_on_disk)
+            return tree.upsert_leaf(path, file_hash_bin(path_on_disk,
+                                                        hashtype))
+
+        old = upsert('a/f1')                                    # update
+        self.assertEqual('f1', old.name)
+        self.assertIsNone(upsert('a/f0'))                       # insert
+        self.assertIsNone(upsert('b/d/e/f2'))                   # new dirs
+        self.assertTrue(tree.dirty)
+        self.assertFalse(untouched.dirty)
+        self.check(tree, top, hashtype)
+        self.assertFalse(tree.dirty)
+        self.assertFalse(tree['b/d/e'].dirty)
+
+        os.unlink(os.path.join(top, 'b', 'c', 'f1'))
+        self.assertEqual('f1', tree.remove('b/c/f1').name)  # c left empty
+        shutil.rmtree(os.path.join(top, 'b', 'd'))
+        self.assertFalse(tree.remove('/b/d/').is_leaf)
+        self.check(tree, top, hashtype)
+        self.assertIsNone(tree['b'].bin_hash)
+
+        # a subtree built elsewhere, replacing a file
+        other = make_mixed_dir(self.rng)
+        os.unlink(os.path.join(top, 'a', 'f0'))
+        shutil.copytree(os.path.join(other, 'b'),
+                        os.path.join(top, 'a', 'f0'))
+        sub = MerkleTree.create_from_file_system(
+            os.path.join(top, 'a', 'f0'), hashtype)
+        self.assertTrue(tree.replace_subtree('a/f0', sub).is_leaf)
+        shutil.copytree(os.path.join(other, 'a'), os.path.join(top, 'x'))
+        self.assertIsNone(tree.replace_subtree(
+            'x', MerkleTree.create_from_file_system(
+                os.path.join(top, 'x'), hashtype)))
+        self.check(tree, top, hashtype)
+
+        # hashes are recomputed as create_from_file_system() would
+        tree.upsert_leaf('a/big', tree['a/f1'].bin_hash, 12)
+        self.assertIsInstance(tree['a/big'], ChunkedMerkleLeaf)
+        sha = get_hash_func(hashtype)
+        for node in tree['a'].nodes:
+            sha.update(node.bin_hash)
+        self.assertEqual(sha.digest(), tree['a'].bin_hash)
+
+    def test_mutation(self):
+        """ Change trees using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_mutation(hashtype)
+
+    def test_upsert_leaves(self):
+        """
+        Add files in any order to directories old and new, and to the
+        top, all at once, as they are added on disk.
+        """
+        hashtype = HashTypes.SHA2
+        top = make_mixed_dir(self.rng)
+        tree = MerkleTree.create_from_file_system(top, hashtype)
+        for path in ['b', 'x/y', '']:
+            leaves = []
+            for name in ['f9', 'c0', 'f1', 'a5', 'd']:
+                path_on_disk = os.path.join(top, path, name)
+                os.makedirs(os.path.dirname(path_on_disk), exist_ok=True)
+                write_file(self.rng, path_on_disk)
+                leaves.append((name, file_hash_bin(path_on_disk, hashtype),
+                               0))
+            tree.upsert_leaves(path, leaves)
+            self.assertTrue(tree.dirty)
+            self.check(tree, top, hashtype)
+        hash_ = tree['a/f1'].bin_hash
+        with self.assertRaises(RuntimeError):
+            tree.upsert_leaves('b', [('f9', hash_, 0), ('c', hash_, 0)])
+        with self.assertRaises(RuntimeError):
+            tree.upsert_leaves('a/f1', [('f9', hash_, 0)])
+        self.check(tree, top, hashtype)
+
+    def test_bad_changes(self):
+        """ Verify that impossible changes are refused. """
+        top = make_mixed_dir(self.rng)
+        tree = MerkleTree.create_from_file_system(top, HashTypes.SHA2)
+        before = tree.to_string()
+        hash_ = tree['a/f1'].bin_hash
+        with self.assertRaises(KeyError):
+            tree.remove('a/no-such-file')
+        with self.assertRaises(KeyError):
+            tree.remove('no/such/file')
+        for (path, value) in [('a', hash_),             # a directory
+                              ('a/f1/g', hash_),        # below a file
+                              ('', hash_),
+                              ('a/f2', hash_[:-1]),
+                              ('a/f2', hash_.hex())]:
+            with self.assertRaises(RuntimeError):
+                tree.upsert_leaf(path, value)
+        sub = MerkleTree.create_from_file_system(
+            os.path.join(top, 'b'), HashTypes.SHA1)
+        for (path, value) in [('b', sub),               # wrong hashtype
+                              ('c', tree['b']),         # wrong name
+                              ('b', tree['a/f1'])]:     # not a tree
+            with self.assertRaises(RuntimeError):
+                tree.replace_subtree(path, value)
+        self.assertEqual(before, tree.to_string())
+
+    def test_listing_changes(self):
+        """
+        Change a tree read from a text listing, in which an empty
+        directory is shown with a hash of zeroes, and verify that it
+        counts for nothing in the recomputed hashes.
+        """
+        for hashtype in HashTypes:
+            top = make_mixed_dir(self.rng)
+            os.makedirs(os.path.join(top, 'a', 'empty'))
+            tree = MerkleTree.create_from_serialization(
+                MerkleTree.create_from_file_system(top, hashtype).to_string(),
+                hashtype)
+            self.assertIsNone(tree['a/empty'].bin_hash)
+            path_on_disk = os.path.join(top, 'a', 'f2')
+            write_file(self.rng, path_on_disk)
+            tree.upsert_leaf('a/f2', file_hash_bin(path_on_disk, hashtype))
+            tree.rehash()
+            self.check(tree, top, hashtype)
+
+    def test_many_changes(self):
+        """
+        A batch of changes to a large tree recomputes only the hashes of
+        the directories above them.
+        """
+        hashtype = HashTypes.SHA2
+        sha = get_hash_func(hashtype)
+        sha.update(b'x')
+        hash_ = bytes(sha.digest())
+        tree = MerkleTree('top', hashtype)
+        for ndx in range(20000):
+            tree.upsert_leaf('d%02d/e%02d/f%d' % (ndx % 50, ndx % 40, ndx),
+                             hash_)
+        tree.rehash()
+        self.assertFalse(tree.dirty)
+
+        # pylint: disable=protected-access
+        calls = []
+        rehash = MerkleTree._rehash
+
+        def counting_rehash(self):
+            calls.append(self.name)
+            rehash(self)
+        MerkleTree._rehash = counting_rehash
+        try:
+            for ndx in range(0, 20000, 200):
+                tree.upsert_leaf('d07/e%02d/f%d' % (ndx // 200 % 40, ndx),
+                                 hash_)
+            tree.remove('d08/e08/f8')
+            tree.rehash()
+        finally:
+            MerkleTree._rehash = rehash
+        self.assertEqual(40 + 1 + 2 + 1, len(calls))
+        self.assertEqual('top', calls[-1])
+
+    def test_inserts_in_a_large_directory(self):
+        """
+        Files added between the existing ones in a large directory are
+        put in place without rebuilding its name index, and the hash is
+        recomputed once.
+        """
+        # pylint: disable=protected-access
+        hashtype = HashTypes.SHA2
+        sha = get_hash_func(hashtype)
+        sha.update(b'x')
+        hash_ = bytes(sha.digest())
+        tree = MerkleTree('top', hashtype)
+        for ndx in range(0, 100000, 2):
+            tree.upsert_leaf('d/f%06d' % ndx, hash_)
+        tree.rehash()
+        big = tree['d']
+        (index, names) = (big._index, big._names)
+        added = [1 + 2 * self.rng.next_int32(50000) for _ in range(2000)]
+        for ndx in added:
+            tree.upsert_leaf('d/f%06d' % ndx, hash_)
+        self.assertIs(index, big._index)
+        self.assertIs(names, big._names)
+
+        calls = []
+        rehash = MerkleTree._rehash
+
+        def counting_rehash(self):
+            calls.append(self.name)
+            rehash(self)
+        MerkleTree._rehash = counting_rehash
+        try:
+            tree.rehash()
+        finally:
+            MerkleTree._rehash = rehash
+        self.assertEqual(['d', 'top'], calls)
+
+        expected = MerkleTree('top', hashtype)
+        for ndx in sorted(set(range(0, 100000, 2)) | set(added)):
+            expected.upsert_leaf('d/f%06d' % ndx, hash_)
+        self.assertEqual(expected.bin_hash, tree.bin_hash)
+        self.assertEqual(len(expected['d'].nodes), len(big.nodes))
+
+
+if __name__ == '__main__':
+    unittest.main()
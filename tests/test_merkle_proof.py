@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# test_merkle_proof.py
+
+""" Test inclusion proofs for MerkleTrees and MerkleDocs. """
+
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from merkletree import (MerkleDoc, MerkleTree, verify_proof,
+                        verify_multiproof)
+from helpers import make_data_dir, unique_path, write_file
+
+
+class TestMerkleProof(unittest.TestCase):
+    """ Test inclusion proofs for MerkleTrees and MerkleDocs. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    @staticmethod
+    def walk(tree):
+        """ Generate (relative path, node) for every node below tree. """
+        stack = [('', node) for node in reversed(tree.nodes)]
+        while stack:
+            (prefix, node) = stack.pop()
+            path = prefix + node.name
+            yield (path, node)
+            if not node.is_leaf:
+                for child in reversed(node.nodes):
+                    stack.append((path + '/', child))
+
+    # actual unit tests #############################################
+
+    def do_test_proofs(self, hashtype):
+        """
+        Prove and verify the membership of every node in a tree built
+        from the file system, then verify that altered proofs fail.
+        """
+        tree_top = make_data_dir(self.rng, 4, 4)
+        os.mkdir(os.path.join(tree_top, 'empty'))
+        tree = MerkleTree.create_from_file_system(tree_top, hashtype)
+
+        for (path, node) in self.walk(tree):
+            if not node.bin_hash:
+                with self.assertRaises(RuntimeError):
+                    tree.prove(path)
+                continue
+            proof = tree.prove(path)
+            self.assertEqual(path.count('/') + 1, len(proof))
+            self.assertTrue(verify_proof(tree.bin_hash, path, node.bin_hash,
+                                         proof, hashtype))
+            self.assertFalse(verify_proof(tree.bin_hash, path,
+                                          bytes(len(node.bin_hash)),
+                                          proof, hashtype))
+            self.assertFalse(verify_proof(tree.bin_hash, path + '/x',
+                                          node.bin_hash, proof, hashtype))
+            (before, after) = proof[-1]
+            siblings = before + after
+            if siblings:
+                # alter the first byte of the first sibling
+                bad = bytes([siblings[0][0] ^ 1]) + siblings[0][1:]
+                if before:
+                    bad = ([bad] + before[1:], after)
+                else:
+                    bad = (before, [bad] + after[1:])
+                self.assertFalse(verify_proof(
+                    tree.bin_hash, path, node.bin_hash,
+                    proof[:-1] + [bad], hashtype))
+
+        with self.assertRaises(KeyError):
+            tree.prove('no/such/node')
+
+    def test_proofs(self):
+        """ Test proofs using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_proofs(hashtype)
+
+    def test_doc_proofs(self):
+        """ Verify proofs against a MerkleDoc's hash and path. """
+        tree_top = make_data_dir(self.rng, 3, 4)
+        doc = MerkleDoc.create_from_file_system(tree_top, HashTypes.SHA2)
+        for (path, node) in self.walk(doc.tree):
+            proof = doc.prove(path)
+            self.assertTrue(verify_proof(
+                doc.bin_hash, path, node.bin_hash, proof, HashTypes.SHA2,
+                doc_path=doc.path))
+            self.assertFalse(verify_proof(
+                doc.bin_hash, path, node.bin_hash, proof, HashTypes.SHA2,
+                doc_path=doc.path + 'x'))
+            self.assertFalse(verify_proof(
+                doc.bin_hash, path, node.bin_hash, proof, HashTypes.SHA2))
+
+    def test_listing_proofs(self):
+        """
+        Verify proofs from trees parsed from a text listing, in which
+        empty directories are shown with hashes of zeroes, against the
+        hash of the tree built from the file system.
+        """
+        tree_top = unique_path(self.rng)
+        os.makedirs(os.path.join(tree_top, 'A', 'empty'))
+        write_file(self.rng, os.path.join(tree_top, 'A', 'x'))
+        make_data_dir(self.rng, 2, 3, path=os.path.join(tree_top, 'B'))
+        os.mkdir(os.path.join(tree_top, 'empty'))
+        for hashtype in HashTypes:
+            full = MerkleTree.create_from_file_system(tree_top, hashtype)
+            listing = full.to_string()
+            chosen = dict((path, node.bin_hash)
+                          for (path, node) in self.walk(full)
+                          if node.bin_hash)
+            for parsed in [
+                    MerkleTree.create_from_serialization(listing, hashtype),
+                    MerkleTree.create_lazy(listing.encode('utf-8'),
+                                           hashtype)]:
+                self.assertIsNone(parsed['A/empty'].bin_hash)
+                self.assertEqual(full.bin_hash, parsed.bin_hash)
+                for (path, hash_) in chosen.items():
+                    self.assertTrue(verify_proof(
+                        full.bin_hash, path, hash_, parsed.prove(path),
+                        hashtype))
+                self.assertTrue(verify_multiproof(
+                    full.bin_hash, chosen, parsed.prove_many(chosen),
+                    hashtype))
+
+    def do_test_multiproofs(self, hashtype):
+        """
+        Prove many paths at once, verifying that the multiproof holds
+        each hash once and fails if any claim or hash is altered.
+        """
+        tree_top = make_data_dir(self.rng, 4, 5)
+        os.mkdir(os.path.join(tree_top, 'empty'))
+        doc = MerkleDoc.create_from_file_system(tree_top, hashtype)
+        tree = doc.tree
+        nodes = [(path, node) for (path, node) in self.walk(tree)
+                 if node.bin_hash]
+        chosen = dict((path, node.bin_hash) for (path, node) in nodes
+                      if self.rng.next_boolean())
+        if not chosen:
+            (path, node) = nodes[0]
+            chosen[path] = node.bin_hash
+
+        proof = tree.prove_many(chosen)
+        self.assertTrue(verify_multiproof(tree.bin_hash, chosen, proof,
+                                          hashtype))
+        self.assertTrue(verify_multiproof(
+            doc.bin_hash, chosen, doc.prove_many(chosen), hashtype,
+            doc_path=doc.path))
+
+        # no more hashes are sent than in separate proofs
+        sent = [token[1] for token in proof if token[0] == 'H']
+        singles = sum(len(before) + len(after)
+                      for path in chosen
+                      for (before, after) in tree.prove(path))
+        self.assertTrue(len(sent) <= singles)
+
+        # a wrong hash, an extra claim, or a missing claim fails; the
+        # deepest path chosen has no chosen path below it
+        path = max(chosen, key=lambda p: p.count('/'))
+        bad = dict(chosen)
+        bad[path] = bytes(len(chosen[path]))
+        self.assertFalse(verify_multiproof(tree.bin_hash, bad, proof,
+                                           hashtype))
+        unclaimed = [p for (p, _) in nodes if p not in chosen and
+                     not any(c.startswith(p + '/') for c in chosen)]
+        if unclaimed:
+            bad = dict(chosen)
+            bad[unclaimed[0]] = tree[unclaimed[0]].bin_hash
+            self.assertFalse(verify_multiproof(tree.bin_hash, bad, proof,
+                                               hashtype))
+        bad = dict(chosen)
+        del bad[path]
+        self.assertFalse(verify_multiproof(tree.bin_hash, bad, proof,
+                                           hashtype))
+        self.assertFalse(verify_multiproof(tree.bin_hash, chosen,
+                                           proof[:-1], hashtype))
+        self.assertFalse(verify_multiproof(tree.bin_hash, chosen,
+                                           proof + [('H', tree.bin_hash)],
+                                           hashtype))
+
+        with self.assertRaises(KeyError):
+            tree.prove_many(['no/such/node'])
+        with self.assertRaises(RuntimeError):
+            tree.prove_many(['empty'])
+
+    def test_multiproofs(self):
+        """ Test multiproofs using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_multiproofs(hashtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@
 
 """ Test package functionality at the Tree level. """
 
+import io
 import os
 import shutil
 import sys
@@ -14,7 +15,7 @@ from xlattice import (HashTypes, check_hashtype,
                       SHA1_HEX_NONE, SHA2_HEX_NONE, SHA3_HEX_NONE,
                       BLAKE2B_256_HEX_NONE)
 from xlcrypto.hash import XLSHA1, XLSHA2, XLSHA3, XLBLAKE2B_256
-from merkletree import MerkleTree, MerkleLeaf
+from merkletree import MerkleTree, MerkleLeaf, MerkleParseError
 
 ONE = 1
 FOUR = 4
@@ -399,6 +400,202 @@ class TestMerkleTree(unittest.TestCase):
 
         self.assertTrue(tree1 == tree2)
 
+    def test_streaming_serialization(self):
+        """
+        Verify that iter_lines() and write_to() produce exactly the
+        serialization returned by to_string().
+        """
+        with open('tests/test_data/dat2.xlattice.org', 'rb') as file:
+            serialization = str(file.read(), 'utf-8')
+        tree = MerkleTree.create_from_serialization(
+            serialization, HashTypes.SHA2)
+
+        lines = list(tree.iter_lines())
+        self.assertEqual(2511, len(lines))
+        for line in lines:
+            self.assertTrue(line.endswith('\n'))
+            self.assertEqual(1, line.count('\n'))
+        self.assertEqual(serialization, ''.join(lines))
+
+        file = io.StringIO()
+        tree.write_to(file)
+        self.assertEqual(serialization, file.getvalue())
+
+        # a non-zero initial indent applies to every line
+        file = io.StringIO()
+        tree.write_to(file, 2)
+        self.assertEqual(tree.to_string(2), file.getvalue())
+        for line in file.getvalue().split('\n')[:-1]:
+            self.assertTrue(line.startswith('  '))
+
+    def test_streaming_parse(self):
+        """
+        Verify that trees parsed from a file object, from bytes and from
+        a generator are identical to that parsed from a string.
+        """
+        path_to_data = 'tests/test_data/dat.xlattice.org'
+        with open(path_to_data, 'rb') as file:
+            serialization = str(file.read(), 'utf-8')
+        tree = MerkleTree.create_from_serialization(
+            serialization, HashTypes.SHA1)
+
+        with open(path_to_data, 'r', encoding='utf-8') as file:
+            tree1 = MerkleTree.create_from_stream(file, HashTypes.SHA1)
+        self.assertEqual(tree, tree1)
+
+        with open(path_to_data, 'rb') as file:
+            tree2 = MerkleTree.create_from_stream(file, HashTypes.SHA1)
+        self.assertEqual(tree, tree2)
+
+        tree3 = MerkleTree.create_from_stream(
+            (line for line in serialization.split('\n')), HashTypes.SHA1)
+        self.assertEqual(tree, tree3)
+        self.assertEqual(serialization, tree3.to_string())
+
+        with self.assertRaises(RuntimeError):
+            MerkleTree.create_from_stream(iter([]), HashTypes.SHA1)
+
+    def test_fast_line_parser(self):
+        """
+        Verify that the regex-free parser agrees with parse_other_line()
+        and that malformed lines are reported by line number.
+        """
+        for (name, len_hash) in [('tests/test_data/dat.xlattice.org', 20),
+                                 ('tests/test_data/dat2.xlattice.org', 32)]:
+            with open(name, 'r', encoding='utf-8') as file:
+                lines = file.read().split('\n')[1:-1]
+            for line in lines:
+                self.assertEqual(
+                    MerkleTree.parse_other_line(line),
+                    MerkleTree.parse_other_line_fast(line, len_hash))
+
+        good = ' ' + 'a' * 64 + ' foo.txt'
+        self.assertEqual((1, bytes([0xaa] * 32), 'foo.txt', False),
+                         MerkleTree.parse_other_line_fast(good, 32))
+        for bad in [' ' + 'a' * 63 + ' foo.txt',      # short hash
+                    ' ' + 'a' * 62 + ' a foo.txt',    # embedded space
+                    ' ' + 'g' * 64 + ' foo.txt',      # not hex
+                    ' ' + 'a' * 64 + ' foo bar',      # space in name
+                    ' ' + 'a' * 64 + ' fo~o',         # not in SHA2 names
+                    ' ' + 'a' * 64 + ' /',            # empty dir name
+                    ' ' + 'a' * 64 + ' ']:            # no name at all
+            with self.assertRaises(MerkleParseError):
+                MerkleTree.parse_other_line_fast(bad.rstrip(), 32)
+            with self.assertRaises(RuntimeError):
+                MerkleTree.parse_other_line(bad.rstrip())
+
+        serialization = '0' * 64 + ' top/\n' + good + '\n' + \
+            ' ' + 'a' * 64 + ' sub/\n' + '  ' + 'a' * 40 + ' sha1.txt\n'
+        try:
+            MerkleTree.create_from_serialization(
+                serialization, HashTypes.SHA2)
+            self.fail("parsed line with SHA1 hash in SHA2 tree")
+        except MerkleParseError as exc:
+            self.assertTrue(str(exc).startswith('line 4:'))
+
+    def test_child_lookup(self):
+        """
+        Verify that nodes can be found by path, and that add_node()
+        keeps children in order by name whatever order they arrive in.
+        """
+        tree = MerkleTree.create_from_file(
+            'tests/test_data/dat2.xlattice.org', HashTypes.SHA2)
+        stack = [('', tree)]
+        while stack:
+            (path, node) = stack.pop()
+            self.assertTrue(tree.get(path) is node)
+            self.assertTrue(tree[path] is node)
+            self.assertTrue(path in tree)
+            if not node.is_leaf:
+                prefix = path + '/' if path else ''
+                for child in node.nodes:
+                    stack.append((prefix + child.name, child))
+                    self.assertTrue(node.get(child.name) is child)
+        self.assertIsNone(tree.get('no/such/node'))
+        self.assertEqual('x', tree.get('no-such-node', 'x'))
+        self.assertFalse('no-such-node' in tree)
+        with self.assertRaises(KeyError):
+            tree['no-such-node']            # pylint: disable=W0104
+
+        names = [self.rng.next_file_name(MAX_NAME_LEN) for _ in range(64)]
+        names = list(set(names))
+        tree = MerkleTree('top', HashTypes.SHA2)
+        for ndx, name in enumerate(names):
+            tree.add_node(MerkleLeaf(name, HashTypes.SHA2))
+            self.assertTrue(tree[name].name == name)
+            self.assertEqual(ndx + 1, len(tree.nodes))
+        self.assertEqual(sorted(names), [node.name for node in tree.nodes])
+        for name in names:
+            self.assertTrue(name in tree)
+        with self.assertRaises(RuntimeError):
+            tree.add_node(MerkleLeaf(names[0], HashTypes.SHA2))
+
+    def test_inserts_in_the_middle(self):
+        """
+        Verify that nodes added out of order to a large directory update
+        the name index in place rather than having it rebuilt, and that
+        the index follows changes made directly to the node list.
+        """
+        # pylint: disable=protected-access
+        tree = MerkleTree('top', HashTypes.SHA2)
+        for ndx in range(0, 20000, 2):
+            tree.add_node(MerkleLeaf('f%05d' % ndx, HashTypes.SHA2))
+        self.assertIn('f00000', tree)               # builds the index
+        (index, names) = (tree._index, tree._names)
+        odd = list(range(19999, 0, -2))
+        for ndx in odd[::2] + odd[1::2]:        # high, then low
+            tree.add_node(MerkleLeaf('f%05d' % ndx, HashTypes.SHA2))
+        self.assertIs(index, tree._index)
+        self.assertIs(names, tree._names)
+        self.assertEqual(['f%05d' % ndx for ndx in range(20000)],
+                         [node.name for node in tree.nodes])
+        for ndx in range(0, 20000, 997):
+            self.assertEqual('f%05d' % ndx, tree['f%05d' % ndx].name)
+
+        leaf = MerkleLeaf('g', HashTypes.SHA2)
+        tree.nodes.append(leaf)
+        self.assertIs(leaf, tree.get('g'))
+        tree.nodes[-1] = MerkleLeaf('h', HashTypes.SHA2)
+        self.assertIsNone(tree.get('g'))
+        self.assertIn('h', tree)
+
+    def test_lazy_loading(self):
+        """
+        Verify that a lazily loaded tree is identical to one parsed in
+        full, and that exploring one subtree leaves the rest unparsed.
+        """
+        for (name, hashtype) in [('tests/test_data/dat.xlattice.org',
+                                  HashTypes.SHA1),
+                                 ('tests/test_data/dat2.xlattice.org',
+                                  HashTypes.SHA2)]:
+            tree = MerkleTree.create_from_file(name, hashtype)
+            with open(name, 'rb') as file:
+                data = file.read()
+
+            lazy = MerkleTree.create_lazy(data, hashtype)
+            self.assertEqual(tree.bin_hash, lazy.bin_hash)
+            self.assertEqual(tree.name, lazy.name)
+            subdirs = [node for node in lazy.nodes if not node.is_leaf]
+            self.assertTrue(subdirs)
+            # exploring the first subdirectory parses none of the others
+            target = subdirs[0]
+            self.assertEqual(tree[target.name], target)
+            for node in subdirs[1:]:
+                # pylint: disable=protected-access
+                self.assertIsNotNone(node._source)
+
+            self.assertEqual(tree, lazy)
+            self.assertEqual(tree.to_string(), lazy.to_string())
+            self.assertEqual(
+                tree, MerkleTree.create_from_file(name, hashtype, lazy=True))
+
+        bad = ('0' * 64 + ' top/\n' + ' ' + 'a' * 64 + ' sub/\n' +
+               '  ' + 'a' * 63 + ' foo\n').encode('utf-8')
+        lazy = MerkleTree.create_lazy(bad, HashTypes.SHA2)
+        sub = lazy['sub']
+        with self.assertRaises(MerkleParseError):
+            sub.nodes                   # pylint: disable=W0104
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,12 +4,14 @@
 """ Test MerkleTree behavior with deeper directories. """
 
 import os
+import sys
+import tempfile
 import time
 import unittest
 
 from rnglib import SimpleRNG
 from xlattice import HashTypes
-from merkletree import MerkleTree
+from merkletree import MerkleTree, MerkleLeaf, get_hash_func
 
 MAX_NAME_LEN = 16
 
@@ -23,6 +25,30 @@ class TestMerkleTree2(unittest.TestCase):
     def tearDown(self):
         pass
 
+    # utility functions #############################################
+
+    @staticmethod
+    def remove_tree(path):
+        """
+        Remove the directory tree at path, working from the bottom up
+        without recursion, which shutil.rmtree() may use.
+        """
+        stack = [path]
+        while stack:
+            subdirs = []
+            with os.scandir(stack[-1]) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    else:
+                        os.unlink(entry.path)
+            if subdirs:
+                stack.extend(subdirs)
+            else:
+                os.rmdir(stack.pop())
+
+    # actual unit tests #############################################
+
     def do_test_deepish_trees(self, hashtype):
         """
         Build a directory of random data, then its MerkleTree, then
@@ -73,6 +99,92 @@ class TestMerkleTree2(unittest.TestCase):
         for hashtype in HashTypes:
             self.do_test_deepish_trees(hashtype)
 
+    def do_test_parallel_build(self, hashtype):
+        """
+        Build the same MerkleTree serially and using a pool of workers,
+        verifying that the two are identical.
+        """
+        tree_top = os.path.join('tmp', self.rng.next_file_name(MAX_NAME_LEN))
+        while os.path.exists(tree_top):
+            tree_top = os.path.join(
+                'tmp', self.rng.next_file_name(MAX_NAME_LEN))
+        self.rng.next_data_dir(tree_top, depth=5, width=6, max_len=4096)
+
+        tree = MerkleTree.create_from_file_system(tree_top, hashtype)
+        for workers in [2, 8]:
+            tree2 = MerkleTree.create_from_file_system(
+                tree_top, hashtype, workers=workers)
+            self.assertEqual(tree2.bin_hash, tree.bin_hash)
+            self.assertEqual(tree2, tree)
+            self.assertEqual(tree2.to_string(0), tree.to_string(0))
+
+    def test_parallel_build(self):
+        """ Test building trees in parallel using various hash types. """
+
+        for hashtype in HashTypes:
+            self.do_test_parallel_build(hashtype)
+
+    def test_very_deep_tree(self):
+        """
+        Verify that a directory structure nested more deeply than the
+        recursion limit can be merkleized.  The tree is built outside
+        the repository, where a later collection of tests would recurse
+        into it.
+        """
+        tree_top = tempfile.mkdtemp()
+        try:
+            depth = sys.getrecursionlimit() + 16
+            path = tree_top
+            for _ in range(depth):      # os.makedirs() itself recurses
+                path = os.path.join(path, 'd')
+                os.mkdir(path)
+            data = self.rng.some_bytes(64)
+            with open(os.path.join(path, 'leaf'), 'wb') as file:
+                file.write(data)
+
+            tree = MerkleTree.create_from_file_system(tree_top,
+                                                      HashTypes.SHA2)
+        finally:
+            self.remove_tree(tree_top)
+
+        sha = get_hash_func(HashTypes.SHA2)
+        sha.update(data)
+        expected = sha.digest()
+        for _ in range(depth + 1):
+            sha = get_hash_func(HashTypes.SHA2)
+            sha.update(expected)
+            expected = sha.digest()
+        self.assertEqual(expected, tree.bin_hash)
+
+        node = tree
+        for _ in range(depth):
+            self.assertEqual(1, len(node.nodes))
+            node = node.nodes[0]
+            self.assertEqual('d', node.name)
+        self.assertTrue(isinstance(node.nodes[0], MerkleLeaf))
+
+    def test_symlinks(self):
+        """
+        Symbolic links to files are followed, but symbolic links to
+        directories are ignored, as are dangling links.
+        """
+        tree_top = os.path.join('tmp', self.rng.next_file_name(MAX_NAME_LEN))
+        while os.path.exists(tree_top):
+            tree_top = os.path.join(
+                'tmp', self.rng.next_file_name(MAX_NAME_LEN))
+        os.makedirs(os.path.join(tree_top, 'sub'))
+        with open(os.path.join(tree_top, 'sub', 'data'), 'wb') as file:
+            file.write(self.rng.some_bytes(64))
+        os.symlink('sub/data', os.path.join(tree_top, 'a_file_link'))
+        os.symlink('sub', os.path.join(tree_top, 'b_dir_link'))
+        os.symlink('nowhere', os.path.join(tree_top, 'c_dangling'))
+
+        tree = MerkleTree.create_from_file_system(tree_top, HashTypes.SHA2)
+        self.assertEqual(['a_file_link', 'sub'],
+                         [node.name for node in tree.nodes])
+        self.assertEqual(tree.nodes[0].bin_hash,
+                         tree.nodes[1].nodes[0].bin_hash)
+
 
 if __name__ == '__main__':
     unittest.main()
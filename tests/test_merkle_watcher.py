@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# test_merkle_watcher.py
+
+""" Test keeping a MerkleTree current with MerkleWatcher. """
+
+import os
+import shutil
+import sys
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlutil import make_ex_re
+from merkletree import MerkleTree
+from merkletree.watcher import MerkleWatcher
+from helpers import make_mixed_dir, write_file
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+class TestMerkleWatcher(unittest.TestCase):
+    """ Test keeping a MerkleTree current with MerkleWatcher. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    def settle(self, watcher):
+        """ Apply events until there are no more. """
+        while watcher.poll(0.05):
+            pass
+
+    def check(self, watcher, top, hashtype, ex_re=None):
+        """ Verify that the watcher's tree is what a new build gives. """
+        self.settle(watcher)
+        tree = MerkleTree.create_from_file_system(top, hashtype, ex_re)
+        self.assertEqual(tree, watcher.tree)
+        self.assertEqual(tree.bin_hash, watcher.bin_hash)
+        self.assertEqual(tree.hex_hash, watcher.hex_hash)
+
+    # actual unit tests #############################################
+
+    def do_test_changes(self, hashtype):
+        """ Follow a series of changes to a directory tree. """
+        top = make_mixed_dir(self.rng)
+        with MerkleWatcher(top, hashtype, debounce=0.02) as watcher:
+            self.check(watcher, top, hashtype)
+            self.assertFalse(watcher.poll(0))
+
+            write_file(self.rng, os.path.join(top, 'a', 'f1'))      # modify
+            self.check(watcher, top, hashtype)
+            write_file(self.rng, os.path.join(top, 'a', 'f0'))      # add
+            os.unlink(os.path.join(top, 'b', 'c', 'f1'))            # remove
+            self.check(watcher, top, hashtype)
+
+            # a new directory, filled before its events are read
+            os.makedirs(os.path.join(top, 'd', 'e'))
+            write_file(self.rng, os.path.join(top, 'd', 'e', 'f2'))
+            self.check(watcher, top, hashtype)
+            # and inside it
+            write_file(self.rng, os.path.join(top, 'd', 'e', 'f3'))
+            self.check(watcher, top, hashtype)
+
+            os.rename(os.path.join(top, 'd'), os.path.join(top, 'b', 'd'))
+            self.check(watcher, top, hashtype)
+            write_file(self.rng, os.path.join(top, 'b', 'd', 'e', 'f2'))
+            self.check(watcher, top, hashtype)
+
+            shutil.rmtree(os.path.join(top, 'b'))
+            write_file(self.rng, os.path.join(top, 'b'))        # dir to file
+            self.check(watcher, top, hashtype)
+            os.unlink(os.path.join(top, 'a', 'f0'))             # file to dir
+            os.mkdir(os.path.join(top, 'a', 'f0'))
+            write_file(self.rng, os.path.join(top, 'a', 'f0', 'g'))
+            self.check(watcher, top, hashtype)
+
+            # everything gone, then back again
+            for name in os.listdir(top):
+                path = os.path.join(top, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+            self.check(watcher, top, hashtype)
+            self.assertIsNone(watcher.bin_hash)
+            write_file(self.rng, os.path.join(top, 'new'))
+            self.check(watcher, top, hashtype)
+
+    def test_changes(self):
+        """ Follow changes to trees using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_changes(hashtype)
+
+    def test_storm(self):
+        """ A storm of events is applied as one batch. """
+        top = make_mixed_dir(self.rng)
+        path = os.path.join(top, 'a', 'f1')
+        with MerkleWatcher(top, debounce=0.05) as watcher:
+            for _ in range(200):
+                with open(path, 'ab') as file:
+                    file.write(self.rng.some_bytes(16))
+            self.assertTrue(watcher.poll(1))
+            self.assertFalse(watcher.poll(0.1))
+            self.check(watcher, top, HashTypes.SHA2)
+
+    def test_large_directory(self):
+        """
+        A batch of files created between those already in a large
+        directory is put in place without rebuilding its name index.
+        """
+        # pylint: disable=protected-access
+        top = make_mixed_dir(self.rng)
+        big = os.path.join(top, 'big')
+        os.mkdir(big)
+        for ndx in range(0, 8000, 2):
+            write_file(self.rng, os.path.join(big, 'f%04d' % ndx), 16)
+        with MerkleWatcher(top, debounce=0.05) as watcher:
+            tree = watcher.tree['big']
+            self.assertIn('f0000', tree)            # builds the index
+            (index, names) = (tree._index, tree._names)
+            for ndx in range(7999, 0, -8):
+                write_file(self.rng, os.path.join(big, 'f%04d' % ndx), 16)
+            self.check(watcher, top, HashTypes.SHA2)
+            self.assertIs(tree, watcher.tree['big'])
+            self.assertIs(index, tree._index)
+            self.assertIs(names, tree._names)
+            self.assertEqual(5000, len(tree.nodes))
+
+    def test_overflow(self):
+        """ After an overflow, only changed files are rehashed. """
+        top = make_mixed_dir(self.rng)
+        with MerkleWatcher(top, workers=3) as watcher:
+            before = watcher.tree['a/f1']
+            changed = watcher.tree['b/c/f1']
+            write_file(self.rng, os.path.join(top, 'b', 'c', 'f1'))
+            os.mkdir(os.path.join(top, 'b', 'x'))
+            write_file(self.rng, os.path.join(top, 'b', 'x', 'y'))
+            watcher.rescan()
+            self.assertIs(before, watcher.tree['a/f1'])
+            self.assertIsNot(changed, watcher.tree['b/c/f1'])
+            self.check(watcher, top, HashTypes.SHA2)
+
+    def test_background(self):
+        """ Apply changes in a thread, honouring exclusions. """
+        top = make_mixed_dir(self.rng)
+        ex_re = make_ex_re(['*.o'])
+        watcher = MerkleWatcher(top, ex_re=ex_re, debounce=0.02)
+        try:
+            watcher.start()
+            with self.assertRaises(RuntimeError):
+                watcher.start()
+            hash_ = watcher.bin_hash
+            write_file(self.rng, os.path.join(top, 'a', 'junk.o'))
+            write_file(self.rng, os.path.join(top, 'a', 'f1'))
+            deadline = time.monotonic() + 10
+            while watcher.bin_hash == hash_ and time.monotonic() < deadline:
+                time.sleep(0.01)
+            watcher.stop()
+            self.check(watcher, top, HashTypes.SHA2, ex_re)
+            self.assertNotIn('a/junk.o', watcher.tree)
+        finally:
+            watcher.close()
+        with self.assertRaises(RuntimeError):
+            MerkleWatcher(top + '-not-there')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# test_sharded_build.py
+
+""" Test building MerkleTrees in several processes. """
+
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlutil import make_ex_re
+from merkletree import MerkleDoc, MerkleTree
+from merkletree.sharded import create_sharded
+from merkletree.stats import BuildStats
+from helpers import make_data_dir, unique_path, write_file
+
+
+class TestShardedBuild(unittest.TestCase):
+    """ Test building MerkleTrees in several processes. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    # utility functions #############################################
+
+    def make_sharded_dir(self):
+        """
+        Create a quasi-random directory tree under tmp/, with a flat
+        directory holding many files, an empty directory, and a file
+        big enough to be hashed in chunks.
+        """
+        top = unique_path(self.rng)
+        make_data_dir(self.rng, 4, 4, path=os.path.join(top, 'r'))
+        os.makedirs(os.path.join(top, 'flat'))
+        for ndx in range(37):
+            write_file(self.rng, os.path.join(top, 'flat', 'f%02d' % ndx), 64)
+        write_file(self.rng, os.path.join(top, 'flat', 'junk.o'), 64)
+        os.makedirs(os.path.join(top, 'r', 'empty'))
+        write_file(self.rng, os.path.join(top, 'big'), 9000)
+        write_file(self.rng, os.path.join(top, 'top_file'), 100)
+        return top
+
+    # actual unit tests #############################################
+
+    def do_test_sharded(self, hashtype):
+        """
+        Build the same trees serially and in shares small enough that
+        subtrees and the flat directory are split up.
+        """
+        top = self.make_sharded_dir()
+        ex_re = make_ex_re(['*.o'])
+        serial = MerkleTree.create_from_file_system(top, hashtype, ex_re,
+                                                    chunk_bits=12)
+        serial_stats = BuildStats()
+        MerkleTree.create_from_file_system(top, hashtype, ex_re,
+                                           stats=serial_stats, chunk_bits=12)
+        for (files, size) in [(5, 1 << 30), (1000, 1000), (1000, 1 << 30)]:
+            stats = BuildStats()
+            tree = create_sharded(top, hashtype, ex_re, None, 3, stats, 12,
+                                  files, size)
+            self.assertEqual(serial, tree)
+            self.assertEqual(serial.bin_hash, tree.bin_hash)
+            self.assertEqual(serial.to_string(), tree.to_string())
+            self.assertEqual(serial.to_bytes(), tree.to_bytes())
+            for name in ['dirs', 'files', 'bytes_read', 'excluded']:
+                self.assertEqual(getattr(serial_stats, name),
+                                 getattr(stats, name))
+            self.assertNotIn('flat/junk.o', tree)
+
+    def test_sharded(self):
+        """ Build trees in shares using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_sharded(hashtype)
+
+    def test_create_from_file_system(self):
+        """ Build MerkleTrees and MerkleDocs with processes set. """
+        top = self.make_sharded_dir()
+        tree = MerkleTree.create_from_file_system(top, processes=2)
+        self.assertEqual(MerkleTree.create_from_file_system(top), tree)
+        stats = BuildStats()
+        doc = MerkleDoc.create_from_file_system(
+            top, exclusions=['*.o'], stats=stats, processes=2)
+        self.assertEqual(MerkleDoc.create_from_file_system(
+            top, exclusions=['*.o']), doc)
+        self.assertIn('build', stats.phases)
+        with self.assertRaises(RuntimeError):
+            MerkleTree.create_from_file_system(top, processes=2,
+                                               cache=object())
+        with self.assertRaises(RuntimeError):
+            create_sharded(top + '-not-there')
+        with self.assertRaises(RuntimeError):
+            create_sharded(top, shard_files=0)
+
+
+if __name__ == '__main__':
+    unittest.main()